@@ -0,0 +1,87 @@
+"""
+Mode digest des notifications administrateur
+
+Quand ADMIN_DIGEST_MODE=on, les notifications destinées à ADMIN_EMAIL (nouvelle
+réservation, commentaire, message de contact, bon cadeau) ne sont plus envoyées
+une par une : elles sont stockées dans la collection "adminDigest" puis envoyées
+en un seul email récapitulatif par la fonction planifiée send_admin_digest (main.py).
+Le quota et le débit Resend restent ainsi disponibles pour les emails clients.
+
+Même sans ADMIN_DIGEST_MODE, une notification passe par le récapitulatif quand
+le budget d'envoi restant est réservé aux emails clients (send_budget.py).
+
+Configuration :
+- ADMIN_DIGEST_MODE : "on" pour activer le digest ("off" par défaut)
+- ADMIN_DIGEST_URGENT_TYPES : types envoyés immédiatement malgré le digest,
+  séparés par des virgules (ex: "booking_admin,contact_admin")
+- ADMIN_DIGEST_SCHEDULE : fréquence d'envoi du récapitulatif ("every 60 minutes")
+- ADMIN_DIGEST_MAX_ITEMS : nombre maximum de notifications par récapitulatif (200)
+"""
+
+import os
+from typing import Any
+
+from firebase_admin import firestore
+
+import metrics
+import send_budget
+from structured_logging import get_logger
+
+logger = get_logger("admin_digest")
+
+ADMIN_DIGEST_COLLECTION = "adminDigest"
+ADMIN_DIGEST_MODE = os.environ.get("ADMIN_DIGEST_MODE", "off").lower() in ("on", "true", "1")
+ADMIN_DIGEST_URGENT_TYPES = frozenset(
+    t.strip() for t in os.environ.get("ADMIN_DIGEST_URGENT_TYPES", "").split(",") if t.strip()
+)
+ADMIN_DIGEST_SCHEDULE = os.environ.get("ADMIN_DIGEST_SCHEDULE", "every 60 minutes")
+ADMIN_DIGEST_MAX_ITEMS = int(os.environ.get("ADMIN_DIGEST_MAX_ITEMS", "200"))
+
+
+def should_digest(notification_type: str) -> bool:
+    """Indique si une notification admin doit attendre le prochain récapitulatif"""
+    if ADMIN_DIGEST_MODE and notification_type not in ADMIN_DIGEST_URGENT_TYPES:
+        return True
+    if not send_budget.allows(notification_type):
+        metrics.inc("admin_notifications_budget_held_total", type=notification_type)
+        return True
+    return False
+
+
+def queue_notification(notification_type: str, subject: str, summary: dict[str, str]) -> str:
+    """
+    Ajoute une notification au prochain récapitulatif, retourne l'ID du document
+    `summary` contient les champs affichés dans le récapitulatif (libellé -> valeur)
+    """
+    doc_ref = firestore.client().collection(ADMIN_DIGEST_COLLECTION).document()
+    doc_ref.set({
+        "type": notification_type,
+        "subject": subject,
+        "summary": summary,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    })
+    metrics.inc("admin_notifications_digested_total", type=notification_type)
+    logger.info("Notification %s ajoutée au récapitulatif admin: %s", notification_type, doc_ref.id)
+    return doc_ref.id
+
+
+def pending_notifications(limit: int = ADMIN_DIGEST_MAX_ITEMS) -> list[Any]:
+    """Notifications en attente, de la plus ancienne à la plus récente"""
+    docs = list(
+        firestore.client().collection(ADMIN_DIGEST_COLLECTION)
+        .order_by("createdAt")
+        .limit(limit)
+        .stream()
+    )
+    metrics.count_reads(len(docs))
+    return docs
+
+
+def clear_notifications(docs: list[Any]) -> None:
+    """Supprime les notifications incluses dans un récapitulatif envoyé (batchs de 500)"""
+    db = firestore.client()
+    for start in range(0, len(docs), 500):
+        batch = db.batch()
+        for doc in docs[start:start + 500]:
+            batch.delete(doc.reference)
+        batch.commit()
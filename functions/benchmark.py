@@ -0,0 +1,1130 @@
+"""
+Benchmark local des Cloud Functions contre un Firestore et un Resend en mémoire
+
+Chaque fonction est invoquée avec des événements synthétiques, sans accès
+réseau. Le mode mémoire (MEMORY_PROFILE) est activé et le rapport de
+profiling.py recommande un palier de mémoire par fonction.
+
+Usage:
+    python benchmark.py memory --iterations 20 --customers 5000
+    python benchmark.py stress --threads 16 --iterations 20
+    python benchmark.py email-sizes [--budget 16384]
+    python benchmark.py checks
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Iterator
+
+# time.sleep est neutralisé par load_main (attentes de rate limit) ; la latence simulée de Resend l'utilise
+_real_sleep = time.sleep
+
+
+# ---------------------------------------------------------------------------
+# Faux Firestore (sous-ensemble de l'API utilisé par main.py)
+# ---------------------------------------------------------------------------
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocumentRef", data: dict | None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self) -> bool:
+        return self._data is not None
+
+    def to_dict(self) -> dict | None:
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field: str) -> Any:
+        """Comme DocumentSnapshot.get : None si le document n'existe pas, KeyError si le champ est absent"""
+        if self._data is None:
+            return None
+        value: Any = self._data
+        for part in field.split("."):
+            if not isinstance(value, dict) or part not in value:
+                raise KeyError(f"'{field}' is not contained in the data")
+            value = value[part]
+        return value
+
+
+def _deep_merge(target: dict, data: dict) -> None:
+    """set(..., merge=True) de Firestore : les maps imbriquées sont fusionnées"""
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _resolve_values(data: dict, current: dict) -> dict:
+    """Remplace SERVER_TIMESTAMP et Increment (y compris dans les maps imbriquées)"""
+    from firebase_admin import firestore
+
+    resolved = {}
+    for key, value in data.items():
+        previous: Any = current
+        for part in key.split("."):
+            previous = previous.get(part) if isinstance(previous, dict) else None
+        if value is firestore.SERVER_TIMESTAMP:
+            value = datetime.now(timezone.utc)
+        elif isinstance(value, firestore.Increment):
+            value = (previous or 0) + value.value
+        elif isinstance(value, dict):
+            value = _resolve_values(value, previous if isinstance(previous, dict) else {})
+        resolved[key] = value
+    return resolved
+
+
+class FakeDocumentRef:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    @property
+    def parent(self) -> "FakeCollection":
+        return FakeCollection(self._db, self.path.rsplit("/", 1)[0])
+
+    def _resolve(self, data: dict) -> dict:
+        return _resolve_values(data, self._db.documents.get(self.path) or {})
+
+    def get(self, *args: Any, **kwargs: Any) -> FakeSnapshot:
+        with self._db.lock:
+            data = self._db.documents.get(self.path)
+            return FakeSnapshot(self, dict(data) if data is not None else None)
+
+    def set(self, data: dict, merge: bool = False) -> None:
+        with self._db.lock:
+            if merge and self.path in self._db.documents:
+                _deep_merge(self._db.documents[self.path], self._resolve(data))
+            else:
+                self._db.documents[self.path] = self._resolve(data)
+
+    def create(self, data: dict) -> None:
+        with self._db.lock:
+            if self.path in self._db.documents:
+                raise ValueError(f"Document {self.path} already exists")
+            self._db.documents[self.path] = self._resolve(data)
+
+    def update(self, data: dict) -> None:
+        with self._db.lock:
+            if self.path not in self._db.documents:
+                raise KeyError(f"Document {self.path} not found")
+            document = self._db.documents[self.path]
+            for key, value in self._resolve(data).items():
+                # Chemins "a.b" : mise à jour d'un champ imbriqué, comme Firestore
+                *parents, leaf = key.split(".")
+                target = document
+                for part in parents:
+                    target = target.setdefault(part, {})
+                target[leaf] = value
+
+    def delete(self) -> None:
+        with self._db.lock:
+            self._db.documents.pop(self.path, None)
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+
+class FakeQuery:
+    _OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+        "==": lambda a, b: a == b,
+        "!=": lambda a, b: a != b,
+        "<": lambda a, b: a is not None and a < b,
+        "<=": lambda a, b: a is not None and a <= b,
+        ">": lambda a, b: a is not None and a > b,
+        ">=": lambda a, b: a is not None and a >= b,
+        "in": lambda a, b: a in b,
+        "array_contains": lambda a, b: isinstance(a, list) and b in a,
+        "array_contains_any": lambda a, b: isinstance(a, list) and any(x in a for x in b),
+    }
+
+    def __init__(self, db: "FakeFirestore", path: str, filters: tuple = (), orders: tuple = (),
+                 limit_count: int | None = None, start_after_values: tuple | None = None):
+        self._db = db
+        self._path = path
+        self._filters = filters
+        self._orders = orders
+        self._limit = limit_count
+        self._start_after = start_after_values
+
+    def _copy(self, **changes: Any) -> "FakeQuery":
+        params = {
+            "filters": self._filters, "orders": self._orders,
+            "limit_count": self._limit, "start_after_values": self._start_after,
+        }
+        params.update(changes)
+        return FakeQuery(self._db, self._path, **params)
+
+    def where(self, field: str | None = None, op: str | None = None, value: Any = None, *, filter: Any = None) -> "FakeQuery":
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field, op, value),))
+
+    def order_by(self, field: str, direction: str = "ASCENDING") -> "FakeQuery":
+        return self._copy(orders=self._orders + ((field, direction),))
+
+    def limit(self, count: int) -> "FakeQuery":
+        return self._copy(limit_count=count)
+
+    def select(self, fields: list[str]) -> "FakeQuery":
+        return self
+
+    def start_after(self, snapshot_or_values: Any) -> "FakeQuery":
+        if isinstance(snapshot_or_values, FakeSnapshot):
+            values = tuple(
+                snapshot_or_values.id if field == "__name__" else snapshot_or_values.get(field)
+                for field, _ in self._orders
+            )
+        elif isinstance(snapshot_or_values, dict):
+            values = tuple(snapshot_or_values.get(field) for field, _ in self._orders)
+        else:
+            values = tuple(snapshot_or_values)
+        return self._copy(start_after_values=values)
+
+    def stream(self, *args: Any, **kwargs: Any):
+        prefix = self._path + "/"
+        with self._db.lock:
+            rows = [
+                (path, dict(data)) for path, data in self._db.documents.items()
+                if path.startswith(prefix) and "/" not in path[len(prefix):]
+            ]
+        def value(path: str, data: dict, field: str) -> Any:
+            # "__name__" : filtre, tri et curseur sur l'ID du document
+            return path.rsplit("/", 1)[-1] if field == "__name__" else data.get(field)
+
+        for field, op, expected in self._filters:
+            if field == "__name__" and isinstance(expected, FakeDocumentRef):
+                expected = expected.id
+            rows = [(p, d) for p, d in rows if self._OPERATORS[op](value(p, d, field), expected)]
+
+        for field, direction in reversed(self._orders):
+            rows.sort(key=lambda row: (value(*row, field) is None, value(*row, field)), reverse=direction == "DESCENDING")
+        if self._start_after is not None:
+            keys = [tuple(value(p, d, f) for f, _ in self._orders) for p, d in rows]
+            rows = [row for row, key in zip(rows, keys) if key > self._start_after]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for path, data in rows:
+            yield FakeSnapshot(FakeDocumentRef(self._db, path), data)
+
+    def get(self, *args: Any, **kwargs: Any) -> list[FakeSnapshot]:
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db: "FakeFirestore", path: str):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: str | None = None) -> FakeDocumentRef:
+        return FakeDocumentRef(self._db, f"{self._path}/{document_id or uuid.uuid4().hex[:20]}")
+
+
+class FakeCollectionGroup:
+    """Sous-ensemble de CollectionGroup : get_partitions découpe aux ID répartis uniformément"""
+
+    def __init__(self, db: "FakeFirestore", name: str):
+        self._db = db
+        self._name = name
+
+    def get_partitions(self, partition_count: int) -> Iterator[SimpleNamespace]:
+        with self._db.lock:
+            paths = sorted(path for path in self._db.documents
+                           if path.rsplit("/", 2)[-2:-1] == [self._name] and path.count("/") % 2 == 1)
+        points = sorted({paths[len(paths) * i // partition_count] for i in range(1, partition_count)} if paths else set())
+        start_at = None
+        for path in points:
+            end_at = FakeDocumentRef(self._db, path)
+            yield SimpleNamespace(start_at=start_at, end_at=end_at)
+            start_at = end_at
+        yield SimpleNamespace(start_at=start_at, end_at=None)
+
+
+class FakeBatch:
+    def __init__(self) -> None:
+        self._operations: list[Callable[[], None]] = []
+
+    def set(self, ref: FakeDocumentRef, data: dict, merge: bool = False) -> None:
+        self._operations.append(lambda: ref.set(data, merge=merge))
+
+    def update(self, ref: FakeDocumentRef, data: dict) -> None:
+        self._operations.append(lambda: ref.update(data))
+
+    def delete(self, ref: FakeDocumentRef) -> None:
+        self._operations.append(ref.delete)
+
+    def commit(self) -> None:
+        for operation in self._operations:
+            operation()
+        self._operations = []
+
+
+class FakeBulkWriter(FakeBatch):
+    """
+    Les écritures sont appliquées à flush() / close() ; une écriture refusée est
+    passée au callback on_write_error (code gRPC comme BulkWriteFailure), qui
+    décide d'un nouvel essai
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._on_error: Callable | None = None
+        self._references: list[FakeDocumentRef] = []
+
+    def on_write_error(self, callback: Callable | None) -> None:
+        self._on_error = callback
+
+    def set(self, ref: FakeDocumentRef, data: dict, merge: bool = False) -> None:
+        super().set(ref, data, merge=merge)
+        self._references.append(ref)
+
+    def update(self, ref: FakeDocumentRef, data: dict) -> None:
+        super().update(ref, data)
+        self._references.append(ref)
+
+    def delete(self, ref: FakeDocumentRef) -> None:
+        super().delete(ref)
+        self._references.append(ref)
+
+    def create(self, ref: FakeDocumentRef, data: dict) -> None:
+        self._operations.append(lambda: ref.create(data))
+        self._references.append(ref)
+
+    def commit(self) -> None:
+        operations = list(zip(self._operations, self._references))
+        self._operations, self._references = [], []
+        for operation, ref in operations:
+            attempts = 0
+            while True:
+                try:
+                    operation()
+                    break
+                except Exception as e:
+                    if self._on_error is None:
+                        raise
+                    # 6 = ALREADY_EXISTS, 5 = NOT_FOUND, 13 = INTERNAL
+                    code = 6 if isinstance(e, ValueError) else 5 if isinstance(e, KeyError) else 13
+                    failure = SimpleNamespace(operation=SimpleNamespace(reference=ref), attempts=attempts,
+                                              code=code, message=str(e))
+                    if not self._on_error(failure, self):
+                        break
+                    attempts += 1
+
+    def flush(self) -> None:
+        self.commit()
+
+    def close(self) -> None:
+        self.commit()
+
+
+class FakeTransaction(FakeBatch):
+    """
+    Transaction pour firestore.transactional : le verrou de la base est tenu
+    de _begin à _commit, les transactions concurrentes sont donc sérialisées
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db: "FakeFirestore") -> None:
+        super().__init__()
+        self._db = db
+        self._id = None
+
+    def create(self, ref: FakeDocumentRef, data: dict) -> None:
+        self._operations.append(lambda: ref.create(data))
+
+    def _clean_up(self) -> None:
+        self._operations = []
+        self._id = None
+
+    def _begin(self, retry_id: Any = None) -> None:
+        self._db.lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self) -> list:
+        try:
+            self.commit()
+        finally:
+            self._id = None
+            self._db.lock.release()
+        return []
+
+    def _rollback(self) -> None:
+        if self._id is not None:
+            self._clean_up()
+            self._db.lock.release()
+
+
+class FakeFirestore:
+    def __init__(self) -> None:
+        import threading
+
+        self.lock = threading.RLock()
+        self.documents: dict[str, dict] = {}
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def document(self, path: str) -> FakeDocumentRef:
+        return FakeDocumentRef(self, path)
+
+    def batch(self) -> FakeBatch:
+        return FakeBatch()
+
+    def transaction(self, *args: Any, **kwargs: Any) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def collection_group(self, name: str) -> "FakeCollectionGroup":
+        return FakeCollectionGroup(self, name)
+
+    def bulk_writer(self, *args: Any, **kwargs: Any) -> FakeBulkWriter:
+        return FakeBulkWriter()
+
+    def get_all(self, references: list[FakeDocumentRef], *args: Any, **kwargs: Any):
+        for reference in references:
+            yield reference.get()
+
+
+class FakeResend:
+    """Remplace resend.Emails.send : enregistre les emails au lieu de les envoyer"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: list[dict] = []
+
+    def send(self, params: dict) -> dict:
+        if self.latency:
+            _real_sleep(self.latency)
+        self.sent.append(params)
+        return {"id": uuid.uuid4().hex}
+
+    def send_batch(self, params: list[dict], options: Any = None) -> dict:
+        """Remplace resend.Batch.send : un seul appel pour toute la liste"""
+        if self.latency:
+            _real_sleep(self.latency)
+        self.sent.extend(params)
+        return {"data": [{"id": uuid.uuid4().hex} for _ in params]}
+
+
+# ---------------------------------------------------------------------------
+# Événements synthétiques
+# ---------------------------------------------------------------------------
+
+class FakeChange:
+    def __init__(self, before: FakeSnapshot | None, after: FakeSnapshot | None):
+        self.before = before
+        self.after = after
+
+
+class FakeEvent:
+    def __init__(self, data: Any, params: dict[str, str]):
+        self.data = data
+        self.params = params
+        self.id = uuid.uuid4().hex
+
+
+def _snapshot(db: FakeFirestore, path: str, data: dict | None) -> FakeSnapshot:
+    return FakeSnapshot(FakeDocumentRef(db, path), data)
+
+
+def created_event(db: FakeFirestore, collection: str, document_id: str, data: dict, param: str) -> FakeEvent:
+    db.documents[f"{collection}/{document_id}"] = dict(data)
+    return FakeEvent(_snapshot(db, f"{collection}/{document_id}", data), {param: document_id})
+
+
+def updated_event(db: FakeFirestore, collection: str, document_id: str, before: dict, after: dict, param: str) -> FakeEvent:
+    path = f"{collection}/{document_id}"
+    db.documents[path] = dict(after)
+    return FakeEvent(FakeChange(_snapshot(db, path, before), _snapshot(db, path, after)), {param: document_id})
+
+
+def sample_booking(index: int, status: str = "en_attente") -> dict:
+    return {
+        "name": f"Client {index}",
+        "email": f"client{index}@example.com",
+        "phone": "0600000000",
+        "date": datetime.now(timezone.utc) + timedelta(days=1 + index % 30),
+        "time": "10:00",
+        "massageType": "cocooning_60",
+        "serviceType": "massage",
+        "status": status,
+        "notes": "Première visite",
+        "isAtHome": index % 3 == 0,
+        "homeAddress": "1 rue de la Paix, Strasbourg",
+    }
+
+
+def sample_voucher(index: int, status: str = "paid") -> dict:
+    return {
+        "purchaserName": f"Acheteur {index}",
+        "purchaserEmail": f"buyer{index}@example.com",
+        "recipientName": f"Destinataire {index}",
+        "recipientEmail": f"recipient{index}@example.com",
+        "amount": 85.0,
+        "message": "Joyeux anniversaire !",
+        "status": status,
+        "createdAt": datetime.now(timezone.utc),
+        "paidAt": datetime.now(timezone.utc),
+        "paypalOrderId": "ORDER123",
+        "expiresAt": datetime.now(timezone.utc) + timedelta(days=365),
+    }
+
+
+def seed_catalog(db: FakeFirestore, customers: int) -> None:
+    """Catalogue minimal et `customers` clients ayant réservé le massage "cocooning" """
+    db.documents["massages/cocooning"] = {"name": "Cocooning", "order": 1}
+    db.documents["treatments/facial"] = {"name": "Soin visage", "order": 1}
+    for i in range(customers):
+        db.documents[f"customers/client{i}@example.com"] = {
+            "email": f"client{i}@example.com",
+            "name": f"Client {i}",
+            "phone": "0600000000",
+            "massageTypes": ["cocooning"],
+            "massageTypesNames": ["Cocooning"],
+            "treatmentTypes": [],
+            "treatmentTypesNames": [],
+        }
+
+
+def build_scenarios(main: Any, db: FakeFirestore) -> dict[str, Callable[[int], None]]:
+    """Retourne {nom de fonction: invocation(i)} pour chaque trigger benchmarké"""
+
+    def handler(function: Callable) -> Callable:
+        # Retirer le décorateur Firebase (fonction déployée séparément) pour appeler la fonction instrumentée
+        if hasattr(function, "__firebase_endpoint__"):
+            return function.__wrapped__
+        return function
+
+    def booking_created(i: int) -> None:
+        handler(main.send_booking_email)(created_event(db, "bookings", f"b{i}", sample_booking(i), "bookingId"))
+
+    def booking_updated(i: int) -> None:
+        before = sample_booking(i)
+        after = {**before, "status": "confirmed"}
+        handler(main.send_booking_status_email)(updated_event(db, "bookings", f"b{i}", before, after, "bookingId"))
+
+    def review_created(i: int) -> None:
+        review = {"prenom": "Marie", "name": "D.", "rating": 5, "comment": "Super massage " * 20,
+                  "approved": False, "createdAt": datetime.now()}
+        handler(main.send_review_notification_email)(created_event(db, "reviews", f"r{i}", review, "reviewId"))
+
+    def voucher_created(i: int) -> None:
+        handler(main.send_voucher_emails_on_create)(created_event(db, "giftVouchers", f"v{i}", sample_voucher(i), "voucherId"))
+
+    def voucher_updated(i: int) -> None:
+        before = sample_voucher(i, "pending")
+        after = sample_voucher(i, "paid")
+        handler(main.send_voucher_emails)(updated_event(db, "giftVouchers", f"v{i}", before, after, "voucherId"))
+
+    def contact_created(i: int) -> None:
+        contact = {"name": f"Contact {i}", "email": f"contact{i}@example.com", "contactMethod": "email",
+                   "message": "Bonjour, " * 50, "createdAt": datetime.now(), "answered": False}
+        handler(main.send_contact_message_email)(created_event(db, "contactMessages", f"c{i}", contact, "contactId"))
+
+    def contact_answered(i: int) -> None:
+        before = {"name": f"Contact {i}", "email": f"contact{i}@example.com", "contactMethod": "email",
+                  "message": "Bonjour, " * 50, "answered": False}
+        after = {**before, "answered": True, "answer": "Merci pour votre message. " * 20}
+        handler(main.send_contact_answer_email)(updated_event(db, "contactMessages", f"c{i}", before, after, "contactId"))
+
+    def massage_renamed(i: int) -> None:
+        before = {"name": f"Cocooning {i}", "order": 1}
+        after = {"name": f"Cocooning {i + 1}", "order": 1}
+        handler(main.update_customer_massage_names)(updated_event(db, "massages", "cocooning", before, after, "massageId"))
+
+    def massage_reordered(i: int) -> None:
+        # Réordonnancement du catalogue : seul le champ order change
+        before = {"name": "Cocooning", "order": i}
+        after = {"name": "Cocooning", "order": i + 1}
+        handler(main.update_customer_massage_names)(updated_event(db, "massages", "cocooning", before, after, "massageId"))
+
+    def contact_read(i: int) -> None:
+        before = {"name": f"Contact {i}", "email": f"contact{i}@example.com", "contactMethod": "email",
+                  "message": "Bonjour, " * 50, "answered": False, "read": False}
+        after = {**before, "read": True}
+        handler(main.send_contact_answer_email)(updated_event(db, "contactMessages", f"c{i}", before, after, "contactId"))
+
+    def reminders_sent(i: int) -> None:
+        # 200 réservations confirmées dans les prochaines heures, réparties sur deux jours
+        start = datetime.now(main.BUSINESS_TIMEZONE) + timedelta(hours=1)
+        for j in range(200):
+            booking_start = start + timedelta(minutes=5 * j)
+            day = booking_start.replace(hour=0, minute=0, second=0, microsecond=0)
+            db.documents[f"bookings/reminder_{i}_{j}"] = {
+                **sample_booking(j, "confirmed"),
+                "date": day.astimezone(timezone.utc),
+                "time": booking_start.strftime("%H:%M"),
+            }
+        handler(main.send_booking_reminders)(None)
+
+    def vouchers_swept(i: int) -> None:
+        # 500 bons payés expirés (plus de deux pages) et 50 bons valides
+        now = datetime.now(timezone.utc)
+        for j in range(550):
+            days = -1 - j % 300 if j < 500 else 10 + j
+            db.documents[f"giftVouchers/sweep_{i}_{j}"] = {**sample_voucher(j), "expiresAt": now + timedelta(days=days)}
+        handler(main.sweep_gift_vouchers)(None)
+
+    return {
+        "send_booking_email": booking_created,
+        "send_booking_status_email": booking_updated,
+        "send_review_notification_email": review_created,
+        "send_voucher_emails_on_create": voucher_created,
+        "send_voucher_emails": voucher_updated,
+        "send_contact_message_email": contact_created,
+        "send_contact_answer_email": contact_answered,
+        "update_customer_massage_names": massage_renamed,
+        "update_customer_massage_names (order)": massage_reordered,
+        "send_contact_answer_email (read)": contact_read,
+        "send_booking_reminders": reminders_sent,
+        "sweep_gift_vouchers": vouchers_swept,
+    }
+
+
+def load_main(db: FakeFirestore, resend_fake: FakeResend) -> Any:
+    """Importe main.py avec Firestore et Resend remplacés par les faux en mémoire"""
+    os.environ.setdefault("RESEND_API_KEY", "re_benchmark")
+    os.environ.setdefault("METRICS_SINK", "none")
+    # Quotas Resend illimités : le budget d'envoi ne doit pas changer les emails comparés entre deux passes
+    os.environ.setdefault("RESEND_DAILY_QUOTA", "0")
+    os.environ.setdefault("RESEND_MONTHLY_QUOTA", "0")
+    # Fourni par l'environnement des Cloud Functions, nécessaire aux triggers Storage
+    os.environ.setdefault("FIREBASE_CONFIG", '{"projectId": "benchmark", "storageBucket": "benchmark.appspot.com"}')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import firebase_admin
+    import resend
+    from firebase_admin import firestore
+
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firestore.client = lambda *args, **kwargs: db
+    resend.Emails.send = resend_fake.send
+    resend.Batch.send = resend_fake.send_batch
+    # Les attentes de rate limit ne sont pas pertinentes contre le faux Resend
+    time.sleep = lambda seconds: None
+
+    import main
+
+    return main
+
+
+def run_memory_benchmark(iterations: int, customers: int, baseline_mib: float) -> None:
+    samples_file = os.path.join(tempfile.mkdtemp(prefix="harmonya-bench-"), "memory.jsonl")
+    os.environ["MEMORY_PROFILE"] = "1"
+    os.environ["MEMORY_PROFILE_FILE"] = samples_file
+
+    db = FakeFirestore()
+    resend_fake = FakeResend()
+    main = load_main(db, resend_fake)
+    seed_catalog(db, customers)
+
+    for name, scenario in build_scenarios(main, db).items():
+        start = time.perf_counter()
+        for i in range(iterations):
+            scenario(i)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<36} {iterations} invocation(s) en {elapsed:.2f}s")
+
+    print(f"\n{len(resend_fake.sent)} email(s) simulé(s), mesures dans {samples_file}\n")
+
+    from profiling import memory_report
+
+    memory_report(samples_file, baseline_mib)
+
+
+# Fonctions planifiées : jamais exécutées en parallèle avec elles-mêmes par Cloud Scheduler
+_SCHEDULED_SCENARIOS = ("send_booking_reminders", "sweep_gift_vouchers")
+
+
+def run_stress(threads: int, iterations: int, customers: int, latency: float) -> int:
+    """
+    Exécute les triggers en parallèle (ThreadPoolExecutor) puis compare avec une exécution
+    séquentielle des mêmes événements : emails envoyés, erreurs, compteurs de métriques
+    Retourne 1 si une incohérence est détectée
+    """
+    import logging
+    import random
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+
+    db = FakeFirestore()
+    resend_fake = FakeResend(latency=latency)
+    main = load_main(db, resend_fake)
+
+    import metrics
+    import resend
+
+    errors: list[str] = []
+
+    class _ErrorCollector(logging.Handler):
+        def emit(self, record: logging.LogRecord) -> None:
+            errors.append(f"{record.name}: {record.getMessage()}")
+
+    logging.getLogger("harmonya").addHandler(_ErrorCollector(level=logging.ERROR))
+
+    scenarios = {name: run for name, run in build_scenarios(main, db).items() if name not in _SCHEDULED_SCENARIOS}
+    tasks = [(name, i) for name in scenarios for i in range(iterations)]
+
+    def run_phase(workers: int) -> tuple[int, float, dict[str, float]]:
+        with db.lock:
+            db.documents.clear()
+        seed_catalog(db, customers)
+        resend_fake.sent.clear()
+        errors.clear()
+        before = metrics.snapshot()["counters"]
+        shuffled = list(tasks)
+        random.shuffle(shuffled)
+        start = time.perf_counter()
+        if workers == 1:
+            for name, i in shuffled:
+                scenarios[name](i)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(scenarios[name], i) for name, i in shuffled]:
+                    future.result()
+        elapsed = time.perf_counter() - start
+        after = metrics.snapshot()["counters"]
+        delta = {key: value - before.get(key, 0) for key, value in after.items() if value != before.get(key, 0)}
+        return len(resend_fake.sent), elapsed, delta
+
+    expected_emails, sequential_seconds, sequential_counters = run_phase(1)
+    sequential_errors = list(errors)
+    sent_emails, parallel_seconds, parallel_counters = run_phase(threads)
+    api_key_before = resend.api_key
+
+    problems = []
+    if sent_emails != expected_emails:
+        problems.append(f"{sent_emails} email(s) envoyé(s) en parallèle, {expected_emails} attendu(s)")
+    if len(errors) > len(sequential_errors):
+        problems.append(f"{len(errors)} erreur(s) loguée(s) en parallèle: {errors[:5]}")
+    counted = sum(v for k, v in parallel_counters.items() if k.startswith("emails_sent_total"))
+    if counted != sent_emails:
+        problems.append(f"emails_sent_total={counted} pour {sent_emails} email(s) envoyé(s)")
+    invocations = sum(v for k, v in parallel_counters.items() if k.startswith("invocations_total"))
+    expected_invocations = sum(v for k, v in sequential_counters.items() if k.startswith("invocations_total"))
+    if invocations != expected_invocations:
+        problems.append(f"invocations_total={invocations}, {expected_invocations} attendu(s)")
+    if resend.api_key != api_key_before or resend.api_key != os.environ["RESEND_API_KEY"]:
+        problems.append("resend.api_key modifiée pendant l'exécution")
+
+    print(f"{len(tasks)} invocation(s), {len(scenarios)} trigger(s), latence Resend simulée {latency * 1000:.0f} ms")
+    print(f"séquentiel : {sequential_seconds:.2f}s, {expected_emails} email(s)")
+    print(f"{threads} threads  : {parallel_seconds:.2f}s, {sent_emails} email(s)")
+    if problems:
+        print("\nIncohérences :")
+        for problem in problems:
+            print(f"- {problem}")
+        return 1
+    print("\nAucune incohérence détectée")
+    return 0
+
+
+def sample_templates(main: Any) -> dict[str, tuple[Callable[..., str], tuple]]:
+    """Chaque template d'email avec des arguments de test réalistes : {nom: (fonction, arguments)}"""
+    booking = sample_booking(1)
+    voucher = sample_voucher(1)
+    date_formatted = main.format_date_french(booking["date"])
+    review = {"prenom": "Marie", "name": "D.", "rating": 5, "comment": "Super massage " * 20, "approved": False}
+    contact = {"name": "Contact", "email": "contact@example.com", "contactMethod": "email", "message": "Bonjour, " * 50}
+    notifications = [
+        {"type": "booking_admin", "subject": f"Nouvelle réservation - Client {i}",
+         "summary": {"Client": f"Client {i}", "Email": f"client{i}@example.com", "Date": date_formatted}}
+        for i in range(20)
+    ]
+    return {
+        "admin": (main.get_html_template_admin, (booking, "b1", date_formatted)),
+        "client": (main.get_html_template_client, (booking, date_formatted)),
+        "confirmed": (main.get_html_template_confirmed, (booking, date_formatted)),
+        "cancelled": (main.get_html_template_cancelled, (booking, date_formatted)),
+        "reminder": (main.get_html_template_reminder, (booking, date_formatted, "Cocooning", "Type de massage:")),
+        "review_admin": (main.get_html_template_review_admin, (review, "r1", date_formatted)),
+        "voucher_purchaser": (main.get_html_template_voucher_purchaser, (voucher, "v1")),
+        "voucher_recipient": (main.get_html_template_voucher_recipient, (voucher, "v1")),
+        "voucher_expiring": (main.get_html_template_voucher_expiring, (voucher, "v1")),
+        "voucher_admin": (main.get_html_template_voucher_admin, (voucher, "v1")),
+        "contact_message": (main.get_html_template_contact_message, (contact, "c1", date_formatted)),
+        "contact_answer": (main.get_html_template_contact_answer, ("Contact", contact["message"], "Merci. " * 40)),
+        "admin_digest": (main.get_html_template_admin_digest, (notifications,)),
+    }
+
+
+def run_email_sizes(budget: int | None) -> int:
+    """
+    Affiche la taille de chaque email avant/après finalisation ; retourne 1 si le
+    budget est dépassé ou si la finalisation grossit un email
+    """
+    db = FakeFirestore()
+    main = load_main(db, FakeResend())
+    seed_catalog(db, 0)
+
+    from email_html import EMAIL_HTML_BUDGET_BYTES
+
+    budget = budget or EMAIL_HTML_BUDGET_BYTES
+    over_budget = []
+    grown = []
+    print(f"{'template':<20} {'brut':>8} {'final':>8}")
+    for name, (template, args) in sample_templates(main).items():
+        raw = len(template.__wrapped__(*args).encode("utf-8"))
+        final = len(template(*args).encode("utf-8"))
+        print(f"{name:<20} {raw:>8} {final:>8}")
+        if final > budget:
+            over_budget.append(name)
+        if final > raw:
+            grown.append(name)
+    if grown:
+        print(f"\nFinalisation plus grosse que le HTML brut: {', '.join(grown)}")
+    if over_budget:
+        print(f"\nBudget de {budget} octets dépassé: {', '.join(over_budget)}")
+    if grown or over_budget:
+        return 1
+    print(f"\nTous les templates respectent le budget de {budget} octets")
+    return 0
+
+
+# ---------------------------------------------------------------------------
+# Vérifications de non-régression
+# ---------------------------------------------------------------------------
+
+def check_replay_budget_half_open(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Un email différé retenu par le budget ne bloque pas l'appel de test du circuit half_open"""
+    import send_budget
+    from circuit_breaker import HALF_OPEN
+    from email_sender import DEFERRED_EMAILS_COLLECTION, replay_deferred_emails, resend_breaker, send_email
+
+    month, day = send_budget._period()
+    saved_quota = send_budget.RESEND_DAILY_QUOTA
+    send_budget.RESEND_DAILY_QUOTA = 100
+    send_budget._usage["loaded_at"] = float("-inf")
+    db.documents[f"{send_budget.SEND_BUDGET_COLLECTION}/{month}"] = {"total": 99, "days": {day: 99}}
+    db.documents[f"{DEFERRED_EMAILS_COLLECTION}/budget_held"] = {
+        "email": {"from": "a@example.com", "to": "b@example.com", "subject": "Rappel", "html": ""},
+        "type": "booking_reminder", "reason": "budget", "attempts": 0, "createdAt": datetime.now(timezone.utc),
+    }
+    try:
+        for _ in range(resend_breaker.failure_threshold):
+            resend_breaker.record_failure()
+        resend_breaker._opened_at -= resend_breaker.recovery_timeout
+        assert resend_breaker.state == HALF_OPEN
+        assert replay_deferred_emails() == 0
+        assert f"{DEFERRED_EMAILS_COLLECTION}/budget_held" in db.documents, "email retenu par le budget supprimé"
+        assert resend_breaker._probes_in_flight == 0, "appel de test du circuit jamais libéré"
+        result = send_email({"from": "a@example.com", "to": "b@example.com", "subject": "OK", "html": ""}, "booking_confirmed")
+        assert "deferred" not in result, f"email client différé: {result}"
+        assert resend_breaker.state != HALF_OPEN
+    finally:
+        send_budget.RESEND_DAILY_QUOTA = saved_quota
+        send_budget._usage["loaded_at"] = float("-inf")
+        resend_breaker.record_success()
+
+
+def check_history_without_resend_key(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """L'historique du client est écrit à la création, même sans RESEND_API_KEY, un document par réservation"""
+    saved = os.environ.pop("RESEND_API_KEY")
+    try:
+        for booking_id in ("h1", "h2"):
+            main.send_booking_email.__wrapped__(
+                created_event(db, "bookings", booking_id, sample_booking(1), "bookingId"))
+    finally:
+        os.environ["RESEND_API_KEY"] = saved
+    assert not resend_fake.sent, "email envoyé sans clé Resend"
+    for booking_id in ("h1", "h2"):
+        entry = db.documents.get(f"customers/client1@example.com/bookingHistory/{booking_id}")
+        assert entry and entry["status"] == "en_attente", f"historique absent pour {booking_id}"
+
+
+def check_local_errors_not_outage(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Une erreur de programmation n'est ni réessayée, ni différée, ni comptée comme une panne de Resend"""
+    import resend
+    import requests
+    from circuit_breaker import CLOSED
+    from email_sender import resend_breaker, send_email
+    from retry_policy import PERMANENT, TRANSIENT, classify_error
+
+    assert classify_error(KeyError("to")) == PERMANENT
+    assert classify_error(requests.ConnectionError("reset")) == TRANSIENT
+    calls = []
+
+    def broken_send(params: dict) -> dict:
+        calls.append(params)
+        raise KeyError("to")
+
+    resend.Emails.send = broken_send
+    try:
+        for _ in range(resend_breaker.failure_threshold + 1):
+            try:
+                send_email({"from": "a@example.com", "subject": "OK", "html": ""}, "booking_confirmed")
+            except KeyError:
+                pass
+            else:
+                raise AssertionError("erreur de programmation avalée")
+    finally:
+        resend.Emails.send = resend_fake.send
+    assert len(calls) == resend_breaker.failure_threshold + 1, f"{len(calls)} appels : erreur réessayée"
+    assert resend_breaker.state == CLOSED, "circuit ouvert par une erreur de programmation"
+    assert not any(path.startswith("deferredEmails/") for path in db.documents), "email différé"
+
+
+def check_import_keeps_existing_documents(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """bulk_import ne remplace pas un client existant, sauf --overwrite (fusion) ; une reprise ne rejette pas ses propres écritures"""
+    import io
+    import json
+
+    import bulk_import
+
+    # Client créé par l'application : ni imported ni importBatch
+    live = {"email": "client1@example.com", "name": "Client 1", "massageTypes": ["cocooning"],
+            "massageTypesNames": ["Cocooning"], "added_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}
+    db.documents["customers/client1@example.com"] = dict(live)
+    source = os.path.join(tempfile.mkdtemp(prefix="harmonya-import-"), "clients.ndjson")
+    with open(source, "w", encoding="utf-8") as handle:
+        handle.write(json.dumps({"email": "client1@example.com", "name": "Ancien nom", "massageTypes": "zen"}) + "\n")
+        handle.write(json.dumps({"email": "new@example.com", "name": "Nouveau"}) + "\n")
+
+    report = bulk_import.run_import(db, "customers", source, out=io.StringIO())
+    assert report["written"] == 1 and report["rejected"] == 1, report
+    assert db.documents["customers/client1@example.com"] == live, "client existant remplacé"
+    assert "importBatch" not in db.documents["customers/client1@example.com"]
+    with open(f"{source}.rejects.ndjson", encoding="utf-8") as handle:
+        assert "déjà présent" in handle.read()
+
+    # Reprise : le checkpoint désigne l'import qui a déjà créé new@example.com
+    batch = db.documents["customers/new@example.com"]["importBatch"]
+    bulk_import.save_checkpoint(f"{source}.checkpoint.json", {
+        "source": os.path.abspath(source), "collection": "customers", "batch": batch,
+        "line": 0, "written": 0, "rejected": 0,
+    })
+    report = bulk_import.run_import(db, "customers", source, out=io.StringIO())
+    assert report["written"] == 1 and report["rejected"] == 1, f"reprise : {report}"
+
+    report = bulk_import.run_import(db, "customers", source, restart=True, overwrite=True, out=io.StringIO())
+    assert report["written"] == 2 and report["rejected"] == 0, report
+    customer = db.documents["customers/client1@example.com"]
+    assert customer["name"] == "Ancien nom" and customer["massageTypes"] == ["zen"], "--overwrite sans effet"
+
+
+def check_export_stream_context(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Le flux d'export, lu après le retour de la fonction, garde le contexte de l'invocation"""
+    import logging
+
+    import metrics
+    from data_export import export_stream
+    from instrumentation import instrumented, invocation_stream
+    from structured_logging import current_context
+
+    for i in range(3):
+        db.documents[f"bookings/export_{i}"] = sample_booking(i)
+    records: list[dict] = []
+
+    class Capture(logging.Handler):
+        def emit(self, record: logging.LogRecord) -> None:
+            records.append({"message": record.getMessage(), **current_context()})
+
+    @instrumented
+    def export_check(request: Any) -> Any:
+        return invocation_stream(export_stream(db, "bookings", "csv"))
+
+    handler = Capture()
+    logging.getLogger("harmonya.data_export").addHandler(handler)
+    flushes = []
+    saved_flush = metrics.flush_if_due
+    metrics.flush_if_due = lambda: flushes.append(current_context().get("function"))
+    try:
+        body = b"".join(export_check(SimpleNamespace(headers={"X-Cloud-Trace-Context": "trace-export/1"})))
+    finally:
+        metrics.flush_if_due = saved_flush
+        logging.getLogger("harmonya.data_export").removeHandler(handler)
+    assert body.count(b"\n") == 4, body
+    done = [record for record in records if "terminé" in record["message"]]
+    assert done and done[0].get("function") == "export_check" and done[0].get("trace") == "trace-export", records
+    assert flushes == ["export_check", "export_check"], f"métriques publiées : {flushes}"
+    reads = metrics.snapshot()["counters"].get('firestore_reads_total{function="export_check"}', 0)
+    assert reads >= 3, "lectures de l'export non attribuées à la fonction"
+
+
+def check_backfill_partitions(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """customers_backfill découpe les ID "imp_..." en plusieurs plages, le checkpoint ne garde que les plages écrites"""
+    import json
+
+    import customers_backfill
+
+    now = datetime.now(timezone.utc)
+    for i in range(400):
+        db.documents[f"bookings/imp_{uuid.uuid4().hex[:20]}"] = {
+            **sample_booking(i % 50, "confirmed"), "createdAt": now - timedelta(days=400 - i),
+        }
+    # Même client dans deux plages : le nom de la réservation la plus récente l'emporte
+    db.documents["bookings/0old"] = {**sample_booking(1, "confirmed"), "name": "Ancien", "createdAt": now - timedelta(days=900)}
+    db.documents["bookings/zzz_new"] = {**sample_booking(1, "confirmed"), "name": "Récent", "createdAt": now}
+
+    splits = customers_backfill.partition_splits(db, 8)
+    bounds = customers_backfill.partition_bounds(splits)
+    sizes = [sum(1 for _ in customers_backfill._iter_partition(db, bound)) for bound in bounds]
+    assert len(bounds) == 8 and max(sizes) <= 2 * 402 / 8, f"plages déséquilibrées : {sizes}"
+
+    checkpoint_path = os.path.join(tempfile.mkdtemp(prefix="harmonya-backfill-"), "backfill.json")
+    # Reprise : les plages 0 à 5 sont déjà écrites, seules les deux dernières sont relues
+    customers_backfill.save_checkpoint(checkpoint_path, {"splits": splits, "done": list(range(6))})
+    report = customers_backfill.rebuild_customers(db, checkpoint_path=checkpoint_path, workers=4)
+    assert report["bookings"] == sum(sizes[6:]), f"plages terminées relues : {report}"
+    report = customers_backfill.rebuild_customers(db, checkpoint_path=checkpoint_path, restart=True, partitions=8, workers=4)
+    assert report["bookings"] == 402 and not os.path.exists(checkpoint_path), report
+    assert db.documents["customers/client1@example.com"]["name"] == "Récent"
+    history = [path for path in db.documents if path.startswith("customers/client1@example.com/bookingHistory/")]
+    assert len(history) == 10, f"{len(history)} entrées d'historique"
+
+    # Checkpoint pendant l'exécution : uniquement des ID de découpe et des numéros de plages
+    saved = []
+    save = customers_backfill.save_checkpoint
+    customers_backfill.save_checkpoint = lambda path, data: saved.append(json.dumps(data)) or save(path, data)
+    try:
+        customers_backfill.rebuild_customers(db, checkpoint_path=checkpoint_path, restart=True, partitions=8, workers=4)
+    finally:
+        customers_backfill.save_checkpoint = save
+    assert max(len(data) for data in saved) < 1000 and set(json.loads(saved[-1])) == {"splits", "done"}, saved[-1]
+
+
+def check_voucher_expiry_notice_without_marker(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Un bon sans marqueur expiryNoticeSentAt (champ absent, pas None) reçoit son avis d'expiration"""
+    now = datetime.now(timezone.utc)
+    db.documents["giftVouchers/expiring"] = {**sample_voucher(1), "expiresAt": now + timedelta(days=3)}
+    db.documents["giftVouchers/notified"] = {**sample_voucher(2), "expiresAt": now + timedelta(days=3),
+                                             "expiryNoticeSentAt": now - timedelta(days=1)}
+    saved = main.VOUCHER_EXPIRY_NOTICE_DAYS
+    main.VOUCHER_EXPIRY_NOTICE_DAYS = 14
+    try:
+        sent = main.send_voucher_expiry_notices(db, now)
+    finally:
+        main.VOUCHER_EXPIRY_NOTICE_DAYS = saved
+    assert sent == 1 and [email["to"] for email in resend_fake.sent] == ["recipient1@example.com"], resend_fake.sent
+    assert "expiryNoticeSentAt" in db.documents["giftVouchers/expiring"], "marqueur non posé"
+
+
+def check_replay_past_budget_held(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Des emails retenus par le budget en tête de file n'empêchent pas le renvoi d'un email client plus récent"""
+    import send_budget
+    from email_sender import DEFERRED_EMAILS_COLLECTION, replay_deferred_emails
+
+    month, day = send_budget._period()
+    saved_quota = send_budget.RESEND_DAILY_QUOTA
+    send_budget.RESEND_DAILY_QUOTA = 100
+    send_budget._usage["loaded_at"] = float("-inf")
+    db.documents[f"{send_budget.SEND_BUDGET_COLLECTION}/{month}"] = {"total": 99, "days": {day: 99}}
+    start = datetime.now(timezone.utc) - timedelta(hours=2)
+    for i in range(120):
+        db.documents[f"{DEFERRED_EMAILS_COLLECTION}/held_{i:03d}"] = {
+            "email": {"from": "a@example.com", "to": f"r{i}@example.com", "subject": "Rappel", "html": ""},
+            "type": "booking_reminder", "reason": "budget", "attempts": 0, "createdAt": start + timedelta(seconds=i),
+        }
+    db.documents[f"{DEFERRED_EMAILS_COLLECTION}/critical"] = {
+        "email": {"from": "a@example.com", "to": "client@example.com", "subject": "Confirmée", "html": ""},
+        "type": "booking_confirmed", "reason": "circuit_open", "attempts": 0, "createdAt": start + timedelta(hours=1),
+    }
+    try:
+        assert replay_deferred_emails() == 1
+    finally:
+        send_budget.RESEND_DAILY_QUOTA = saved_quota
+        send_budget._usage["loaded_at"] = float("-inf")
+    assert [email["to"] for email in resend_fake.sent] == ["client@example.com"], resend_fake.sent
+    held = [path for path in db.documents if path.startswith(f"{DEFERRED_EMAILS_COLLECTION}/held_")]
+    assert len(held) == 120, "email retenu par le budget supprimé"
+
+
+def check_customer_search_prefixes_trigger(main: Any, db: FakeFirestore, resend_fake: FakeResend) -> None:
+    """Un client modifié depuis l'application est réindexé ; l'écriture de searchPrefixes ne relance rien"""
+    trigger = main.update_customer_search_prefixes.__wrapped__
+    path = "customers/helene@example.com"
+    created = {"email": "helene@example.com", "name": "Hélène Dupont", "phone": "0612345678"}
+    db.documents[path] = dict(created)
+    trigger(FakeEvent(FakeChange(None, _snapshot(db, path, created)), {"customerEmail": "helene@example.com"}))
+    assert "hel" in db.documents[path].get("searchPrefixes", []), db.documents[path]
+
+    before = dict(db.documents[path])
+    renamed = {**before, "name": "Hélène Martin"}
+    trigger(updated_event(db, "customers", "helene@example.com", before, renamed, "customerEmail"))
+    prefixes = db.documents[path]["searchPrefixes"]
+    assert "mar" in prefixes and "dup" not in prefixes, prefixes
+
+    # Événement produit par l'écriture du trigger : seul searchPrefixes change, la fonction n'est pas appelée
+    # (le document stocké est modifié pour détecter une éventuelle écriture)
+    own_write = {**renamed, "searchPrefixes": prefixes}
+    trigger(updated_event(db, "customers", "helene@example.com", renamed, own_write, "customerEmail"))
+    db.documents[path]["searchPrefixes"] = ["marqueur"]
+    trigger(updated_event(db, "customers", "helene@example.com", renamed, {**own_write, "searchPrefixes": ["marqueur"]}, "customerEmail"))
+    assert db.documents[path]["searchPrefixes"] == ["marqueur"], "le trigger a réagi à sa propre écriture"
+
+
+CHECKS: dict[str, Callable[[Any, FakeFirestore, FakeResend], None]] = {
+    "replay_deferred_emails (budget, half_open)": check_replay_budget_half_open,
+    "replay_deferred_emails (file retenue par le budget)": check_replay_past_budget_held,
+    "send_booking_email (historique sans clé Resend)": check_history_without_resend_key,
+    "send_email (erreur locale, circuit)": check_local_errors_not_outage,
+    "bulk_import (documents existants)": check_import_keeps_existing_documents,
+    "export_data (contexte du flux)": check_export_stream_context,
+    "customers_backfill (plages, reprise)": check_backfill_partitions,
+    "send_voucher_expiry_notices (sans marqueur)": check_voucher_expiry_notice_without_marker,
+    "update_customer_search_prefixes (écriture propre)": check_customer_search_prefixes_trigger,
+}
+
+
+def run_checks() -> int:
+    """Exécute les vérifications contre les faux ; retourne 1 si l'une d'elles échoue"""
+    failed = []
+    for name, check in CHECKS.items():
+        db = FakeFirestore()
+        resend_fake = FakeResend()
+        main = load_main(db, resend_fake)
+        seed_catalog(db, 0)
+        try:
+            check(main, db, resend_fake)
+        except Exception as e:
+            failed.append(name)
+            print(f"ÉCHEC {name}: {type(e).__name__}: {e}")
+        else:
+            print(f"OK    {name}")
+    if failed:
+        print(f"\n{len(failed)} vérification(s) en échec")
+        return 1
+    print(f"\n{len(CHECKS)} vérification(s) réussie(s)")
+    return 0
+
+
+def main_cli(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark local des Cloud Functions Harmonya")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    memory_parser = subparsers.add_parser("memory", help="Mesure mémoire et palier recommandé par fonction")
+    memory_parser.add_argument("--iterations", type=int, default=10)
+    memory_parser.add_argument("--customers", type=int, default=2000, help="Clients concernés par un renommage")
+    memory_parser.add_argument("--baseline-mib", type=float, default=90)
+    stress_parser = subparsers.add_parser("stress", help="Triggers en parallèle (concurrence > 1) contre les faux")
+    stress_parser.add_argument("--threads", type=int, default=16)
+    stress_parser.add_argument("--iterations", type=int, default=20, help="Invocations par trigger")
+    stress_parser.add_argument("--customers", type=int, default=200)
+    stress_parser.add_argument("--latency-ms", type=float, default=5, help="Latence simulée d'un envoi Resend")
+    sizes_parser = subparsers.add_parser("email-sizes", help="Taille des emails rendus, échoue au-delà du budget")
+    sizes_parser.add_argument("--budget", type=int, default=None, help="Octets (EMAIL_HTML_BUDGET_BYTES par défaut)")
+    subparsers.add_parser("checks", help="Vérifications de non-régression contre les faux")
+    args = parser.parse_args(argv)
+
+    if args.command == "memory":
+        run_memory_benchmark(args.iterations, args.customers, args.baseline_mib)
+    elif args.command == "stress":
+        sys.exit(run_stress(args.threads, args.iterations, args.customers, args.latency_ms / 1000))
+    elif args.command == "email-sizes":
+        sys.exit(run_email_sizes(args.budget))
+    elif args.command == "checks":
+        sys.exit(run_checks())
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,189 @@
+"""
+Archivage des anciennes réservations et agrégats mensuels
+
+La collection "bookings" grandit sans fin : les requêtes de l'application par
+date (et leur repli sans index, qui lit toute la collection) ralentissent avec
+l'historique. La fonction planifiée archive_old_bookings (main.py) déplace les
+réservations dont la date est antérieure au début du mois d'il y a
+BOOKING_ARCHIVE_MONTHS mois (heure de Paris) :
+- chaque réservation est copiée telle quelle, avec le même ID, dans
+  "bookingsArchive" (champ archivedAt en plus) : l'historique reste
+  consultable et exportable (export_data, collection bookingsArchive)
+- l'original n'est supprimé qu'une fois la copie écrite
+- chaque mois touché est agrégé dans bookingRollups/{AAAA-MM} :
+
+    {"month": "2025-03", "count": 84, "byStatus": {"confirmed": 70, ...},
+     "byServiceType": {"massage": 60, "soins": 24},
+     "confirmed": {"count": 70, "byService": {"cocooning": 25, ...},
+                   "durationMinutes": 4650, "atHome": 12}}
+
+Les copies et suppressions passent par un BulkWriter. L'agrégat d'un mois est
+recalculé à partir de "bookingsArchive" (lecture des seuls champs utiles)
+plutôt qu'incrémenté : un passage interrompu puis repris ne compte jamais une
+réservation deux fois. Le parcours s'arrête avant la fin du budget de
+l'invocation, les réservations restantes sont reprises au passage suivant.
+
+Configuration :
+- BOOKING_ARCHIVE_MONTHS : mois complets conservés dans "bookings" en plus du mois en cours (12)
+- BOOKING_ARCHIVE_SCHEDULE : fréquence de la fonction planifiée ("every day 04:30")
+- BOOKING_ARCHIVE_PAGE_SIZE : réservations déplacées par page (200)
+"""
+
+import os
+from datetime import date, datetime, time
+from typing import Any
+from zoneinfo import ZoneInfo
+
+from firebase_admin import firestore
+
+import metrics
+from retry_policy import remaining_budget
+from structured_logging import get_logger
+
+logger = get_logger("booking_archive")
+
+BOOKINGS_ARCHIVE_COLLECTION = "bookingsArchive"
+BOOKING_ROLLUPS_COLLECTION = "bookingRollups"
+BOOKING_ARCHIVE_MONTHS = int(os.environ.get("BOOKING_ARCHIVE_MONTHS", "12"))
+BOOKING_ARCHIVE_SCHEDULE = os.environ.get("BOOKING_ARCHIVE_SCHEDULE", "every day 04:30")
+BOOKING_ARCHIVE_PAGE_SIZE = int(os.environ.get("BOOKING_ARCHIVE_PAGE_SIZE", "200"))
+ARCHIVE_TIMEZONE = ZoneInfo("Europe/Paris")
+
+_ROLLUP_FIELDS = ["date", "status", "serviceType", "massageType", "duration", "isAtHome"]
+
+
+def month_start(year: int, month: int) -> datetime:
+    """Premier jour du mois à minuit, heure de Paris (mois hors de 1..12 acceptés)"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime.combine(date(year, month, 1), time.min, tzinfo=ARCHIVE_TIMEZONE)
+
+
+def archive_cutoff(now: datetime, months: int = BOOKING_ARCHIVE_MONTHS) -> datetime:
+    """Les réservations datées avant cette limite sont archivées (toujours un début de mois)"""
+    local = now.astimezone(ARCHIVE_TIMEZONE)
+    return month_start(local.year, local.month - months)
+
+
+def month_key(value: Any) -> str | None:
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is not None:
+        value = value.astimezone(ARCHIVE_TIMEZONE)
+    return f"{value.year:04d}-{value.month:02d}"
+
+
+def rollup(bookings: list[dict]) -> dict[str, Any]:
+    """Agrégat d'un mois de réservations (voir le format en tête de module)"""
+    summary: dict[str, Any] = {
+        "count": 0, "byStatus": {}, "byServiceType": {},
+        "confirmed": {"count": 0, "byService": {}, "durationMinutes": 0, "atHome": 0},
+    }
+    for booking in bookings:
+        status = booking.get("status") or "en_attente"
+        service_type = booking.get("serviceType") or "massage"
+        summary["count"] += 1
+        summary["byStatus"][status] = summary["byStatus"].get(status, 0) + 1
+        summary["byServiceType"][service_type] = summary["byServiceType"].get(service_type, 0) + 1
+        if status != "confirmed":
+            continue
+        confirmed = summary["confirmed"]
+        confirmed["count"] += 1
+        service_id = (booking.get("massageType") or "").split("_")[0]
+        if service_id:
+            confirmed["byService"][service_id] = confirmed["byService"].get(service_id, 0) + 1
+        try:
+            confirmed["durationMinutes"] += int(booking.get("duration") or 0)
+        except (TypeError, ValueError):
+            pass
+        if booking.get("isAtHome") is True:
+            confirmed["atHome"] += 1
+    return summary
+
+
+def rebuild_rollup(db: Any, month: str) -> dict[str, Any]:
+    """Recalcule bookingRollups/{month} à partir des réservations archivées de ce mois"""
+    year, number = (int(part) for part in month.split("-"))
+    query = (
+        db.collection(BOOKINGS_ARCHIVE_COLLECTION)
+        .where("date", ">=", month_start(year, number))
+        .where("date", "<", month_start(year, number + 1))
+        .select(_ROLLUP_FIELDS)
+    )
+    bookings = []
+    for doc in query.stream():
+        metrics.count_reads()
+        bookings.append(doc.to_dict() or {})
+    summary = rollup(bookings)
+    db.collection(BOOKING_ROLLUPS_COLLECTION).document(month).set({
+        "month": month, **summary, "updatedAt": firestore.SERVER_TIMESTAMP,
+    })
+    return summary
+
+
+def _old_bookings_query(db: Any, cutoff: datetime) -> Any:
+    # Tri stable (date puis ID) : le curseur ne saute pas les réservations d'une même date
+    return (
+        db.collection("bookings").where("date", "<", cutoff)
+        .order_by("date").order_by("__name__").limit(BOOKING_ARCHIVE_PAGE_SIZE)
+    )
+
+
+def archive_bookings(db: Any, now: datetime) -> tuple[int, bool]:
+    """
+    Déplace les réservations antérieures à archive_cutoff(now) dans "bookingsArchive"
+    et met à jour les agrégats des mois concernés
+    Retourne (nombre de réservations archivées, True si le parcours est complet)
+    """
+    cutoff = archive_cutoff(now)
+    failures: set[str] = set()
+    months: set[str] = set()
+    archived = 0
+    complete = False
+
+    def on_write_error(failure: Any, writer: Any) -> bool:
+        # Réessayer les erreurs temporaires, abandonner le reste (repris au prochain passage)
+        if failure.attempts < 3:
+            return True
+        failures.add(failure.operation.reference.id)
+        return False
+
+    bulk_writer = db.bulk_writer()
+    bulk_writer.on_write_error(on_write_error)
+    archive = db.collection(BOOKINGS_ARCHIVE_COLLECTION)
+    query = _old_bookings_query(db, cutoff)
+    try:
+        while True:
+            page = list(query.stream())
+            metrics.count_reads(len(page))
+            for doc in page:
+                data = doc.to_dict() or {}
+                bulk_writer.set(archive.document(doc.id), {**data, "archivedAt": firestore.SERVER_TIMESTAMP})
+            # Copies écrites avant toute suppression
+            bulk_writer.flush()
+            for doc in page:
+                if doc.id in failures:
+                    continue
+                bulk_writer.delete(doc.reference)
+                archived += 1
+                month = month_key(doc.get("date"))
+                if month:
+                    months.add(month)
+            bulk_writer.flush()
+            if len(page) < BOOKING_ARCHIVE_PAGE_SIZE:
+                complete = True
+                break
+            if remaining_budget() < 10:
+                logger.warning("Budget de l'invocation presque épuisé, archivage repris au prochain passage")
+                break
+            query = query.start_after(page[-1])
+    finally:
+        bulk_writer.close()
+        # Agrégats des mois touchés, même après une interruption
+        for month in sorted(months):
+            rebuild_rollup(db, month)
+
+    if failures:
+        logger.error("Réservations non archivées (reprises au prochain passage): %s", ", ".join(sorted(failures)))
+    metrics.inc("bookings_archived_total", archived)
+    logger.info("%s réservation(s) archivée(s) avant le %s (%s mois mis à jour)", archived, cutoff.date(), len(months))
+    return archived, complete
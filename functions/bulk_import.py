@@ -0,0 +1,419 @@
+"""
+Import en masse de réservations et de clients (migration depuis l'ancien outil)
+
+    python bulk_import.py bookings historique.csv
+    python bulk_import.py customers clients.ndjson --dry-run
+    python bulk_import.py customers clients.ndjson --overwrite
+
+Le fichier (CSV avec en-tête ou NDJSON, éventuellement .gz) est lu ligne à
+ligne, jamais chargé en entier. Les colonnes sont celles de l'export
+(data_export.py) : un export peut être réimporté tel quel.
+
+- Chaque ligne est validée ; les lignes refusées sont écrites avec la raison
+  dans <fichier>.rejects.ndjson et n'interrompent pas l'import
+- Les écritures passent par un BulkWriter en mode parallèle (montée en charge
+  progressive jusqu'à IMPORT_MAX_OPS_PER_SECOND) ; tous les
+  IMPORT_CHECKPOINT_ROWS lignes, l'import attend que les écritures en cours
+  soient terminées (backpressure : au plus une fenêtre en vol) puis enregistre
+  sa progression dans <fichier>.checkpoint.json
+- Les documents sont créés (create) : une ligne dont le document existe déjà
+  (client de même email, réservation de même ID) est rejetée, les données
+  modifiées depuis dans l'application ne sont jamais écrasées. Avec
+  --overwrite, la ligne est fusionnée dans le document existant (set merge) :
+  les champs présents dans le fichier remplacent ceux du document
+- Après un échec, relancer la même commande reprend après la dernière fenêtre
+  terminée (--restart pour repartir du début) ; les ID de documents sont
+  déterministes, une ligne réécrite ne crée pas de doublon (un document déjà
+  créé par le même import n'est pas rejeté)
+- Les documents sont marqués imported=true et importedAt : les triggers
+  d'emails (send_booking_email, send_booking_status_email) les ignorent sans
+  lire le reste du document (triggers.skip_imported)
+
+Les réservations importées ne créent ni ne mettent à jour les documents de la
+collection "customers" (les triggers sont ignorés) : lancer ensuite
+customers_backfill.py.
+
+Le débit (lignes/s) est affiché à chaque fenêtre et en fin d'import.
+
+Configuration :
+- IMPORT_CHECKPOINT_ROWS : lignes par fenêtre d'écriture (2000)
+- IMPORT_MAX_OPS_PER_SECOND : plafond du BulkWriter (2000)
+- IMPORT_MAX_ATTEMPTS : tentatives par document avant rejet (5)
+"""
+
+import argparse
+import csv
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import date, datetime, time as day_time
+from typing import Any, Callable, Iterator
+from zoneinfo import ZoneInfo
+
+from firebase_admin import firestore
+from google.rpc import code_pb2
+
+import metrics
+from customer_search import SEARCH_PREFIXES_FIELD, search_prefixes
+from structured_logging import get_logger
+
+logger = get_logger("bulk_import")
+
+IMPORT_CHECKPOINT_ROWS = int(os.environ.get("IMPORT_CHECKPOINT_ROWS", "2000"))
+IMPORT_MAX_OPS_PER_SECOND = int(os.environ.get("IMPORT_MAX_OPS_PER_SECOND", "2000"))
+IMPORT_MAX_ATTEMPTS = int(os.environ.get("IMPORT_MAX_ATTEMPTS", "5"))
+IMPORT_TIMEZONE = ZoneInfo("Europe/Paris")
+
+BOOKING_STATUSES = ("en_attente", "confirmed", "cancelled")
+SERVICE_TYPES = ("massage", "soins")
+_EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+_TIME = re.compile(r"^(\d{1,2}):(\d{2})$")
+_DOCUMENT_ID = re.compile(r"^[^/]{1,1500}$")
+
+
+class RowError(ValueError):
+    """Ligne invalide (écrite dans le fichier des rejets)"""
+
+
+# Lecture en flux
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8-sig", newline="")
+    return open(path, "r", encoding="utf-8-sig", newline="")
+
+
+def read_rows(path: str) -> Iterator[tuple[int, dict]]:
+    """(numéro de ligne de données, ligne) pour un fichier CSV ou NDJSON"""
+    is_ndjson = path.removesuffix(".gz").endswith((".ndjson", ".jsonl"))
+    with _open_text(path) as handle:
+        if is_ndjson:
+            for line_number, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, {"__error__": f"JSON invalide: {e}"}
+        else:
+            for line_number, row in enumerate(csv.DictReader(handle), start=1):
+                yield line_number, {(k or "").strip(): v for k, v in row.items()}
+
+
+# Validation
+
+
+def _text(row: dict, field: str, required: bool = False) -> str:
+    value = row.get(field)
+    value = "" if value is None else str(value).strip()
+    # Cellules neutralisées par l'export CSV ('=..., '+...)
+    if value[:2] in ("'=", "'+", "'-", "'@"):
+        value = value[1:]
+    if required and not value:
+        raise RowError(f"{field} manquant")
+    return value
+
+
+def _email(row: dict, field: str = "email") -> str:
+    value = _text(row, field, required=True).lower()
+    if not _EMAIL.match(value):
+        raise RowError(f"{field} invalide: {value}")
+    return value
+
+
+def _bool(row: dict, field: str) -> bool:
+    value = row.get(field)
+    if isinstance(value, bool):
+        return value
+    text = _text(row, field).lower()
+    if text in ("", "false", "non", "no", "0"):
+        return False
+    if text in ("true", "oui", "yes", "1"):
+        return True
+    raise RowError(f"{field} invalide: {text}")
+
+
+def _list(row: dict, field: str) -> list[str]:
+    value = row.get(field)
+    if isinstance(value, list):
+        return [str(v).strip() for v in value if str(v).strip()]
+    return [part.strip() for part in _text(row, field).split("|") if part.strip()]
+
+
+def _datetime(row: dict, field: str) -> datetime | None:
+    text = _text(row, field)
+    if not text:
+        return None
+    try:
+        value = datetime.fromisoformat(text)
+    except ValueError:
+        raise RowError(f"{field} invalide: {text}")
+    return value if value.tzinfo else value.replace(tzinfo=IMPORT_TIMEZONE)
+
+
+def _day(row: dict, field: str) -> datetime:
+    """Minuit (heure de Paris) du jour indiqué, comme les dates saisies dans l'application"""
+    text = _text(row, field, required=True)
+    try:
+        day = date.fromisoformat(text[:10]) if len(text) <= 10 else None
+        if day is None:
+            value = datetime.fromisoformat(text)
+            day = (value.astimezone(IMPORT_TIMEZONE) if value.tzinfo else value).date()
+    except ValueError:
+        raise RowError(f"{field} invalide: {text}")
+    return datetime.combine(day, day_time.min, tzinfo=IMPORT_TIMEZONE)
+
+
+def validate_booking(row: dict) -> tuple[str, dict]:
+    """(ID du document, données) d'une réservation"""
+    email = _email(row)
+    booking_date = _day(row, "date")
+    match = _TIME.match(_text(row, "time", required=True))
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise RowError(f"time invalide: {row.get('time')}")
+    booking_time = f"{int(match.group(1)):02d}:{match.group(2)}"
+    massage_type = _text(row, "massageType", required=True)
+    service_type = _text(row, "serviceType") or "massage"
+    if service_type not in SERVICE_TYPES:
+        raise RowError(f"serviceType invalide: {service_type}")
+    status = _text(row, "status") or "confirmed"
+    if status not in BOOKING_STATUSES:
+        raise RowError(f"status invalide: {status}")
+    duration_text = _text(row, "duration") or massage_type.rpartition("_")[2]
+    try:
+        duration = int(float(duration_text))
+    except ValueError:
+        duration = 0
+    booking = {
+        "name": _text(row, "name", required=True),
+        "email": email,
+        "phone": _text(row, "phone"),
+        "date": booking_date,
+        "time": booking_time,
+        "massageType": massage_type,
+        "serviceType": service_type,
+        "duration": duration,
+        "status": status,
+        "isAtHome": _bool(row, "isAtHome"),
+        "homeAddress": _text(row, "homeAddress"),
+        "notes": _text(row, "notes"),
+        "createdAt": _datetime(row, "createdAt") or booking_date,
+    }
+    if _text(row, "serviceName"):
+        booking["serviceName"] = _text(row, "serviceName")
+    document_id = _text(row, "id")
+    if not document_id:
+        key = f"{email}|{booking_date.date().isoformat()}|{booking_time}|{massage_type}"
+        document_id = "imp_" + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20]
+    elif not _DOCUMENT_ID.match(document_id):
+        raise RowError(f"id invalide: {document_id}")
+    return document_id, booking
+
+
+def validate_customer(row: dict) -> tuple[str, dict]:
+    """(ID du document = email, données) d'un client"""
+    email = _email(row)
+    name = _text(row, "name")
+    phone = _text(row, "phone")
+    massage_types = _list(row, "massageTypes")
+    treatment_types = _list(row, "treatmentTypes")
+    customer = {
+        "email": email,
+        "name": name,
+        "phone": phone,
+        "massageTypes": massage_types,
+        "treatmentTypes": treatment_types,
+        "massageTypesNames": _list(row, "massageTypesNames") or list(massage_types),
+        "treatmentTypesNames": _list(row, "treatmentTypesNames") or list(treatment_types),
+        SEARCH_PREFIXES_FIELD: search_prefixes(name, email, phone),
+        "added_at": _datetime(row, "added_at") or firestore.SERVER_TIMESTAMP,
+    }
+    return email, customer
+
+
+VALIDATORS: dict[str, Callable[[dict], tuple[str, dict]]] = {
+    "bookings": validate_booking,
+    "customers": validate_customer,
+}
+
+
+# Checkpoint
+
+
+def load_checkpoint(path: str, source: str, collection: str) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return {}
+    if checkpoint.get("source") != source or checkpoint.get("collection") != collection:
+        raise SystemExit(f"{path} correspond à un autre import, utiliser --restart")
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump(checkpoint, handle)
+    os.replace(temporary, path)
+
+
+# Import
+
+
+def run_import(db: Any, collection: str, source: str, dry_run: bool = False, restart: bool = False,
+               overwrite: bool = False, window: int = IMPORT_CHECKPOINT_ROWS, out: Any = sys.stdout) -> dict:
+    """
+    Importe `source` dans `collection`, retourne le bilan (lignes lues, écrites, rejetées, lignes/s)
+    Sans `overwrite`, les documents existants ne sont pas modifiés (lignes rejetées)
+    """
+    validate = VALIDATORS[collection]
+    source = os.path.abspath(source)
+    checkpoint_path = f"{source}.checkpoint.json"
+    rejects_path = f"{source}.rejects.ndjson"
+    if restart or dry_run:
+        checkpoint = {}
+    else:
+        checkpoint = load_checkpoint(checkpoint_path, source, collection)
+    resume_after = checkpoint.get("line", 0)
+    report = {
+        "read": 0, "written": checkpoint.get("written", 0), "rejected": checkpoint.get("rejected", 0),
+        "skipped": resume_after,
+    }
+    import_batch = checkpoint.get("batch") or uuid.uuid4().hex[:12]
+    if resume_after:
+        print(f"Reprise après la ligne {resume_after} (import {import_batch})", file=out)
+
+    rejects_lock = threading.Lock()
+    rejects = open(rejects_path, "a" if resume_after else "w", encoding="utf-8")
+
+    def reject(line_number: int | None, error: str, row: Any = None) -> None:
+        with rejects_lock:
+            report["rejected"] += 1
+            rejects.write(json.dumps({"line": line_number, "error": error, "row": row},
+                                     ensure_ascii=False, default=str) + "\n")
+
+    # Documents en vol dans la fenêtre courante : chemin -> numéro de ligne
+    in_flight: dict[str, int] = {}
+
+    def on_write_error(failure: Any, bulk_writer: Any) -> bool:
+        reference = failure.operation.reference
+        if failure.code == code_pb2.ALREADY_EXISTS:
+            # Document créé par ce même import avant une interruption : déjà compté, rien à faire
+            existing = reference.get()
+            metrics.count_reads()
+            # to_dict : un document créé par l'application n'a pas de champ importBatch (get lèverait KeyError)
+            if (existing.to_dict() or {}).get("importBatch") == import_batch:
+                return False
+            with rejects_lock:
+                report["written"] -= 1
+            reject(in_flight.get(reference.path), "document déjà présent (--overwrite pour le mettre à jour)")
+            return False
+        if failure.attempts < IMPORT_MAX_ATTEMPTS:
+            return True
+        with rejects_lock:
+            report["written"] -= 1
+        reject(in_flight.get(reference.path), f"écriture refusée ({failure.code}): {failure.message}")
+        return False
+
+    writer = None
+    if not dry_run:
+        from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+
+        writer = db.bulk_writer(BulkWriterOptions(initial_ops_per_second=500, max_ops_per_second=IMPORT_MAX_OPS_PER_SECOND))
+        writer.on_write_error(on_write_error)
+
+    started = time.monotonic()
+    last_line = resume_after
+
+    def end_window() -> None:
+        """Attend les écritures de la fenêtre (backpressure) puis enregistre la progression"""
+        if writer is not None:
+            writer.flush()
+            in_flight.clear()
+            save_checkpoint(checkpoint_path, {
+                "source": source, "collection": collection, "batch": import_batch,
+                "line": last_line, "written": report["written"], "rejected": report["rejected"],
+            })
+        elapsed = max(time.monotonic() - started, 1e-9)
+        print(f"{report['read']} ligne(s) lue(s), {report['written']} écrite(s), {report['rejected']} rejetée(s)"
+              f" - {report['read'] / elapsed:.0f} lignes/s", file=out)
+
+    try:
+        collection_ref = db.collection(collection)
+        rows_in_window = 0
+        for line_number, row in read_rows(source):
+            if line_number <= resume_after:
+                continue
+            report["read"] += 1
+            last_line = line_number
+            try:
+                if "__error__" in row:
+                    raise RowError(row["__error__"])
+                document_id, data = validate(row)
+            except RowError as e:
+                reject(line_number, str(e), row)
+            else:
+                if writer is not None:
+                    data.update({"imported": True, "importedAt": firestore.SERVER_TIMESTAMP, "importBatch": import_batch})
+                    ref = collection_ref.document(document_id)
+                    in_flight[f"{collection}/{document_id}"] = line_number
+                    if overwrite:
+                        writer.set(ref, data, merge=True)
+                    else:
+                        writer.create(ref, data)
+                with rejects_lock:
+                    report["written"] += 1
+            rows_in_window += 1
+            if rows_in_window >= window:
+                end_window()
+                rows_in_window = 0
+        end_window()
+        if writer is not None:
+            writer.close()
+    finally:
+        rejects.close()
+
+    elapsed = max(time.monotonic() - started, 1e-9)
+    report["seconds"] = round(elapsed, 2)
+    report["rows_per_second"] = round(report["read"] / elapsed, 1)
+    metrics.inc("imported_documents_total", report["written"], collection=collection)
+    if not dry_run:
+        # Import terminé : un nouveau lancement repart du début
+        os.remove(checkpoint_path)
+    if not report["rejected"] and os.path.exists(rejects_path):
+        os.remove(rejects_path)
+    return report
+
+
+def main_cli(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Import en masse de réservations ou de clients")
+    parser.add_argument("collection", choices=sorted(VALIDATORS))
+    parser.add_argument("source", help="fichier CSV ou NDJSON (éventuellement .gz)")
+    parser.add_argument("--dry-run", action="store_true", help="valide le fichier sans rien écrire")
+    parser.add_argument("--restart", action="store_true", help="ignore le checkpoint et repart du début")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="fusionne les lignes dans les documents existants au lieu de les rejeter")
+    args = parser.parse_args(argv)
+
+    import firebase_admin
+
+    firebase_admin.initialize_app()
+    report = run_import(firestore.client(), args.collection, args.source, dry_run=args.dry_run,
+                        restart=args.restart, overwrite=args.overwrite)
+    print(f"Terminé en {report['seconds']} s : {report['written']} document(s) écrit(s), "
+          f"{report['rejected']} ligne(s) rejetée(s), {report['rows_per_second']} lignes/s")
+    if report["rejected"]:
+        print(f"Lignes rejetées : {os.path.abspath(args.source)}.rejects.ndjson")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,145 @@
+"""
+Instantané public du catalogue (massages et soins)
+
+Le catalogue change rarement mais chaque visiteur de la page d'accueil lisait
+toutes les prestations. Les triggers de "massages" et "treatments" (main.py)
+reconstruisent à chaque création, modification ou suppression un instantané
+pré-sérialisé stocké dans catalog/snapshot :
+- json : le catalogue ({"massages": [...], "treatments": [...]}, triés par order)
+- gzip : le même contenu compressé
+- etag : empreinte du contenu ; l'instantané n'est réécrit que s'il a changé
+
+L'endpoint get_catalog sert cet instantané avec ETag (réponse 304 si le client
+a déjà la version courante), Cache-Control (mise en cache par le CDN de
+Firebase Hosting via la réécriture /api/catalog) et gzip. Une instance chaude
+garde l'instantané en mémoire CATALOG_CACHE_SECONDS secondes : la plupart des
+requêtes ne lisent aucun document.
+
+Configuration :
+- CATALOG_MAX_AGE : durée de cache navigateur en secondes (60)
+- CATALOG_CDN_MAX_AGE : durée de cache CDN en secondes (300)
+- CATALOG_CACHE_SECONDS : durée du cache mémoire par instance (60)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+from typing import Any
+
+from firebase_admin import firestore
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("catalog_snapshot")
+
+CATALOG_COLLECTION = "catalog"
+CATALOG_DOCUMENT = "snapshot"
+CATALOG_SOURCES = ("massages", "treatments")
+CATALOG_MAX_AGE = int(os.environ.get("CATALOG_MAX_AGE", "60"))
+CATALOG_CDN_MAX_AGE = int(os.environ.get("CATALOG_CDN_MAX_AGE", "300"))
+CATALOG_CACHE_SECONDS = float(os.environ.get("CATALOG_CACHE_SECONDS", "60"))
+
+_cache: dict[str, Any] | None = None
+_cache_loaded_at = 0.0
+_cache_lock = threading.Lock()
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return None
+    raise TypeError(f"Type non sérialisable dans le catalogue: {type(value).__name__}")
+
+
+def serialize(catalog: dict) -> dict[str, Any]:
+    """Contenu JSON compact, version gzip et ETag du catalogue"""
+    body = json.dumps(catalog, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=_json_value)
+    raw = body.encode("utf-8")
+    return {
+        "json": body,
+        # mtime fixe : même contenu -> mêmes octets compressés
+        "gzip": gzip.compress(raw, compresslevel=9, mtime=0),
+        "etag": hashlib.sha256(raw).hexdigest()[:32],
+        "size": len(raw),
+    }
+
+
+@firestore.transactional
+def _rebuild(transaction: Any, db: Any) -> tuple[str, bool]:
+    # Lectures et écriture dans une transaction : deux reconstructions
+    # concurrentes ne peuvent pas écrire un instantané périmé
+    catalog = {}
+    reads = 0
+    for collection in CATALOG_SOURCES:
+        docs = list(db.collection(collection).order_by("order").stream(transaction=transaction))
+        reads += len(docs)
+        catalog[collection] = [{"id": doc.id, **(doc.to_dict() or {})} for doc in docs]
+    snapshot_ref = db.collection(CATALOG_COLLECTION).document(CATALOG_DOCUMENT)
+    current = snapshot_ref.get(transaction=transaction)
+    metrics.count_reads(reads + 1)
+    serialized = serialize(catalog)
+    if current.exists and (current.to_dict() or {}).get("etag") == serialized["etag"]:
+        return serialized["etag"], False
+    transaction.set(snapshot_ref, {**serialized, "updatedAt": firestore.SERVER_TIMESTAMP})
+    return serialized["etag"], True
+
+
+def rebuild_catalog_snapshot(db: Any) -> str:
+    """Reconstruit catalog/snapshot si le catalogue a changé, retourne l'ETag courant"""
+    etag, changed = _rebuild(db.transaction(), db)
+    if changed:
+        metrics.inc("catalog_snapshot_rebuilds_total")
+        logger.info("Instantané du catalogue reconstruit (etag %s)", etag)
+    return etag
+
+
+def load_catalog_snapshot(db: Any) -> dict[str, Any]:
+    """
+    Instantané courant (json, gzip, etag), depuis le cache mémoire de l'instance
+    si possible ; construit à la première demande s'il n'existe pas encore
+    """
+    global _cache, _cache_loaded_at
+    with _cache_lock:
+        if _cache is not None and time.monotonic() - _cache_loaded_at < CATALOG_CACHE_SECONDS:
+            metrics.inc("catalog_snapshot_cache_total", outcome="hit")
+            return _cache
+    metrics.inc("catalog_snapshot_cache_total", outcome="miss")
+    snapshot_ref = db.collection(CATALOG_COLLECTION).document(CATALOG_DOCUMENT)
+    doc = snapshot_ref.get()
+    metrics.count_reads()
+    if not doc.exists:
+        rebuild_catalog_snapshot(db)
+        doc = snapshot_ref.get()
+        metrics.count_reads()
+    data = doc.to_dict() or {}
+    snapshot = {"json": data.get("json", "{}"), "gzip": bytes(data.get("gzip") or b""), "etag": data.get("etag", "")}
+    if not snapshot["gzip"]:
+        snapshot["gzip"] = gzip.compress(snapshot["json"].encode("utf-8"), mtime=0)
+    with _cache_lock:
+        _cache, _cache_loaded_at = snapshot, time.monotonic()
+    return snapshot
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Compare l'en-tête If-None-Match à l'ETag courant (liste, W/ et * acceptés)"""
+    for candidate in (if_none_match or "").split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.removeprefix("W/").strip('"') == etag:
+            return True
+    return False
+
+
+def cache_headers(etag: str) -> dict[str, str]:
+    return {
+        "ETag": f'"{etag}"',
+        "Cache-Control": f"public, max-age={CATALOG_MAX_AGE}, s-maxage={CATALOG_CDN_MAX_AGE}",
+        "Vary": "Accept-Encoding",
+    }
@@ -0,0 +1,96 @@
+"""
+Circuit breaker pour les appels à des services externes (Resend)
+
+États :
+- closed : les appels passent ; après `failure_threshold` échecs consécutifs, le circuit s'ouvre
+- open : les appels sont refusés immédiatement pendant `recovery_timeout` secondes
+- half_open : au plus `half_open_max_calls` appels de test passent ; un succès referme
+  le circuit, un échec le rouvre
+
+L'état est partagé par toutes les invocations d'une instance (thread-safe) et
+exposé dans la jauge "circuit_breaker_state" (0 = closed, 1 = half_open, 2 = open).
+"""
+
+import threading
+import time
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("circuit_breaker")
+
+CLOSED = "closed"
+HALF_OPEN = "half_open"
+OPEN = "open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Circuit breaker thread-safe, une instance par service externe"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 half_open_max_calls: int = 1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        metrics.set_gauge("circuit_breaker_state", _STATE_VALUES[CLOSED], circuit=name)
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def _transition(self, state: str) -> None:
+        if state == self._state:
+            return
+        logger.warning("Circuit %s: %s -> %s", self.name, self._state, state,
+                       extra={"fields": {"circuit": self.name, "circuit_state": state}})
+        self._state = state
+        metrics.set_gauge("circuit_breaker_state", _STATE_VALUES[state], circuit=self.name)
+        metrics.inc("circuit_breaker_transitions_total", circuit=self.name, state=state)
+
+    def _maybe_half_open(self) -> None:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._probes_in_flight = 0
+            self._transition(HALF_OPEN)
+
+    def allow_request(self) -> bool:
+        """Indique si un appel peut être tenté ; en half_open, réserve un appel de test"""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                return True
+            metrics.inc("circuit_breaker_rejections_total", circuit=self.name)
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            self._transition(CLOSED)
+
+    def release(self) -> None:
+        """Libère l'appel de test réservé sans changer l'état (l'appel n'a pas atteint le service)"""
+        with self._lock:
+            if self._state == HALF_OPEN:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._probes_in_flight = 0
+                self._transition(OPEN)
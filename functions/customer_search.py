@@ -0,0 +1,204 @@
+"""
+Index de recherche des clients par préfixe (nom, email, téléphone)
+
+Firestore ne sait pas chercher une sous-chaîne : create_or_update_customer
+(main.py) écrit donc dans chaque document client un tableau "searchPrefixes"
+contenant les préfixes normalisés (minuscules, sans accents) :
+- de chaque mot du nom ("Hélène Dupont" -> "he", "hel", ..., "du", "dup", ...)
+- de l'email complet et des mots de sa partie locale
+- du numéro de téléphone au format national ("+33 6 12..." -> "06", "061", ...)
+
+Une recherche est une seule requête array_contains sur le mot le plus long
+de la saisie, bornée à SEARCH_MAX_CANDIDATES documents ; les autres mots sont
+vérifiés puis les résultats classés en mémoire. Aucun parcours complet de la
+collection, quel que soit le nombre de clients.
+
+Les clients créés ou modifiés directement depuis l'application d'administration
+sont réindexés par le trigger update_customer_search_prefixes (main.py), qui
+ne réagit qu'aux changements de nom, d'email ou de téléphone.
+
+Réindexation des clients existants (ou après un changement de normalisation) :
+
+    python customer_search.py reindex
+"""
+
+import os
+import re
+import sys
+import unicodedata
+from typing import Any
+
+from firebase_admin import firestore
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("customer_search")
+
+SEARCH_PREFIXES_FIELD = "searchPrefixes"
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_LENGTH = 20
+SEARCH_MAX_CANDIDATES = int(os.environ.get("SEARCH_MAX_CANDIDATES", "200"))
+SEARCH_DEFAULT_LIMIT = 20
+
+_SEARCH_FIELDS = ["name", "email", "phone"]
+_WORD_SEPARATORS = re.compile(r"[^a-z0-9@]+")
+_EMAIL_SEPARATORS = re.compile(r"[._+\-]+")
+_PHONE_QUERY = re.compile(r"[\d\s+().\-]+")
+
+
+def fold(text: str) -> str:
+    """Minuscules sans accents ("Hélène" -> "helene")"""
+    decomposed = unicodedata.normalize("NFKD", text or "")
+    return "".join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def normalize_phone(phone: str) -> str:
+    """Chiffres du numéro au format national ("+33 6 12 34 56 78" -> "0612345678")"""
+    phone = (phone or "").strip()
+    digits = re.sub(r"\D", "", phone)
+    if phone.startswith("+33"):
+        digits = "0" + digits[2:]
+    elif digits.startswith("0033"):
+        digits = "0" + digits[4:]
+    elif digits.startswith("33") and len(digits) == 11:
+        digits = "0" + digits[2:]
+    return digits
+
+
+def _prefixes(word: str) -> list[str]:
+    word = word[:MAX_PREFIX_LENGTH]
+    return [word[:length] for length in range(MIN_PREFIX_LENGTH, len(word) + 1)]
+
+
+def name_words(name: str) -> list[str]:
+    return [w for w in _WORD_SEPARATORS.split(fold(name).replace("@", " ")) if w]
+
+
+def search_prefixes(name: str, email: str, phone: str) -> list[str]:
+    """Préfixes à stocker dans "searchPrefixes" pour un client"""
+    prefixes: set[str] = set()
+    for word in name_words(name):
+        prefixes.update(_prefixes(word))
+    email = fold(email)
+    if email:
+        prefixes.update(_prefixes(email))
+        local_part = email.split("@", 1)[0]
+        for word in _EMAIL_SEPARATORS.split(local_part):
+            prefixes.update(_prefixes(word))
+    phone = normalize_phone(phone)
+    if phone:
+        prefixes.update(_prefixes(phone))
+    return sorted(prefixes)
+
+
+def customer_prefixes(data: dict, customer_id: str) -> list[str]:
+    """Préfixes d'un document client (l'ID du document sert d'email s'il n'a pas de champ email)"""
+    return search_prefixes(data.get("name", ""), data.get("email", customer_id), data.get("phone", ""))
+
+
+def query_tokens(query: str) -> list[str]:
+    """Mots normalisés d'une saisie de recherche (numéros de téléphone au format national)"""
+    folded = fold(query)
+    if _PHONE_QUERY.fullmatch(folded):
+        # "06 12 34" : un seul numéro, pas trois mots
+        phone = normalize_phone(folded)
+        return [phone] if len(phone) >= MIN_PREFIX_LENGTH else []
+    tokens = []
+    for token in folded.split():
+        if "@" not in token:
+            tokens.extend(w for w in _WORD_SEPARATORS.split(token) if len(w) >= MIN_PREFIX_LENGTH)
+            continue
+        if len(token) >= MIN_PREFIX_LENGTH:
+            tokens.append(token)
+    return tokens
+
+
+def _token_score(token: str, name: str, words: list[str], email: str, phone: str) -> int:
+    if name.startswith(token):
+        return 4
+    if token in words:
+        return 3
+    if any(word.startswith(token) for word in words):
+        return 2
+    if email.startswith(token) or phone.startswith(token):
+        return 2
+    return 1
+
+
+def rank(candidates: list[dict], tokens: list[str]) -> list[dict]:
+    """
+    Garde les clients dont les préfixes contiennent tous les mots de la saisie
+    et les classe : début du nom, mot entier, début d'un mot, email/téléphone
+    """
+    ranked = []
+    for customer in candidates:
+        name, email, phone = customer.get("name", ""), customer.get("email", ""), customer.get("phone", "")
+        prefixes = set(search_prefixes(name, email, phone))
+        if not all(token[:MAX_PREFIX_LENGTH] in prefixes for token in tokens):
+            continue
+        folded_name, words = fold(name), name_words(name)
+        folded_email, national_phone = fold(email), normalize_phone(phone)
+        score = sum(_token_score(t, folded_name, words, folded_email, national_phone) for t in tokens)
+        ranked.append({**customer, "score": score})
+    ranked.sort(key=lambda c: (-c["score"], fold(c.get("name", "")), c.get("email", "")))
+    return ranked
+
+
+def search_customers(db: Any, query: str, limit: int = SEARCH_DEFAULT_LIMIT) -> list[dict]:
+    """
+    Recherche des clients : une requête array_contains indexée sur le mot le plus
+    long (le plus sélectif), puis filtrage et classement en mémoire
+    """
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    lookup = max(tokens, key=len)[:MAX_PREFIX_LENGTH]
+    docs = list(
+        db.collection("customers")
+        .where(SEARCH_PREFIXES_FIELD, "array_contains", lookup)
+        .select(_SEARCH_FIELDS)
+        .limit(SEARCH_MAX_CANDIDATES)
+        .stream()
+    )
+    metrics.count_reads(len(docs))
+    if len(docs) >= SEARCH_MAX_CANDIDATES:
+        logger.info("Recherche \"%s\" : limite de %s candidats atteinte", query, SEARCH_MAX_CANDIDATES)
+    candidates = []
+    for doc in docs:
+        data = doc.to_dict() or {}
+        candidates.append({"id": doc.id, **{field: data.get(field, "") for field in _SEARCH_FIELDS}})
+    return rank(candidates, tokens)[:limit]
+
+
+def reindex_customers(db: Any, page_size: int = 500) -> int:
+    """Recalcule "searchPrefixes" pour tous les clients, retourne le nombre de documents modifiés"""
+    updated = 0
+    last = None
+    writer = db.bulk_writer()
+    while True:
+        query = db.collection("customers").order_by("__name__").limit(page_size)
+        if last is not None:
+            query = query.start_after(last)
+        docs = list(query.stream())
+        metrics.count_reads(len(docs))
+        for doc in docs:
+            data = doc.to_dict() or {}
+            prefixes = customer_prefixes(data, doc.id)
+            if data.get(SEARCH_PREFIXES_FIELD) != prefixes:
+                writer.update(doc.reference, {SEARCH_PREFIXES_FIELD: prefixes})
+                updated += 1
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+    writer.close()
+    return updated
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["reindex"]:
+        sys.exit("Usage : python customer_search.py reindex")
+    import firebase_admin
+
+    firebase_admin.initialize_app()
+    print(f"{reindex_customers(firestore.client())} client(s) réindexé(s)")
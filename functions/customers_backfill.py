@@ -0,0 +1,319 @@
+"""
+Reconstruction de la collection "customers" à partir des réservations
+
+create_or_update_customer (main.py) ne crée un client qu'à la confirmation
+d'une réservation : les clients antérieurs aux Cloud Functions Python, ceux
+des réservations importées (bulk_import.py) et les noms de prestations
+devenus faux (massageTypesNames) ne sont jamais corrigés.
+
+    python customers_backfill.py
+    python customers_backfill.py --restart
+
+Déroulement :
+1. La collection "bookings" est découpée en au plus BACKFILL_PARTITIONS plages
+   d'ID de documents. Les points de découpe sont échantillonnés par Firestore
+   (partition_query, via collection_group(...).get_partitions) : les plages
+   contiennent à peu près autant de réservations, même quand les ID ne sont
+   pas aléatoires (ID "imp_..." de bulk_import.py)
+2. BACKFILL_WORKERS threads lisent les plages en parallèle, page par page avec
+   une projection, et agrègent par email : services réservés (réservations
+   confirmées), nom et téléphone les plus récents, entrées de l'historique
+   (customers/{email}/bookingHistory/{bookingId}, toutes réservations)
+3. Dès qu'une plage est agrégée, ses clients sont écrits par un BulkWriter
+   (une plage à la fois), par paquets de BACKFILL_UPSERT_CHUNK emails : les
+   clients existants sont lus par get_all, leurs services sont conservés et
+   complétés, les noms sont repris du catalogue actuel, added_at n'est ajouté
+   qu'aux nouveaux clients. Un client présent dans plusieurs plages est
+   complété à chaque plage ; le nom et le téléphone ne sont remplacés que par
+   ceux d'une réservation plus récente que lastBookingAt
+
+Le checkpoint (customers_backfill.checkpoint.json) ne contient que les points
+de découpe et les numéros des plages écrites : relancer la commande après un
+échec reprend avec les mêmes plages, sans relire les plages terminées.
+L'écriture est idempotente.
+
+Les écritures des triggers pendant la reconstruction peuvent être écrasées
+pour les champs de services : lancer la commande hors des heures d'affluence,
+ou la relancer une fois terminée.
+
+Configuration :
+- BACKFILL_PARTITIONS : nombre maximum de plages (32)
+- BACKFILL_WORKERS : lectures parallèles (8)
+- BACKFILL_PAGE_SIZE : documents lus par requête (1000)
+- BACKFILL_UPSERT_CHUNK : clients lus par get_all puis écrits (300)
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+from firebase_admin import firestore
+
+import metrics
+from customer_search import SEARCH_PREFIXES_FIELD, search_prefixes
+from structured_logging import get_logger
+
+logger = get_logger("customers_backfill")
+
+BACKFILL_PARTITIONS = int(os.environ.get("BACKFILL_PARTITIONS", "32"))
+BACKFILL_WORKERS = int(os.environ.get("BACKFILL_WORKERS", "8"))
+BACKFILL_PAGE_SIZE = int(os.environ.get("BACKFILL_PAGE_SIZE", "1000"))
+BACKFILL_UPSERT_CHUNK = int(os.environ.get("BACKFILL_UPSERT_CHUNK", "300"))
+BACKFILL_CHECKPOINT = "customers_backfill.checkpoint.json"
+
+# Même sous-collection que record_booking_history (main.py)
+BOOKING_HISTORY_COLLECTION = "bookingHistory"
+
+_BOOKING_FIELDS = ["email", "name", "phone", "massageType", "serviceType", "serviceName",
+                   "status", "date", "time", "createdAt"]
+_SERVICE_FIELDS = {"massages": ("massageTypes", "massageTypesNames"),
+                   "treatments": ("treatmentTypes", "treatmentTypesNames")}
+
+
+def partition_splits(db: Any, count: int) -> list[str]:
+    """
+    ID de réservations qui découpent "bookings" en au plus `count` plages de taille
+    comparable, échantillonnés par Firestore (partition_query)
+    """
+    splits = set()
+    for partition in db.collection_group("bookings").get_partitions(max(1, count)):
+        end = partition.end_at
+        # Requête de groupe : ne garder que les réservations de la collection racine
+        if end is not None and end.path.count("/") == 1:
+            splits.add(end.id)
+    return sorted(splits)
+
+
+def partition_bounds(splits: list[str]) -> list[tuple[str | None, str | None]]:
+    """Plages [début, fin) d'ID de documents ; la première et la dernière sont ouvertes"""
+    return list(zip([None, *splits], [*splits, None]))
+
+
+def _service(booking: dict) -> tuple[str, str] | None:
+    """(collection, service_id) comme get_service_ref (main.py) : "cocooning_60" -> ("massages", "cocooning")"""
+    massage_type = (booking.get("massageType") or "").strip()
+    if not massage_type:
+        return None
+    collection = "treatments" if booking.get("serviceType") == "soins" else "massages"
+    return collection, massage_type.split("_")[0]
+
+
+def _timestamp(booking: dict) -> float:
+    for field in ("createdAt", "date"):
+        value = booking.get(field)
+        if isinstance(value, datetime):
+            return value.timestamp()
+    return 0.0
+
+
+def _iter_partition(db: Any, bounds: tuple[str | None, str | None]) -> Iterator[Any]:
+    collection = db.collection("bookings")
+    query = collection
+    start, end = bounds
+    if start is not None:
+        query = query.where("__name__", ">=", collection.document(start))
+    if end is not None:
+        query = query.where("__name__", "<", collection.document(end))
+    query = query.order_by("__name__").select(_BOOKING_FIELDS)
+    last = None
+    while True:
+        page = query.limit(BACKFILL_PAGE_SIZE)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        metrics.count_reads(len(docs))
+        yield from docs
+        if len(docs) < BACKFILL_PAGE_SIZE:
+            return
+        last = docs[-1]
+
+
+def aggregate_partition(db: Any, bounds: tuple[str | None, str | None]) -> dict[str, dict]:
+    """
+    {email: {name, phone, latest, services: {collection: {id: serviceName}}, history: {bookingId: entrée}}}
+    pour les réservations d'une plage
+    """
+    customers: dict[str, dict] = {}
+    for doc in _iter_partition(db, bounds):
+        booking = doc.to_dict() or {}
+        email = (booking.get("email") or "").strip()
+        if not email:
+            continue
+        customer = customers.setdefault(email, {"name": "", "phone": "", "latest": -1.0, "services": {}, "history": {}})
+        service = _service(booking)
+        customer["history"][doc.id] = {
+            "date": booking.get("date"),
+            "time": booking.get("time", ""),
+            "serviceId": service[1] if service else "",
+            "serviceType": booking.get("serviceType", "massage"),
+            "status": booking.get("status", "en_attente"),
+        }
+        if booking.get("status") != "confirmed":
+            continue
+        if service:
+            names = customer["services"].setdefault(service[0], {})
+            names[service[1]] = names.get(service[1]) or booking.get("serviceName") or ""
+        timestamp = _timestamp(booking)
+        if timestamp >= customer["latest"]:
+            customer["latest"] = timestamp
+            customer["name"] = booking.get("name", "") or customer["name"]
+            customer["phone"] = booking.get("phone", "") or customer["phone"]
+    return customers
+
+
+def load_service_names(db: Any) -> dict[tuple[str, str], str]:
+    """Noms actuels de toutes les prestations (une lecture par prestation)"""
+    names = {}
+    for collection in _SERVICE_FIELDS:
+        for doc in db.collection(collection).select(["name"]).stream():
+            metrics.count_reads()
+            names[(collection, doc.id)] = (doc.to_dict() or {}).get("name", doc.id)
+    return names
+
+
+def customer_update(email: str, customer: dict, existing: dict | None,
+                    service_names: dict[tuple[str, str], str]) -> dict | None:
+    """Champs du client à écrire (set merge), None si le client n'a aucune réservation confirmée"""
+    if existing is None and not customer["services"] and customer["latest"] < 0:
+        return None
+    existing = existing or {}
+    update: dict[str, Any] = {"email": email}
+    for collection, (ids_field, names_field) in _SERVICE_FIELDS.items():
+        ids = list(existing.get(ids_field) or [])
+        old_names = list(existing.get(names_field) or [])
+        booked = customer["services"].get(collection, {})
+        ids += [service_id for service_id in booked if service_id not in ids]
+        update[ids_field] = ids
+        update[names_field] = [
+            service_names.get((collection, service_id))
+            or (old_names[index] if index < len(old_names) and old_names[index] else "")
+            or booked.get(service_id)
+            or service_id
+            for index, service_id in enumerate(ids)
+        ]
+    # Nom et téléphone de la réservation confirmée la plus récente, toutes plages confondues
+    last_booking = existing.get("lastBookingAt")
+    name, phone = existing.get("name", ""), existing.get("phone", "")
+    if customer["latest"] >= 0 and (not isinstance(last_booking, datetime)
+                                    or customer["latest"] >= last_booking.timestamp()):
+        name, phone = customer["name"] or name, customer["phone"] or phone
+        update["lastBookingAt"] = datetime.fromtimestamp(customer["latest"], timezone.utc)
+    update.update(name=name, phone=phone)
+    update[SEARCH_PREFIXES_FIELD] = search_prefixes(name, email, phone)
+    if "added_at" not in existing:
+        update["added_at"] = firestore.SERVER_TIMESTAMP
+    return update
+
+
+# Checkpoint : points de découpe et plages écrites uniquement
+
+
+def load_checkpoint(path: str) -> dict | None:
+    try:
+        with open(path, "r", encoding="utf-8") as handle:
+            checkpoint = json.load(handle)
+    except FileNotFoundError:
+        return None
+    if not isinstance(checkpoint.get("splits"), list) or not isinstance(checkpoint.get("done"), list):
+        raise SystemExit(f"{path} n'est pas un checkpoint valide, utiliser --restart")
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as handle:
+        json.dump(checkpoint, handle)
+    os.replace(temporary, path)
+
+
+def upsert_partition(db: Any, writer: Any, customers: dict[str, dict],
+                     service_names: dict[tuple[str, str], str], report: dict) -> None:
+    """Écrit les clients et l'historique d'une plage, attend la fin des écritures"""
+    collection = db.collection("customers")
+    emails = sorted(customers)
+    for offset in range(0, len(emails), BACKFILL_UPSERT_CHUNK):
+        chunk = emails[offset:offset + BACKFILL_UPSERT_CHUNK]
+        existing = {}
+        for doc in db.get_all([collection.document(email) for email in chunk]):
+            metrics.count_reads()
+            if doc.exists:
+                existing[doc.id] = doc.to_dict() or {}
+        for email in chunk:
+            customer_ref = collection.document(email)
+            update = customer_update(email, customers[email], existing.get(email), service_names)
+            if update is not None:
+                writer.set(customer_ref, update, merge=True)
+                report["customers"] += 1
+                report["created"] += email not in existing
+            history = customer_ref.collection(BOOKING_HISTORY_COLLECTION)
+            for booking_id, entry in customers[email]["history"].items():
+                writer.set(history.document(booking_id), {**entry, "updatedAt": firestore.SERVER_TIMESTAMP}, merge=True)
+            report["histories"] += len(customers[email]["history"])
+        # Écritures terminées avant la lecture du paquet suivant (un client peut revenir dans une autre plage)
+        writer.flush()
+
+
+def rebuild_customers(db: Any, checkpoint_path: str = BACKFILL_CHECKPOINT, restart: bool = False,
+                      partitions: int = BACKFILL_PARTITIONS, workers: int = BACKFILL_WORKERS) -> dict:
+    """Reconstruit les clients et leur historique, retourne le bilan"""
+    started = time.monotonic()
+    checkpoint = None if restart else load_checkpoint(checkpoint_path)
+    if checkpoint is None:
+        checkpoint = {"splits": partition_splits(db, partitions), "done": []}
+        save_checkpoint(checkpoint_path, checkpoint)
+    bounds = partition_bounds(checkpoint["splits"])
+    done = set(checkpoint["done"])
+    pending = [index for index in range(len(bounds)) if index not in done]
+    if done:
+        print(f"Reprise : {len(done)}/{len(bounds)} plage(s) déjà écrite(s)")
+
+    service_names = load_service_names(db)
+    report = {"bookings": 0, "customers": 0, "created": 0, "histories": 0}
+
+    def on_write_error(failure: Any, bulk_writer: Any) -> bool:
+        if failure.attempts < 5:
+            return True
+        logger.error("Écriture refusée pour %s (%s): %s", failure.operation.reference.path, failure.code, failure.message)
+        return False
+
+    writer = db.bulk_writer()
+    writer.on_write_error(on_write_error)
+    # Lectures en parallèle ; les plages sont écrites une à une, dans l'ordre où elles se terminent
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(aggregate_partition, db, bounds[index]): index for index in pending}
+        for future in as_completed(futures):
+            index = futures[future]
+            customers = future.result()
+            upsert_partition(db, writer, customers, service_names, report)
+            report["bookings"] += sum(len(customer["history"]) for customer in customers.values())
+            done.add(index)
+            checkpoint["done"] = sorted(done)
+            save_checkpoint(checkpoint_path, checkpoint)
+            print(f"Plage {index + 1}/{len(bounds)} : {len(customers)} client(s) ({len(done)}/{len(bounds)} terminées)")
+    writer.close()
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    report["seconds"] = round(time.monotonic() - started, 2)
+    metrics.inc("customers_backfill_total", report["customers"])
+    logger.info("Reconstruction des clients terminée: %s", report)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruit la collection customers à partir des réservations")
+    parser.add_argument("--restart", action="store_true", help="ignore le checkpoint et repart du début")
+    parser.add_argument("--checkpoint", default=BACKFILL_CHECKPOINT, help="fichier de progression")
+    args = parser.parse_args()
+
+    import firebase_admin
+
+    firebase_admin.initialize_app()
+    report = rebuild_customers(firestore.client(), checkpoint_path=args.checkpoint, restart=args.restart)
+    print(f"Terminé en {report['seconds']} s : {report['bookings']} réservation(s), "
+          f"{report['customers']} écriture(s) de client dont {report['created']} nouveau(x), "
+          f"{report['histories']} entrée(s) d'historique")
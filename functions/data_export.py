@@ -0,0 +1,246 @@
+"""
+Export en flux des réservations, clients et bons cadeaux (CSV ou NDJSON)
+
+L'endpoint export_data (main.py) ne charge jamais une collection en mémoire :
+- les documents sont lus par pages de EXPORT_PAGE_SIZE avec un curseur
+  (start_after) et une projection (select) limitée aux colonnes exportées
+- chaque ligne est encodée dès sa lecture par un générateur
+- les lignes sont regroupées en blocs d'environ EXPORT_CHUNK_BYTES puis
+  compressées à la volée (gzip) si le client l'accepte
+- la réponse est envoyée en chunked transfer au fil de la lecture
+
+La mémoire utilisée est la même pour cent lignes ou cent mille.
+
+Paramètres de la requête :
+- collection : bookings, bookingsArchive, customers ou giftVouchers
+- format : csv (défaut) ou ndjson
+- from / to : dates incluses (AAAA-MM-JJ, heure de Paris) sur le champ de date
+  de la collection (date du rendez-vous, date d'ajout du client, date d'achat du bon)
+- status : statut ou liste de statuts séparés par des virgules (bookings, giftVouchers)
+
+Configuration :
+- EXPORT_PAGE_SIZE : documents lus par requête Firestore (500)
+- EXPORT_CHUNK_BYTES : taille des blocs envoyés au client (65536)
+"""
+
+import csv
+import io
+import json
+import os
+import zlib
+from datetime import date, datetime, time, timedelta
+from typing import Any, Iterable, Iterator
+from zoneinfo import ZoneInfo
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("data_export")
+
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "500"))
+EXPORT_CHUNK_BYTES = int(os.environ.get("EXPORT_CHUNK_BYTES", "65536"))
+EXPORT_TIMEZONE = ZoneInfo("Europe/Paris")
+
+# Collection -> colonnes exportées, champ de date filtrable, champ de statut (ou None)
+EXPORTS: dict[str, dict[str, Any]] = {
+    "bookings": {
+        "fields": ["name", "email", "phone", "date", "time", "massageType", "serviceType", "serviceName",
+                   "duration", "status", "isAtHome", "homeAddress", "notes", "createdAt"],
+        "date_field": "date",
+        "status_field": "status",
+    },
+    # Réservations archivées (booking_archive.py) : mêmes colonnes
+    "bookingsArchive": {
+        "fields": ["name", "email", "phone", "date", "time", "massageType", "serviceType", "serviceName",
+                   "duration", "status", "isAtHome", "homeAddress", "notes", "createdAt", "archivedAt"],
+        "date_field": "date",
+        "status_field": "status",
+    },
+    "customers": {
+        "fields": ["email", "name", "phone", "massageTypesNames", "treatmentTypesNames", "added_at"],
+        "date_field": "added_at",
+        "status_field": None,
+    },
+    "giftVouchers": {
+        "fields": ["purchaserName", "purchaserEmail", "recipientName", "recipientEmail", "amount", "message",
+                   "status", "createdAt", "paidAt", "expiresAt", "paypalOrderId"],
+        "date_field": "createdAt",
+        "status_field": "status",
+    },
+}
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+
+class ExportError(ValueError):
+    """Paramètres d'export invalides (réponse 400)"""
+
+
+def parse_day(value: str, end: bool = False) -> datetime | None:
+    """Début du jour (ou du lendemain si `end`) en heure de Paris, None si vide"""
+    if not value:
+        return None
+    try:
+        day = date.fromisoformat(value)
+    except ValueError:
+        raise ExportError(f"Date invalide: {value} (format attendu AAAA-MM-JJ)")
+    if end:
+        day += timedelta(days=1)
+    return datetime.combine(day, time.min, tzinfo=EXPORT_TIMEZONE)
+
+
+def build_query(db: Any, collection: str, start: datetime | None, end: datetime | None, statuses: list[str]) -> Any:
+    """Requête filtrée et triée (tri stable pour la pagination par curseur)"""
+    config = EXPORTS[collection]
+    date_field = config["date_field"]
+    query = db.collection(collection)
+    if statuses:
+        if not config["status_field"]:
+            raise ExportError(f"La collection {collection} n'a pas de statut")
+        if len(statuses) == 1:
+            query = query.where(config["status_field"], "==", statuses[0])
+        else:
+            query = query.where(config["status_field"], "in", statuses)
+    if start is not None:
+        query = query.where(date_field, ">=", start)
+    if end is not None:
+        query = query.where(date_field, "<", end)
+    if start is not None or end is not None:
+        # Le filtre d'intervalle impose de trier d'abord sur le champ de date
+        query = query.order_by(date_field)
+    return query.order_by("__name__").select(config["fields"])
+
+
+def iter_documents(query: Any, page_size: int = EXPORT_PAGE_SIZE) -> Iterator[Any]:
+    """Documents de la requête, page par page (au plus une page en mémoire)"""
+    last = None
+    while True:
+        page = query.limit(page_size)
+        if last is not None:
+            page = page.start_after(last)
+        docs = list(page.stream())
+        metrics.count_reads(len(docs))
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+
+
+def _plain(value: Any) -> Any:
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(EXPORT_TIMEZONE)
+        return value.isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, dict):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _csv_cell(value: Any) -> str:
+    value = _plain(value)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "oui" if value else "non"
+    if isinstance(value, list):
+        value = " | ".join(str(v) for v in value)
+    elif isinstance(value, dict):
+        value = json.dumps(value, ensure_ascii=False)
+    text = str(value)
+    # Données saisies par les visiteurs : pas de formule exécutée à l'ouverture dans un tableur
+    if text[:1] in ("=", "@") or (text[:1] in ("+", "-") and not text[1:2].isdigit()):
+        text = "'" + text
+    return text
+
+
+def encode_rows(docs: Iterable[Any], fields: list[str], export_format: str) -> Iterator[str]:
+    """Une ligne encodée (CSV avec en-tête, ou NDJSON) par document"""
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def line(row: list[Any]) -> str:
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerow(row)
+            return buffer.getvalue()
+
+        # BOM : accents corrects à l'ouverture dans Excel
+        yield "\ufeff" + line(["id", *fields])
+        for doc in docs:
+            data = doc.to_dict() or {}
+            yield line([doc.id, *(_csv_cell(data.get(field)) for field in fields)])
+    else:
+        for doc in docs:
+            data = doc.to_dict() or {}
+            row = {"id": doc.id, **{field: _plain(data.get(field)) for field in fields}}
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+
+def chunked(lines: Iterable[str], chunk_bytes: int = EXPORT_CHUNK_BYTES) -> Iterator[bytes]:
+    """Regroupe les lignes en blocs d'environ `chunk_bytes` octets"""
+    parts: list[bytes] = []
+    size = 0
+    for line in lines:
+        data = line.encode("utf-8")
+        parts.append(data)
+        size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(parts)
+            parts, size = [], 0
+    if parts:
+        yield b"".join(parts)
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compression gzip au fil de l'eau"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(db: Any, collection: str, export_format: str, start: datetime | None = None,
+                  end: datetime | None = None, statuses: list[str] | None = None,
+                  compress: bool = False) -> Iterator[bytes]:
+    """
+    Flux d'octets de l'export (les erreurs de paramètres sont levées avant le
+    premier octet : ExportError)
+    """
+    if collection not in EXPORTS:
+        raise ExportError(f"Collection inconnue: {collection}")
+    if export_format not in FORMATS:
+        raise ExportError(f"Format inconnu: {export_format}")
+    query = build_query(db, collection, start, end, statuses or [])
+    fields = EXPORTS[collection]["fields"]
+
+    count = 0
+
+    def counted() -> Iterator[Any]:
+        nonlocal count
+        for doc in iter_documents(query):
+            count += 1
+            yield doc
+
+    def rows() -> Iterator[str]:
+        try:
+            yield from encode_rows(counted(), fields, export_format)
+        except Exception:
+            # Les en-têtes sont déjà partis : l'export est tronqué, l'erreur reste dans les logs
+            logger.exception("Export %s interrompu après %s ligne(s)", collection, count)
+            raise
+        finally:
+            metrics.inc("export_rows_total", count, collection=collection, format=export_format)
+        logger.info("Export %s (%s) terminé: %s ligne(s)", collection, export_format, count)
+
+    stream = chunked(rows())
+    return gzip_stream(stream) if compress else stream
@@ -0,0 +1,231 @@
+"""
+Finalisation du HTML des emails : CSS en ligne et minification
+
+Les templates de main.py gardent un bloc <style> lisible ; le décorateur
+`email_template` transforme leur résultat avant l'envoi :
+- les règles simples (balise, .classe, balise.classe) sont recopiées dans
+  l'attribut style de chaque élément, car de nombreux clients mail ignorent
+  les blocs <style> ; les règles non transposables restent dans un <style> minifié,
+  ainsi que celles d'éléments répétés (lignes du récapitulatif admin) dont la
+  copie sur chaque élément grossirait l'email au lieu de le réduire
+- les espaces d'indentation et entre balises sont supprimés, sauf dans les
+  éléments en white-space: pre* (messages des clients)
+
+Chaque feuille de style n'est analysée qu'une fois par instance (cache) :
+seul le contenu variable est traité à chaque rendu.
+
+EMAIL_HTML_BUDGET_BYTES (16 Ko par défaut) est la taille maximale attendue
+d'un email rendu : un dépassement est signalé dans les logs et mesuré
+(métrique email_html_bytes) ; `python benchmark.py email-sizes` échoue si un
+template dépasse ce budget avec les données de test, ou si la finalisation
+le grossit.
+"""
+
+import functools
+import os
+import re
+from typing import Callable
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("email_html")
+
+EMAIL_HTML_BUDGET_BYTES = int(os.environ.get("EMAIL_HTML_BUDGET_BYTES", "16384"))
+
+# Bornes de l'histogramme des tailles d'emails (octets)
+SIZE_BUCKETS = (2048, 4096, 8192, 12288, 16384, 32768, 65536, 102400)
+
+_STYLE_BLOCK = re.compile(r"<style[^>]*>(.*?)</style>", re.DOTALL | re.IGNORECASE)
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+_CSS_RULE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+_SIMPLE_SELECTOR = re.compile(r"^([a-z][a-z0-9]*)?(?:\.([\w-]+))?$", re.IGNORECASE)
+_START_TAG = re.compile(r"<([a-z][a-z0-9]*)(\s[^<>]*?)?(/?)>", re.IGNORECASE)
+_ATTRIBUTE = re.compile(r'\s([\w-]+)\s*=\s*"([^"]*)"')
+_PRESERVED = re.compile(
+    r"<(p|pre|div|span|td)\b[^>]*white-space:\s*pre[^>]*>.*?</\1>",
+    re.DOTALL | re.IGNORECASE,
+)
+_HTML_COMMENT = re.compile(r"<!--(?!\[if).*?-->", re.DOTALL)
+_BETWEEN_TAGS = re.compile(r"([>\x00])\s+([<\x00])")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _minify_declarations(declarations: str) -> str:
+    parts = []
+    for declaration in declarations.split(";"):
+        if ":" not in declaration:
+            continue
+        prop, value = declaration.split(":", 1)
+        parts.append(f"{prop.strip().lower()}:{_WHITESPACE.sub(' ', value.strip())}")
+    return ";".join(parts)
+
+
+@functools.lru_cache(maxsize=64)
+def compile_stylesheet(css: str) -> tuple[tuple[tuple[str | None, str | None, str], ...], str]:
+    """
+    Analyse une feuille de style (une seule fois grâce au cache)
+    Retourne (règles transposables [(balise, classe, déclarations)], CSS restant minifié)
+    """
+    rules = []
+    leftover = []
+    for selectors, declarations in _CSS_RULE.findall(_CSS_COMMENT.sub("", css)):
+        declarations = _minify_declarations(declarations)
+        if not declarations:
+            continue
+        kept = []
+        for selector in (s.strip() for s in selectors.split(",")):
+            match = _SIMPLE_SELECTOR.match(selector)
+            if match and (match.group(1) or match.group(2)):
+                rules.append((match.group(1) and match.group(1).lower(), match.group(2), declarations))
+            else:
+                kept.append(selector)
+        if kept:
+            leftover.append(f"{','.join(kept)}{{{declarations}}}")
+    # Les règles de balise passent avant les règles de classe (spécificité CSS)
+    rules.sort(key=lambda rule: rule[1] is not None)
+    return tuple(rules), "".join(leftover)
+
+
+def _matching_rules(tag: str, classes: set[str],
+                    rules: list[tuple[str | None, str | None, str]]) -> list[int]:
+    return [
+        index for index, (rule_tag, rule_class, _) in enumerate(rules)
+        if (rule_tag is None or rule_tag == tag) and (rule_class is None or rule_class in classes)
+    ]
+
+
+def _element(match: re.Match) -> tuple[str, dict[str, str]]:
+    attributes = match.group(2) or ""
+    return match.group(1).lower(), dict((name.lower(), value) for name, value in _ATTRIBUTE.findall(attributes))
+
+
+def _kept_rules(html: str, rules: list[tuple[str | None, str | None, str]]) -> set[int]:
+    """
+    Règles à laisser dans le <style> plutôt qu'en ligne : celles dont la copie
+    sur chaque élément coûte plus d'octets que la règle elle-même (et, pour une
+    classe, que l'attribut class conservé), c'est-à-dire les règles d'éléments répétés
+    """
+    counts = [0] * len(rules)
+    for match in _START_TAG.finditer(html):
+        tag, parsed = _element(match)
+        for index in _matching_rules(tag, set(parsed.get("class", "").split()), rules):
+            counts[index] += 1
+    kept = set()
+    for index, ((rule_tag, rule_class, declarations), count) in enumerate(zip(rules, counts)):
+        inline_cost = count * (len(declarations) + 1)
+        kept_cost = len(rule_tag or "") + len(declarations) + 2
+        if rule_class:
+            kept_cost += len(rule_class) + 1 + count * (len(rule_class) + len(' class=""'))
+        if count and kept_cost < inline_cost:
+            kept.add(index)
+    return kept
+
+
+def _properties(declarations: str) -> set[str]:
+    return {declaration.split(":", 1)[0] for declaration in declarations.split(";")}
+
+
+def inline_css(html: str) -> str:
+    """
+    Recopie les règles des blocs <style> dans l'attribut style des éléments,
+    sauf celles qui alourdiraient l'email (voir _kept_rules)
+    """
+    rules: list[tuple[str | None, str | None, str]] = []
+    leftover = []
+
+    def extract(match: re.Match) -> str:
+        compiled, rest = compile_stylesheet(match.group(1))
+        rules.extend(compiled)
+        if rest:
+            leftover.append(rest)
+        return ""
+
+    html = _STYLE_BLOCK.sub(extract, html)
+    kept = _kept_rules(html, rules)
+    # Les règles de classe gardées passent après les règles de balise, comme dans compile_stylesheet
+    kept_css = "".join(
+        f"{rule_tag or ''}{'.' + rule_class if rule_class else ''}{{{declarations}}}"
+        for index, (rule_tag, rule_class, declarations) in enumerate(rules) if index in kept
+    )
+    style = kept_css + "".join(leftover)
+    if style:
+        html = re.sub(r"</head>", f"<style>{style}</style></head>", html, count=1, flags=re.IGNORECASE)
+    # Classes encore utilisées par le <style> : l'attribut class doit les garder
+    styled_classes = set(re.findall(r"\.([\w-]+)", style))
+
+    def apply(match: re.Match) -> str:
+        tag, parsed = _element(match)
+        classes = parsed.get("class", "").split()
+        matched = _matching_rules(tag, set(classes), rules)
+        # Une règle de classe gardée l'emporte sur une règle de balise en ligne : ses propriétés n'y sont pas recopiées
+        overridden = set().union(*(
+            _properties(rules[index][2]) for index in matched if index in kept and rules[index][1]
+        ))
+        styles = []
+        for index in matched:
+            rule_tag, rule_class, declarations = rules[index]
+            if index in kept:
+                continue
+            if overridden and rule_class is None:
+                declarations = ";".join(
+                    d for d in declarations.split(";") if d.split(":", 1)[0] not in overridden
+                )
+            if declarations:
+                styles.append(declarations)
+        if "style" in parsed:
+            styles.append(_minify_declarations(parsed["style"]))
+        kept_classes = [name for name in classes if name in styled_classes]
+        if not styles and kept_classes == classes:
+            return match.group(0)
+        attributes = _ATTRIBUTE.sub(
+            lambda attr: "" if attr.group(1).lower() in ("style", "class") else attr.group(0),
+            match.group(2) or "",
+        )
+        if kept_classes:
+            attributes += f' class="{" ".join(kept_classes)}"'
+        if styles:
+            attributes += f' style="{";".join(styles)}"'
+        return f"<{match.group(1)}{attributes}{match.group(3)}>"
+
+    return _START_TAG.sub(apply, html)
+
+
+def minify_html(html: str) -> str:
+    """Supprime commentaires et espaces superflus, sans toucher aux éléments en white-space: pre*"""
+    preserved: list[str] = []
+
+    def protect(match: re.Match) -> str:
+        preserved.append(match.group(0))
+        return f"\x00{len(preserved) - 1}\x00"
+
+    html = _PRESERVED.sub(protect, html)
+    html = _HTML_COMMENT.sub("", html)
+    html = _WHITESPACE.sub(" ", html)
+    html = _BETWEEN_TAGS.sub(r"\1\2", html).strip()
+    return re.sub(r"\x00(\d+)\x00", lambda m: preserved[int(m.group(1))], html)
+
+
+def finalize_html(html: str) -> str:
+    """CSS en ligne puis minification"""
+    return minify_html(inline_css(html))
+
+
+def email_template(func: Callable[..., str]) -> Callable[..., str]:
+    """
+    Décorateur des fonctions get_html_template_* : retourne le HTML finalisé
+    et mesure sa taille (métrique email_html_bytes, label template)
+    """
+    template_name = func.__name__.removeprefix("get_html_template_")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs) -> str:
+        html = finalize_html(func(*args, **kwargs))
+        size = len(html.encode("utf-8"))
+        metrics.observe("email_html_bytes", size, buckets=SIZE_BUCKETS, template=template_name)
+        if size > EMAIL_HTML_BUDGET_BYTES:
+            logger.warning("Email %s de %s octets, au-delà du budget de %s octets",
+                           template_name, size, EMAIL_HTML_BUDGET_BYTES)
+        return html
+
+    return wrapper
@@ -0,0 +1,288 @@
+"""
+Envoi des emails via Resend
+
+Tous les envois passent par `send_email`, qui :
+- enregistre les métriques d'envoi par type d'email (metrics.py)
+- réessaie les erreurs temporaires et les rate limits selon la politique commune
+  (retry_policy.py : classification par code HTTP, Retry-After, jitter, budget)
+- protège Resend par un circuit breaker (circuit_breaker.py) : quand Resend est
+  en panne, les emails ne sont plus tentés mais stockés dans la collection
+  "deferredEmails", puis renvoyés par `replay_deferred_emails` (fonction planifiée
+  retry_deferred_emails dans main.py)
+- compte les envois dans le budget journalier et mensuel (send_budget.py) et
+  diffère les emails peu prioritaires quand le budget restant est faible
+
+Les envois en nombre (rappels de rendez-vous...) passent par `send_batch`, qui
+utilise l'API batch de Resend (100 emails par appel) en respectant le débit autorisé.
+
+Configuration :
+- RESEND_REQUESTS_PER_SECOND : appels Resend par seconde pour `send_batch` (2)
+- RESEND_BREAKER_FAILURES : échecs consécutifs avant ouverture du circuit (5)
+- RESEND_BREAKER_RECOVERY_SECONDS : durée d'ouverture avant un appel de test (30)
+"""
+
+import os
+import threading
+import time
+from typing import Any, Callable
+
+import resend
+from firebase_admin import firestore
+
+import metrics
+import send_budget
+from circuit_breaker import CircuitBreaker
+from retry_policy import (
+    DEFAULT_POLICY, PERMANENT, RATE_LIMITED, TRANSIENT, RetryPolicy, classify_error, remaining_budget, status_code,
+)
+from structured_logging import get_logger, log_context
+
+logger = get_logger("email_sender")
+
+DEFERRED_EMAILS_COLLECTION = "deferredEmails"
+
+# API batch de Resend : 100 emails maximum par appel
+RESEND_BATCH_SIZE = 100
+RESEND_REQUESTS_PER_SECOND = float(os.environ.get("RESEND_REQUESTS_PER_SECOND", "2"))
+
+resend_breaker = CircuitBreaker(
+    "resend",
+    failure_threshold=int(os.environ.get("RESEND_BREAKER_FAILURES", "5")),
+    recovery_timeout=float(os.environ.get("RESEND_BREAKER_RECOVERY_SECONDS", "30")),
+)
+
+
+_resend_lock = threading.Lock()
+
+
+def configure_resend(api_key: str) -> None:
+    """
+    Fixe la clé API du SDK Resend (globale au module resend) une seule fois par instance
+    La clé est la même pour toutes les invocations : les invocations concurrentes
+    (concurrence > 1) ne la réécrivent pas pendant un envoi en cours
+    """
+    if resend.api_key == api_key:
+        return
+    with _resend_lock:
+        if resend.api_key != api_key:
+            resend.api_key = api_key
+
+
+class CircuitOpenError(Exception):
+    """Levée quand le circuit Resend s'ouvre entre deux tentatives d'envoi"""
+
+    retryable = False
+
+
+def is_outage_error(error: Exception) -> bool:
+    """
+    Indique si l'erreur signale une indisponibilité de Resend (5xx, erreur réseau)
+    Les erreurs 4xx (validation, rate limit...) prouvent au contraire que Resend répond
+    """
+    return classify_error(error) == TRANSIENT
+
+
+def _call_resend(func: Callable[[], Any], email_type: str, count: int = 1) -> Any:
+    """Appelle Resend et met à jour le circuit breaker et les métriques (`count` emails)"""
+    try:
+        with metrics.timer("email_send_seconds", type=email_type):
+            result = func()
+    except Exception as e:
+        metrics.inc("email_failures_total", count, type=email_type)
+        if classify_error(e) == RATE_LIMITED:
+            metrics.inc("email_rate_limited_total", type=email_type)
+        if is_outage_error(e):
+            resend_breaker.record_failure()
+        elif status_code(e) is not None:
+            resend_breaker.record_success()
+        else:
+            # Erreur locale (payload invalide...) : Resend n'a pas répondu, l'état du circuit ne change pas
+            resend_breaker.release()
+        raise
+    resend_breaker.record_success()
+    metrics.inc("emails_sent_total", count, type=email_type)
+    send_budget.record(count)
+    return result
+
+
+def _deliver(email_data: dict, email_type: str) -> Any:
+    """Envoie l'email via Resend et met à jour le circuit breaker et les métriques"""
+    return _call_resend(lambda: resend.Emails.send(email_data), email_type)
+
+
+def _call_with_policy(deliver: Callable[[], Any], email_type: str, policy: RetryPolicy) -> Any:
+    """
+    Appelle `deliver` selon `policy` en vérifiant le circuit avant chaque nouvel essai
+    Lève CircuitOpenError si le circuit s'ouvre entre deux tentatives
+    """
+    attempts = 0
+
+    def attempt() -> Any:
+        nonlocal attempts
+        attempts += 1
+        if attempts > 1 and not resend_breaker.allow_request():
+            raise CircuitOpenError("Circuit Resend ouvert")
+        with log_context(attempt=attempts, email_type=email_type):
+            return deliver()
+
+    def on_retry(attempt_number: int, error: Exception, wait: float) -> None:
+        metrics.inc("email_retries_total", type=email_type)
+        logger.info("Nouvel essai de l'email %s dans %.2fs (tentative %s): %s", email_type, wait, attempt_number + 1, error)
+
+    try:
+        return policy.call(attempt, on_retry)
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class != PERMANENT:
+            logger.warning("Email %s non envoyé après %s tentative(s) (%s): %s", email_type, attempts, error_class, e)
+        raise
+
+
+def defer_email(email_data: dict, email_type: str, reason: str) -> str:
+    """Stocke un email dans "deferredEmails" pour un envoi ultérieur, retourne l'ID du document"""
+    doc_ref = firestore.client().collection(DEFERRED_EMAILS_COLLECTION).document()
+    doc_ref.set({
+        "email": email_data,
+        "type": email_type,
+        "reason": reason,
+        "attempts": 0,
+        "createdAt": firestore.SERVER_TIMESTAMP,
+    })
+    metrics.inc("emails_deferred_total", type=email_type, reason=reason)
+    logger.warning("Email %s différé (%s): %s", email_type, reason, doc_ref.id)
+    return doc_ref.id
+
+
+def send_email(email_data: dict, email_type: str, policy: RetryPolicy = DEFAULT_POLICY) -> Any:
+    """
+    Envoie un email via Resend en enregistrant les métriques d'envoi
+    (emails_sent_total, email_failures_total, email_retries_total... par type d'email)
+    Les rate limits et erreurs temporaires sont réessayés selon `policy`
+    Si le circuit Resend est ouvert, si l'email n'a pas pu partir dans le budget
+    de l'invocation, ou si le budget d'envoi restant est réservé aux emails plus
+    prioritaires, il est différé et {"deferred": <id>} est retourné
+    Les erreurs définitives (validation, email invalide...) sont relancées à l'appelant
+    """
+    if not send_budget.allows(email_type):
+        return {"deferred": defer_email(email_data, email_type, reason="budget")}
+    if not resend_breaker.allow_request():
+        return {"deferred": defer_email(email_data, email_type, reason="circuit_open")}
+    try:
+        return _call_with_policy(lambda: _deliver(email_data, email_type), email_type, policy)
+    except CircuitOpenError:
+        return {"deferred": defer_email(email_data, email_type, reason="circuit_open")}
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class == PERMANENT:
+            raise
+        return {"deferred": defer_email(email_data, email_type, reason=error_class)}
+
+
+def _send_chunk(emails: list[dict], email_type: str, policy: RetryPolicy) -> list[Any]:
+    """Envoie au plus RESEND_BATCH_SIZE emails en un seul appel à l'API batch de Resend"""
+    if not send_budget.allows(email_type, len(emails)):
+        return [{"deferred": defer_email(email, email_type, reason="budget")} for email in emails]
+    if not resend_breaker.allow_request():
+        return [{"deferred": defer_email(email, email_type, reason="circuit_open")} for email in emails]
+    try:
+        response = _call_with_policy(
+            lambda: _call_resend(lambda: resend.Batch.send(emails), email_type, len(emails)),
+            email_type,
+            policy,
+        )
+    except CircuitOpenError:
+        return [{"deferred": defer_email(email, email_type, reason="circuit_open")} for email in emails]
+    except Exception as e:
+        error_class = classify_error(e)
+        if error_class != PERMANENT:
+            return [{"deferred": defer_email(email, email_type, reason=error_class)} for email in emails]
+        # Une seule adresse invalide fait échouer tout le batch : envoi unitaire pour isoler l'erreur
+        logger.warning("Batch %s refusé (%s), envoi email par email", email_type, e)
+        results = []
+        for email in emails:
+            try:
+                results.append(send_email(email, email_type, policy))
+            except Exception:
+                logger.exception("Erreur lors de l'envoi de l'email %s à %s", email_type, email.get("to"))
+                results.append(None)
+        return results
+    data = (response or {}).get("data") or []
+    return list(data) + [{}] * (len(emails) - len(data))
+
+
+def send_batch(emails: list[dict], email_type: str, policy: RetryPolicy = DEFAULT_POLICY) -> list[Any]:
+    """
+    Envoie une liste d'emails par paquets de RESEND_BATCH_SIZE via l'API batch de Resend,
+    en espaçant les appels selon RESEND_REQUESTS_PER_SECOND
+    Retourne un résultat par email, dans l'ordre : réponse Resend, {"deferred": <id>}
+    si l'email a été différé, ou None en cas d'erreur définitive
+    """
+    results: list[Any] = []
+    interval = 1.0 / RESEND_REQUESTS_PER_SECOND if RESEND_REQUESTS_PER_SECOND > 0 else 0.0
+    last_call = None
+    for start in range(0, len(emails), RESEND_BATCH_SIZE):
+        if last_call is not None:
+            wait = interval - (time.monotonic() - last_call)
+            if wait > 0:
+                time.sleep(wait)
+        last_call = time.monotonic()
+        results.extend(_send_chunk(emails[start:start + RESEND_BATCH_SIZE], email_type, policy))
+    return results
+
+
+def replay_deferred_emails(limit: int = 50) -> int:
+    """
+    Renvoie les emails différés, du plus ancien au plus récent, `limit` tentatives au plus
+    S'arrête dès que le circuit est ouvert ; les emails que le budget d'envoi
+    ne permet pas encore restent en attente et ne comptent pas dans `limit` :
+    la lecture continue page par page au-delà (start_after), pour qu'une file
+    de rappels retenus ne bloque pas les emails clients plus récents.
+    Retourne le nombre d'emails envoyés
+    """
+    db = firestore.client()
+    query = db.collection(DEFERRED_EMAILS_COLLECTION).order_by("createdAt").limit(limit)
+    sent = 0
+    attempted = 0
+    held = 0
+    stop = False
+    while not stop:
+        page = list(query.stream())
+        metrics.count_reads(len(page))
+        for doc in page:
+            data = doc.to_dict() or {}
+            # Budget vérifié avant le circuit : en half_open, allow_request réserve l'appel de test,
+            # qui ne serait jamais libéré si l'email était ensuite laissé en attente
+            if not send_budget.allows(data.get("type", "deferred")):
+                held += 1
+                continue
+            if attempted >= limit:
+                stop = True
+                break
+            if not resend_breaker.allow_request():
+                logger.info("Circuit Resend ouvert, reprise des emails différés interrompue")
+                stop = True
+                break
+            attempted += 1
+            try:
+                DEFAULT_POLICY.call(lambda: _deliver(data.get("email", {}), data.get("type", "deferred")))
+            except Exception as e:
+                if classify_error(e) != PERMANENT:
+                    # Resend toujours indisponible ou limité : réessayer au prochain passage
+                    doc.reference.update({"attempts": firestore.Increment(1), "lastError": str(e)})
+                    logger.warning("Échec du renvoi de l'email différé %s: %s", doc.id, e)
+                    stop = True
+                    break
+                # Erreur définitive (email invalide...) : inutile de réessayer
+                logger.error("Email différé %s abandonné: %s", doc.id, e)
+                doc.reference.delete()
+                continue
+            doc.reference.delete()
+            sent += 1
+        if len(page) < limit or remaining_budget() < 10:
+            break
+        query = query.start_after(page[-1])
+    if held:
+        logger.info("%s email(s) différé(s) retenu(s) par le budget d'envoi", held)
+    if sent:
+        logger.info("%s email(s) différé(s) renvoyé(s)", sent)
+    return sent
@@ -0,0 +1,65 @@
+"""
+Outils communs aux endpoints HTTP d'administration
+
+Les endpoints réservés à l'admin (recherche de clients...) sont appelés par
+l'application d'administration avec le jeton Firebase de l'utilisateur connecté :
+
+    Authorization: Bearer <ID token>
+
+Comme dans firestore.rules, tout utilisateur authentifié est administrateur.
+
+Configuration :
+- ADMIN_CORS_ORIGINS : origines autorisées, séparées par des virgules ("*" par défaut)
+"""
+
+import json
+import os
+from typing import Any
+
+from firebase_admin import auth
+from firebase_functions import https_fn, options
+
+from structured_logging import get_logger
+
+logger = get_logger("http_auth")
+
+ADMIN_CORS = options.CorsOptions(
+    cors_origins=[o.strip() for o in os.environ.get("ADMIN_CORS_ORIGINS", "*").split(",") if o.strip()],
+    cors_methods=["get", "post"],
+)
+
+_AUTH_ERRORS = (
+    ValueError,
+    auth.InvalidIdTokenError,
+    auth.ExpiredIdTokenError,
+    auth.RevokedIdTokenError,
+    auth.CertificateFetchError,
+    auth.UserDisabledError,
+)
+
+
+def authenticate(req: https_fn.Request) -> dict | None:
+    """Jeton décodé de l'utilisateur si l'en-tête Authorization est valide, sinon None"""
+    header = req.headers.get("Authorization", "")
+    scheme, _, token = header.partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        return None
+    try:
+        return auth.verify_id_token(token.strip())
+    except _AUTH_ERRORS as e:
+        logger.warning("Jeton d'authentification refusé: %s", e)
+        return None
+
+
+def json_response(body: Any, status: int = 200, headers: dict[str, str] | None = None) -> https_fn.Response:
+    """Réponse JSON (mêmes conventions que paypal_webhook)"""
+    return https_fn.Response(
+        json.dumps(body, ensure_ascii=False, default=str),
+        status=status,
+        headers=headers,
+        mimetype="application/json",
+    )
+
+
+def unauthorized() -> https_fn.Response:
+    return json_response({"error": "Unauthorized"}, status=401, headers={"WWW-Authenticate": "Bearer"})
@@ -0,0 +1,282 @@
+"""
+Variantes redimensionnées des photos de prestations
+
+L'application d'administration envoie les photos en taille réelle dans
+massages/{id}/<horodatage>.jpg et treatments/{id}/<horodatage>.jpg. La fonction
+generate_image_variants (main.py), déclenchée à la fin de chaque envoi, produit
+pour chaque largeur de IMAGE_VARIANT_WIDTHS une version WebP et une version JPEG :
+
+    massages/{id}/variants/<horodatage>_800w.webp
+    massages/{id}/variants/<horodatage>_800w.jpg
+
+puis enregistre leurs URL dans le champ "imageVariants" du massage ou du soin :
+
+    {"source": "massages/{id}/<horodatage>.jpg", "widths": [400, 800, 1200],
+     "webp": {"400": url, ...}, "jpeg": {"400": url, ...}}
+
+Les variantes portent la métadonnée resized=true et sont rangées sous
+"variants/" : leur propre envoi ne redéclenche pas de traitement. Une image
+n'est jamais agrandie. Les fichiers sont nommés d'après l'original (horodatage
+unique) et servis avec un Cache-Control d'un an.
+
+Les encodages d'une image passent par un pool de IMAGE_RESIZE_WORKERS threads
+(Pillow libère le GIL pendant le redimensionnement et l'encodage), et au plus
+IMAGE_MAX_CONCURRENT images sont traitées en même temps par instance, ce qui
+borne la mémoire quand plusieurs photos arrivent ensemble.
+
+Photos existantes (mêmes bornes de parallélisme) :
+
+    python image_variants.py backfill
+
+Configuration :
+- IMAGE_VARIANT_WIDTHS : largeurs en pixels, séparées par des virgules ("400,800,1200")
+- IMAGE_WEBP_QUALITY / IMAGE_JPEG_QUALITY : qualité d'encodage (80 / 82)
+- IMAGE_RESIZE_WORKERS : threads d'encodage par image (2)
+- IMAGE_MAX_CONCURRENT : images traitées simultanément par instance (2)
+"""
+
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from urllib.parse import quote, unquote, urlparse
+
+from firebase_admin import firestore, storage
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("image_variants")
+
+IMAGE_COLLECTIONS = ("massages", "treatments")
+IMAGE_VARIANTS_FIELD = "imageVariants"
+VARIANTS_FOLDER = "variants"
+IMAGE_VARIANT_WIDTHS = tuple(sorted(
+    int(w) for w in os.environ.get("IMAGE_VARIANT_WIDTHS", "400,800,1200").split(",") if w.strip()
+))
+IMAGE_WEBP_QUALITY = int(os.environ.get("IMAGE_WEBP_QUALITY", "80"))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", "82"))
+IMAGE_RESIZE_WORKERS = int(os.environ.get("IMAGE_RESIZE_WORKERS", "2"))
+IMAGE_MAX_CONCURRENT = int(os.environ.get("IMAGE_MAX_CONCURRENT", "2"))
+VARIANT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Format -> (extension, type MIME, format Pillow)
+FORMATS = {
+    "webp": ("webp", "image/webp", "WEBP"),
+    "jpeg": ("jpg", "image/jpeg", "JPEG"),
+}
+
+_ENCODER_OPTIONS = {
+    "webp": {"quality": IMAGE_WEBP_QUALITY, "method": 4},
+    "jpeg": {"quality": IMAGE_JPEG_QUALITY, "optimize": True, "progressive": True},
+}
+
+_image_slots = threading.BoundedSemaphore(IMAGE_MAX_CONCURRENT)
+
+
+def parse_source_path(object_name: str) -> tuple[str, str, str] | None:
+    """
+    (collection, ID du document, nom de fichier sans extension) pour une photo
+    originale de prestation, None pour tout autre objet (variantes comprises)
+    """
+    parts = (object_name or "").split("/")
+    if len(parts) != 3 or parts[0] not in IMAGE_COLLECTIONS or not parts[1]:
+        return None
+    stem, dot, _ = parts[2].rpartition(".")
+    return parts[0], parts[1], stem if dot else parts[2]
+
+
+def variant_path(object_name: str, width: int, image_format: str) -> str:
+    folder, _, filename = object_name.rpartition("/")
+    stem = filename.rpartition(".")[0] or filename
+    return f"{folder}/{VARIANTS_FOLDER}/{stem}_{width}w.{FORMATS[image_format][0]}"
+
+
+def public_url(bucket_name: str, object_name: str) -> str:
+    """URL de téléchargement Firebase Storage (lecture publique, voir storage.rules)"""
+    return f"https://firebasestorage.googleapis.com/v0/b/{bucket_name}/o/{quote(object_name, safe='')}?alt=media"
+
+
+def object_name_from_url(url: str) -> str | None:
+    """Chemin de l'objet à partir d'une URL de téléchargement Firebase Storage"""
+    path = urlparse(url or "").path
+    if "/o/" not in path:
+        return None
+    return unquote(path.split("/o/", 1)[1])
+
+
+def variant_widths(original_width: int) -> list[int]:
+    """Largeurs à produire : jamais d'agrandissement, au moins une variante"""
+    widths = [w for w in IMAGE_VARIANT_WIDTHS if w < original_width]
+    return widths or [min(original_width, IMAGE_VARIANT_WIDTHS[0])]
+
+
+def resize_image(data: bytes) -> dict[tuple[int, str], bytes]:
+    """Variantes encodées {(largeur, format): octets} d'une image"""
+    # Import à l'utilisation : Pillow ne pèse pas sur le démarrage à froid des autres fonctions
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as source:
+        # JPEG : décodage directement à l'échelle utile (1/2, 1/4...) quand c'est possible ;
+        # carré pour garder la largeur nécessaire après rotation EXIF
+        source.draft("RGB", (IMAGE_VARIANT_WIDTHS[-1], IMAGE_VARIANT_WIDTHS[-1]))
+        image = ImageOps.exif_transpose(source).convert("RGB")
+
+    # Du plus grand au plus petit : chaque variante est réduite depuis la précédente
+    resized = {}
+    current = image
+    for width in sorted(variant_widths(image.width), reverse=True):
+        if width < current.width:
+            height = max(1, round(current.height * width / current.width))
+            current = current.resize((width, height), Image.Resampling.LANCZOS)
+        resized[width] = current
+
+    def encode(job: tuple[int, str]) -> tuple[tuple[int, str], bytes]:
+        width, image_format = job
+        buffer = io.BytesIO()
+        resized[width].save(buffer, FORMATS[image_format][2], **_ENCODER_OPTIONS[image_format])
+        return job, buffer.getvalue()
+
+    jobs = [(width, image_format) for width in resized for image_format in FORMATS]
+    with ThreadPoolExecutor(max_workers=IMAGE_RESIZE_WORKERS) as pool:
+        return dict(pool.map(encode, jobs))
+
+
+def generate_variants(bucket: Any, object_name: str) -> dict[str, Any]:
+    """Télécharge l'original, envoie ses variantes et retourne la valeur de "imageVariants" """
+    with _image_slots:
+        data = bucket.blob(object_name).download_as_bytes()
+        with metrics.timer("image_resize_seconds"):
+            variants = resize_image(data)
+
+        def upload(item: tuple[tuple[int, str], bytes]) -> tuple[int, str, str]:
+            (width, image_format), content = item
+            path = variant_path(object_name, width, image_format)
+            blob = bucket.blob(path)
+            blob.cache_control = VARIANT_CACHE_CONTROL
+            blob.metadata = {"resized": "true", "source": object_name}
+            blob.upload_from_string(content, content_type=FORMATS[image_format][1])
+            return width, image_format, public_url(bucket.name, path)
+
+        with ThreadPoolExecutor(max_workers=IMAGE_RESIZE_WORKERS) as pool:
+            uploaded = list(pool.map(upload, variants.items()))
+
+    original_size = len(data)
+    variant_bytes = sum(len(content) for content in variants.values())
+    metrics.inc("image_variants_total", len(variants))
+    logger.info("%s variante(s) générée(s) pour %s (%s octets -> %s octets au total)",
+                len(variants), object_name, original_size, variant_bytes)
+    record: dict[str, Any] = {
+        "source": object_name,
+        "widths": sorted({width for width, _, _ in uploaded}),
+        **{image_format: {} for image_format in FORMATS},
+    }
+    for width, image_format, url in uploaded:
+        record[image_format][str(width)] = url
+    return record
+
+
+def record_variants(db: Any, object_name: str, record: dict[str, Any]) -> bool:
+    """
+    Enregistre les variantes sur le document de la prestation si sa photo est
+    `object_name` (ou s'il n'a pas encore de photo)
+    Retourne False sinon : si le document pointe plus tard vers cette photo,
+    attach_existing_variants rattache les variantes à ce moment-là
+    """
+    parsed = parse_source_path(object_name)
+    if parsed is None:
+        return False
+    collection, document_id, _ = parsed
+    doc_ref = db.collection(collection).document(document_id)
+    doc = doc_ref.get()
+    metrics.count_reads()
+    if not doc.exists:
+        logger.info("Prestation %s/%s absente, variantes rattachées à son enregistrement", collection, document_id)
+        return False
+    image_url = (doc.to_dict() or {}).get("imageUrl")
+    if image_url and object_name_from_url(image_url) != object_name:
+        logger.info("La photo de %s/%s n'est pas %s, variantes rattachées si elle le devient",
+                    collection, document_id, object_name)
+        return False
+    doc_ref.update({IMAGE_VARIANTS_FIELD: record})
+    return True
+
+
+def existing_variants(bucket: Any, object_name: str) -> dict[str, Any] | None:
+    """Valeur de "imageVariants" d'après les variantes déjà présentes dans Storage, None s'il n'y en a pas"""
+    folder, _, filename = object_name.rpartition("/")
+    stem = filename.rpartition(".")[0] or filename
+    record: dict[str, Any] = {"source": object_name, "widths": [], **{image_format: {} for image_format in FORMATS}}
+    widths = set()
+    for blob in bucket.list_blobs(prefix=f"{folder}/{VARIANTS_FOLDER}/{stem}_"):
+        name = blob.name.rsplit("/", 1)[-1][len(stem) + 1:]
+        width, _, extension = name.partition("w.")
+        image_format = next((f for f, (ext, _, _) in FORMATS.items() if ext == extension), None)
+        if not width.isdigit() or image_format is None:
+            continue
+        widths.add(int(width))
+        record[image_format][width] = public_url(bucket.name, blob.name)
+    if not widths:
+        return None
+    record["widths"] = sorted(widths)
+    return record
+
+
+def attach_existing_variants(db: Any, collection: str, document_id: str, data: dict | None) -> bool:
+    """
+    Rattache au document les variantes de sa photo courante (imageUrl) si elles
+    ont été générées avant que le document pointe vers cette photo
+    Retourne True si le document a été mis à jour
+    """
+    object_name = object_name_from_url((data or {}).get("imageUrl", ""))
+    if not object_name or parse_source_path(object_name) is None:
+        return False
+    if ((data or {}).get(IMAGE_VARIANTS_FIELD) or {}).get("source") == object_name:
+        return False
+    record = existing_variants(storage.bucket(), object_name)
+    if record is None:
+        # Variantes pas encore générées : generate_image_variants les enregistrera
+        return False
+    db.collection(collection).document(document_id).update({IMAGE_VARIANTS_FIELD: record})
+    return True
+
+
+def backfill(db: Any, bucket: Any) -> int:
+    """
+    Génère les variantes manquantes des photos courantes des prestations
+    (IMAGE_MAX_CONCURRENT photos à la fois), retourne le nombre de documents mis à jour
+    """
+    services = []
+    for collection in IMAGE_COLLECTIONS:
+        for doc in db.collection(collection).stream():
+            metrics.count_reads()
+            services.append((collection, doc.id, doc.to_dict() or {}))
+
+    def process(service: tuple[str, str, dict]) -> int:
+        collection, document_id, data = service
+        object_name = object_name_from_url(data.get("imageUrl", ""))
+        if not object_name or parse_source_path(object_name) is None:
+            return 0
+        if (data.get(IMAGE_VARIANTS_FIELD) or {}).get("source") == object_name:
+            return 0
+        try:
+            record = existing_variants(bucket, object_name) or generate_variants(bucket, object_name)
+            db.collection(collection).document(document_id).update({IMAGE_VARIANTS_FIELD: record})
+        except Exception:
+            logger.exception("Erreur lors de la génération des variantes de %s", object_name)
+            return 0
+        return 1
+
+    with ThreadPoolExecutor(max_workers=IMAGE_MAX_CONCURRENT) as pool:
+        return sum(pool.map(process, services))
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["backfill"]:
+        sys.exit("Usage : python image_variants.py backfill")
+    import firebase_admin
+
+    firebase_admin.initialize_app(options={"storageBucket": os.environ["STORAGE_BUCKET"]})
+    print(f"{backfill(firestore.client(), storage.bucket())} photo(s) traitée(s)")
@@ -0,0 +1,127 @@
+"""
+Instrumentation commune des points d'entrée (firestore_fn / https_fn)
+
+Le décorateur `instrumented` se place sous le décorateur Firebase :
+
+    @firestore_fn.on_document_created(document="bookings/{bookingId}", ...)
+    @instrumented
+    def send_booking_email(event): ...
+
+Il rattache à tous les logs de l'invocation le nom de la fonction, l'ID de
+l'événement et l'ID du document, et journalise une seule fois toute exception
+non gérée avant de la relancer. Il ouvre le budget de temps de l'invocation
+utilisé par la politique de retry (retry_policy.py). Il mesure aussi la durée de chaque invocation
+(métriques "invocations_total" et "invocation_seconds") et, si PROFILE_SAMPLE_RATE
+est défini, capture un profil CPU d'une fraction des invocations ; MEMORY_PROFILE
+active la mesure du pic mémoire par invocation (profiling.py).
+
+Une réponse HTTP en flux (export_data) est consommée par le serveur après le
+retour du décorateur : `invocation_stream` rattache ce flux au contexte de
+l'invocation (logs, budget, attribution des lectures) et publie les métriques
+une fois le flux terminé.
+"""
+
+import contextvars
+import functools
+import time
+from typing import Any, Callable, Iterable, Iterator
+
+import metrics
+from profiling import maybe_profile, maybe_trace_memory
+from retry_policy import invocation_budget
+from structured_logging import get_logger, log_context
+
+logger = get_logger("instrumentation")
+
+
+def _invocation_fields(event_or_request: Any) -> dict[str, Any]:
+    """Extrait les champs de contexte d'un événement Firestore ou d'une requête HTTP"""
+    fields: dict[str, Any] = {}
+    params = getattr(event_or_request, "params", None)
+    if isinstance(params, dict) and params:
+        # Un seul wildcard par document dans nos triggers (ex: {"bookingId": "..."})
+        fields["document_id"] = next(iter(params.values()))
+    event_id = getattr(event_or_request, "id", None)
+    if event_id:
+        fields["event_id"] = event_id
+    headers = getattr(event_or_request, "headers", None)
+    if headers is not None:
+        trace = headers.get("X-Cloud-Trace-Context", "")
+        if trace:
+            fields["trace"] = trace.split("/")[0]
+    return fields
+
+
+def instrumented(func: Callable) -> Callable:
+    """Décorateur pour les points d'entrée des Cloud Functions"""
+    function_name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(event_or_request: Any, *args: Any, **kwargs: Any) -> Any:
+        status = "ok"
+        start = time.perf_counter()
+        fields = _invocation_fields(event_or_request)
+        with log_context(function=function_name, **fields), invocation_budget():
+            try:
+                invocation_id = fields.get("event_id") or fields.get("trace", "")
+                with maybe_trace_memory(function_name, invocation_id), maybe_profile(function_name, invocation_id):
+                    return func(event_or_request, *args, **kwargs)
+            except Exception:
+                status = "error"
+                logger.exception("Exception non gérée dans %s", function_name)
+                raise
+            finally:
+                metrics.observe("invocation_seconds", time.perf_counter() - start, function=function_name)
+                metrics.inc("invocations_total", function=function_name, status=status)
+                metrics.flush_if_due()
+
+    return wrapper
+
+
+class _InvocationStream:
+    """Itérateur exécuté dans le contexte capturé à sa création (voir invocation_stream)"""
+
+    def __init__(self, iterable: Iterable[Any]):
+        self._context = contextvars.copy_context()
+        self._iterator = iter(iterable)
+        self._finished = False
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        if self._finished:
+            raise StopIteration
+        try:
+            return self._context.run(next, self._iterator)
+        except BaseException:
+            # Fin du flux (StopIteration) ou erreur, déjà journalisée par le générateur
+            self._finish()
+            raise
+
+    def close(self) -> None:
+        """Appelé par le serveur WSGI, y compris quand le client interrompt le téléchargement"""
+        if self._finished:
+            return
+        close = getattr(self._iterator, "close", None)
+        try:
+            if close is not None:
+                self._context.run(close)
+        finally:
+            self._finish()
+
+    def _finish(self) -> None:
+        if not self._finished:
+            self._finished = True
+            self._context.run(metrics.flush_if_due)
+
+
+def invocation_stream(iterable: Iterable[Any]) -> Iterator[Any]:
+    """
+    Corps de réponse en flux rattaché à l'invocation courante : à appeler dans la
+    fonction décorée par `instrumented`. Chaque morceau est produit dans le
+    contexte de l'invocation (champs de log, budget, fonction des lectures
+    Firestore) et les métriques sont publiées à la fin du flux
+    """
+    return _InvocationStream(iterable)
+
@@ -10,19 +10,45 @@ Installation:
 
 import os
 import json
-import time
-from datetime import datetime
-from typing import Any
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable
+from zoneinfo import ZoneInfo
 
 import firebase_admin
-from firebase_admin import firestore, initialize_app
-from firebase_functions import firestore_fn, https_fn
-import resend
+from firebase_admin import firestore, initialize_app, storage
+from firebase_functions import firestore_fn, https_fn, options, scheduler_fn, storage_fn
 import json
 
+import metrics
+from admin_digest import (
+    ADMIN_DIGEST_SCHEDULE,
+    clear_notifications,
+    pending_notifications,
+    queue_notification,
+    should_digest,
+)
+from booking_archive import BOOKING_ARCHIVE_SCHEDULE, archive_bookings
+import customer_search
+from catalog_snapshot import cache_headers, etag_matches, load_catalog_snapshot, rebuild_catalog_snapshot
+from customer_search import SEARCH_DEFAULT_LIMIT, SEARCH_PREFIXES_FIELD, search_prefixes
+from data_export import FORMATS as EXPORT_FORMATS, ExportError, export_stream, parse_day
+from email_html import email_template
+from email_sender import configure_resend, replay_deferred_emails, send_batch, send_email
+from http_auth import ADMIN_CORS, authenticate, json_response, unauthorized
+from image_variants import attach_existing_variants, generate_variants, parse_source_path, record_variants
+from instrumentation import instrumented, invocation_stream
+from retry_policy import remaining_budget
+from review_stats import record_review
+from service_renames import RENAME_FLUSH_SCHEDULE, apply_service_renames, queue_service_rename
+from structured_logging import get_logger
+from triggers import CREATED, DELETED, UPDATED, WRITTEN, CollectionDispatcher, skip_imported, watch_fields
+
 # Initialiser Firebase Admin
 initialize_app()
 
+logger = get_logger("main")
+
 # Configuration
 # IMPORTANT: Never hardcode API keys or secrets in source code!
 # For Firebase Functions 2nd Gen Python, use secrets (firebase functions:secrets:set)
@@ -32,6 +58,33 @@ ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL", "contact@harmonyamassage.fr")
 # Note: Resend doesn't allow free domains like gmail.com
 # Use onboarding@resend.dev for testing, or verify your own domain for production
 FROM_EMAIL = os.environ.get("FROM_EMAIL", "Harmonya <contact@harmonyamassage.fr>")
+# Rappels de rendez-vous : envoyés pour les réservations confirmées commençant
+# dans les REMINDER_HOURS_AHEAD prochaines heures
+REMINDER_HOURS_AHEAD = float(os.environ.get("REMINDER_HOURS_AHEAD", "24"))
+REMINDER_SCHEDULE = os.environ.get("REMINDER_SCHEDULE", "every 60 minutes")
+# Fuseau horaire des dates et heures de rendez-vous saisies dans l'application
+BUSINESS_TIMEZONE = ZoneInfo("Europe/Paris")
+# Bons cadeaux : passage au statut "expired" et avis d'expiration prochaine
+# (VOUCHER_EXPIRY_NOTICE_DAYS jours avant expiresAt, 0 pour désactiver)
+VOUCHER_SWEEP_SCHEDULE = os.environ.get("VOUCHER_SWEEP_SCHEDULE", "every day 03:00")
+VOUCHER_SWEEP_PAGE_SIZE = int(os.environ.get("VOUCHER_SWEEP_PAGE_SIZE", "200"))
+VOUCHER_EXPIRY_NOTICE_DAYS = int(os.environ.get("VOUCHER_EXPIRY_NOTICE_DAYS", "0"))
+
+# Actions groupées de l'admin (update_bookings_status) : marqueur posé sur les réservations
+# modifiées, pour que send_booking_status_email ne refasse pas le travail
+BATCH_ACTION_FIELD = "batchActionId"
+BATCH_ACTION_STATUSES = ("confirmed", "cancelled")
+# Deux écritures par réservation (statut, historique) dans un seul batch de 500 opérations
+BATCH_ACTION_MAX_BOOKINGS = 200
+
+# Handlers des collections regroupés derrière un seul trigger par collection
+# (voir triggers.py et les fonctions *_trigger en fin de fichier)
+bookings_dispatcher = CollectionDispatcher("bookings")
+vouchers_dispatcher = CollectionDispatcher("giftVouchers")
+contact_messages_dispatcher = CollectionDispatcher("contactMessages")
+reviews_dispatcher = CollectionDispatcher("reviews")
+massages_dispatcher = CollectionDispatcher("massages")
+treatments_dispatcher = CollectionDispatcher("treatments")
 
 # Helper function to get Resend API key from secrets or config
 def get_resend_api_key() -> str:
@@ -52,31 +105,84 @@ def get_resend_api_key() -> str:
     return ""
 
 
-def get_service_name_and_label(booking: dict) -> tuple[str, str]:
+def notify_admin(notification_type: str, subject: str, render_html: Callable[[], str],
+                 render_summary: Callable[[], dict[str, str]]) -> Any:
+    """
+    Envoie une notification à l'administrateur, ou l'ajoute au prochain récapitulatif
+    si le mode digest est actif pour ce type (voir admin_digest.py)
+    Seul le contenu nécessaire est généré : le HTML complet pour un envoi immédiat,
+    le résumé (libellé -> valeur) pour le récapitulatif
+    """
+    if should_digest(notification_type):
+        return {"digest": queue_notification(notification_type, subject, render_summary())}
+    return send_email({
+        "from": FROM_EMAIL,
+        "to": ADMIN_EMAIL,
+        "subject": subject,
+        "html": render_html(),
+    }, notification_type)
+
+
+def get_service_ref(booking: dict) -> tuple[str, str] | None:
+    """
+    Retourne (collection, service_id) du service réservé, ou None si non spécifié
+    Exemple: massageType "cocooning_60" -> ("massages", "cocooning")
+    """
+    massage_type = booking.get("massageType", "")
+    if not massage_type:
+        return None
+    service_type = booking.get("serviceType", "massage")  # Default to 'massage'
+    collection_name = "treatments" if service_type == "soins" else "massages"
+    parts = massage_type.split('_')
+    service_id = parts[0] if parts else massage_type
+    return (collection_name, service_id)
+
+
+def get_service_names(bookings: list[dict]) -> dict[tuple[str, str], str]:
+    """
+    Récupère en un seul appel (get_all) les noms des services de plusieurs réservations
+    Retourne {(collection, service_id): nom}, à passer à get_service_name_and_label
+    """
+    refs = {ref for ref in (get_service_ref(booking) for booking in bookings) if ref}
+    if not refs:
+        return {}
+    db = firestore.client()
+    names = {}
+    try:
+        for doc in db.get_all([db.collection(collection).document(service_id) for collection, service_id in refs]):
+            metrics.count_reads()
+            if doc.exists:
+                names[(doc.reference.parent.id, doc.id)] = (doc.to_dict() or {}).get("name", doc.id)
+    except Exception as e:
+        logger.warning("Erreur lors de la récupération des noms de services: %s", e)
+    return names
+
+
+def get_service_name_and_label(booking: dict, service_names: dict[tuple[str, str], str] | None = None) -> tuple[str, str]:
     """
     Extrait le nom du service et le label approprié depuis les données de réservation
+    Si `service_names` est fourni (voir get_service_names), aucune lecture Firestore n'est faite
     Retourne: (service_name, label)
     """
-    massage_type = booking.get("massageType", "")
     service_type = booking.get("serviceType", "massage")  # Default to 'massage'
     
     # Déterminer le label
     label = "Type de soins:" if service_type == "soins" else "Type de massage:"
     
     # Si massageType est vide, retourner une valeur par défaut
-    if not massage_type:
+    service_ref = get_service_ref(booking)
+    if service_ref is None:
         return ("Non spécifié", label)
+    collection_name, service_id = service_ref
     
-    # Extraire l'ID du service depuis le format "serviceId_duration"
-    # Exemple: "cocooning_60" -> service_id = "cocooning"
-    parts = massage_type.split('_')
-    service_id = parts[0] if parts else massage_type
+    if service_names is not None:
+        return (service_names.get(service_ref, service_id), label)
     
     # Récupérer le nom du service depuis Firestore
     try:
         db = firestore.client()
-        collection_name = "treatments" if service_type == "soins" else "massages"
         service_doc = db.collection(collection_name).document(service_id).get()
+        metrics.count_reads()
         
         if service_doc.exists:
             service_data = service_doc.to_dict()
@@ -86,7 +192,7 @@ def get_service_name_and_label(booking: dict) -> tuple[str, str]:
             # Si le document n'existe pas, retourner l'ID comme fallback
             return (service_id, label)
     except Exception as e:
-        print(f"Erreur lors de la récupération du nom du service: {str(e)}")
+        logger.warning("Erreur lors de la récupération du nom du service: %s", e)
         # En cas d'erreur, retourner l'ID comme fallback
         return (service_id, label)
 
@@ -160,6 +266,7 @@ def format_date_french(timestamp) -> str:
     return f"{weekday} {date.day} {month} {date.year}"
 
 
+@email_template
 def get_html_template_admin(booking: dict, booking_id: str, date_formatted: str) -> str:
     """Génère le template HTML pour l'email admin"""
     notes_html = ""
@@ -253,6 +360,7 @@ def get_html_template_admin(booking: dict, booking_id: str, date_formatted: str)
 """
 
 
+@email_template
 def get_html_template_client(booking: dict, date_formatted: str) -> str:
     """Génère le template HTML pour l'email client"""
     # Home massage information
@@ -328,7 +436,9 @@ def get_html_template_client(booking: dict, date_formatted: str) -> str:
 """
 
 
-def get_html_template_confirmed(booking: dict, date_formatted: str) -> str:
+@email_template
+def get_html_template_confirmed(booking: dict, date_formatted: str,
+                               service_names: dict[tuple[str, str], str] | None = None) -> str:
     """Génère le template HTML pour l'email de confirmation"""
     # Home massage information
     location_html = ""
@@ -351,7 +461,7 @@ def get_html_template_confirmed(booking: dict, date_formatted: str) -> str:
         """
     
     # Get service name and label
-    service_name, service_label = get_service_name_and_label(booking)
+    service_name, service_label = get_service_name_and_label(booking, service_names)
     
     return f"""
 <!DOCTYPE html>
@@ -409,7 +519,9 @@ def get_html_template_confirmed(booking: dict, date_formatted: str) -> str:
 """
 
 
-def get_html_template_cancelled(booking: dict, date_formatted: str) -> str:
+@email_template
+def get_html_template_cancelled(booking: dict, date_formatted: str,
+                               service_names: dict[tuple[str, str], str] | None = None) -> str:
     """Génère le template HTML pour l'email d'annulation"""
     # Home massage information
     location_html = ""
@@ -432,7 +544,7 @@ def get_html_template_cancelled(booking: dict, date_formatted: str) -> str:
         """
     
     # Get service name and label
-    service_name, service_label = get_service_name_and_label(booking)
+    service_name, service_label = get_service_name_and_label(booking, service_names)
     
     return f"""
 <!DOCTYPE html>
@@ -490,124 +602,210 @@ def get_html_template_cancelled(booking: dict, date_formatted: str) -> str:
 """
 
 
-def create_or_update_customer(booking: dict, booking_id: str) -> None:
+@email_template
+def get_html_template_reminder(booking: dict, date_formatted: str, service_name: str, service_label: str) -> str:
+    """Génère le template HTML pour l'email de rappel de rendez-vous"""
+    # Home massage information
+    location_html = ""
+    is_at_home = booking.get("isAtHome", False)
+    if is_at_home:
+        home_address = booking.get("homeAddress", "")
+        location_html = f"""
+      <div class="info-row">
+        <span class="label">Lieu:</span> À domicile
+      </div>
+      <div class="info-row">
+        <span class="label">Adresse:</span> {home_address}
+      </div>
+        """
+    else:
+        location_html = """
+      <div class="info-row">
+        <span class="label">Lieu:</span> Au cabinet
+      </div>
+        """
+    
+    return f"""
+<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="UTF-8">
+  <style>
+    body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+    .header {{ background-color: #6B4423; color: white; padding: 20px; text-align: center; }}
+    .content {{ background-color: #F5F1E8; padding: 20px; }}
+    .info-row {{ margin: 10px 0; }}
+    .label {{ font-weight: bold; color: #6B4423; }}
+    .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
+    .success-box {{ background-color: #d4edda; border: 1px solid #c3e6cb; border-radius: 5px; padding: 15px; margin: 20px 0; }}
+  </style>
+</head>
+<body>
+  <div class="container">
+    <div class="header">
+      <h1>Rappel de votre rendez-vous</h1>
+    </div>
+    <div class="content">
+      <p>Bonjour {booking.get("name", "")},</p>
+      <div class="success-box">
+        <p style="margin: 0; font-weight: bold; color: #155724;">
+          Nous vous rappelons votre rendez-vous chez Harmonya.
+        </p>
+      </div>
+      <p>Voici les détails de votre rendez-vous :</p>
+      <div class="info-row">
+        <span class="label">Date:</span> {date_formatted}
+      </div>
+      <div class="info-row">
+        <span class="label">Heure:</span> {booking.get("time", "")}
+      </div>
+      <div class="info-row">
+        <span class="label">{service_label}</span> {service_name}
+      </div>
+      {location_html}
+      <p style="margin-top: 20px;">
+        {'Nous nous déplacerons à votre domicile pour ce service.' if is_at_home else 'Nous avons hâte de vous accueillir à Harmonya.'} En cas d'empêchement, merci de nous prévenir le plus tôt possible.
+      </p>
+      <p>Cordialement,<br><strong>L'équipe Harmonya</strong></p>
+    </div>
+    <div class="footer">
+      <p><strong>Harmonya</strong></p>
+      <p>1 A rue de la poste<br>67400 ILLKIRCH GRAFFENSTADEN</p>
+      <p>Téléphone: 06 26 14 25 89</p>
+      <p><a href="https://harmonyamassage.fr" style="color: #6B4423; text-decoration: none;">harmonyamassage.fr</a></p>
+    </div>
+  </div>
+</body>
+</html>
+"""
+
+
+def customer_fields(customer: dict | None, booking: dict, service_name: str) -> dict:
+    """
+    Champs du document client après prise en compte de la réservation
+    `customer` : données actuelles du client (None s'il n'existe pas encore)
+    Le service (ID et nom) est ajouté aux tableaux massage ou soins s'il n'y figure pas déjà
+    """
+    customer = customer or {}
+    customer_email = booking.get("email", "")
+    customer_name = booking.get("name", "")
+    customer_phone = booking.get("phone", "")
+    fields = {
+        "name": customer_name,
+        "phone": customer_phone,
+        "massageTypes": list(customer.get("massageTypes", [])),
+        "treatmentTypes": list(customer.get("treatmentTypes", [])),
+        "massageTypesNames": list(customer.get("massageTypesNames", [])),
+        "treatmentTypesNames": list(customer.get("treatmentTypesNames", [])),
+        SEARCH_PREFIXES_FIELD: search_prefixes(customer_name, customer_email, customer_phone),
+    }
+    service_ref = get_service_ref(booking) if (booking.get("massageType") or "").strip() else None
+    if service_ref:
+        collection_name, service_id = service_ref
+        # Déterminer si c'est un massage ou un traitement
+        ids_field, names_field = (
+            ("treatmentTypes", "treatmentTypesNames") if collection_name == "treatments"
+            else ("massageTypes", "massageTypesNames")
+        )
+        if service_id not in fields[ids_field]:
+            fields[ids_field].append(service_id)
+            fields[names_field].append(service_name if service_name else service_id)
+    return fields
+
+
+def create_or_update_customer(booking: dict, booking_id: str,
+                              service_names: dict[tuple[str, str], str] | None = None) -> None:
     """
     Crée ou met à jour un document client dans la collection "customers"
     basé sur les informations de la réservation
+    Si `service_names` est fourni (voir get_service_names), le nom du service n'est pas relu
     """
     try:
         customer_email = booking.get("email")
-        customer_name = booking.get("name", "")
-        customer_phone = booking.get("phone", "")
-        massage_type = booking.get("massageType", "")
-        service_type = booking.get("serviceType", "")  # 'massage' or 'soins'
-        service_name = booking.get("serviceName", "")  # Service name from booking
         
         if not customer_email:
-            print(f"Pas d'email trouvé dans la réservation {booking_id}, impossible de créer/mettre à jour le client")
+            logger.warning("Pas d'email trouvé dans la réservation %s, impossible de créer/mettre à jour le client", booking_id)
             return
         
-        # Extraire l'ID du service depuis le format "serviceId_duration"
-        # Exemple: "facial_60" -> service_id = "facial"
-        service_id = ""
-        if massage_type and massage_type.strip():
-            parts = massage_type.split('_')
-            service_id = parts[0] if parts else massage_type
-        
         # Si serviceName n'est pas dans le booking, le récupérer depuis Firestore
-        if not service_name and service_id:
-            try:
-                db = firestore.client()
-                collection_name = "treatments" if service_type == "soins" else "massages"
-                service_doc = db.collection(collection_name).document(service_id).get()
-                if service_doc.exists:
-                    service_data = service_doc.to_dict()
-                    service_name = service_data.get("name", service_id)
-                else:
-                    service_name = service_id  # Fallback to ID if document not found
-            except Exception as e:
-                print(f"Erreur lors de la récupération du nom du service: {str(e)}")
-                service_name = service_id  # Fallback to ID on error
+        # (l'ID du service sert de nom si le document n'existe pas)
+        service_name = booking.get("serviceName", "")
+        if not service_name and (booking.get("massageType") or "").strip():
+            service_name = get_service_name_and_label(booking, service_names)[0]
         
         db = firestore.client()
         customer_ref = db.collection("customers").document(customer_email)
         customer_doc = customer_ref.get()
+        metrics.count_reads()
         
         if customer_doc.exists:
             # Le document existe, mettre à jour
-            customer_data = customer_doc.to_dict()
-            massage_types = customer_data.get("massageTypes", [])
-            treatment_types = customer_data.get("treatmentTypes", [])
-            massage_types_names = customer_data.get("massageTypesNames", [])
-            treatment_types_names = customer_data.get("treatmentTypesNames", [])
-            
-            # Déterminer si c'est un massage ou un traitement
-            is_treatment = service_type == "soins"
-            
-            # Ajouter le type de service (ID et nom) dans les bons tableaux s'il n'est pas vide
-            if service_id:
-                if is_treatment:
-                    # C'est un traitement
-                    if service_id not in treatment_types:
-                        treatment_types.append(service_id)
-                        treatment_types_names.append(service_name if service_name else service_id)
-                else:
-                    # C'est un massage
-                    if service_id not in massage_types:
-                        massage_types.append(service_id)
-                        massage_types_names.append(service_name if service_name else service_id)
-            
-            # Mettre à jour le document
-            customer_ref.update({
-                "name": customer_name,
-                "phone": customer_phone,
-                "massageTypes": massage_types,
-                "treatmentTypes": treatment_types,
-                "massageTypesNames": massage_types_names,
-                "treatmentTypesNames": treatment_types_names,
-            })
-            print(f"Document client mis à jour pour {customer_email}")
+            customer_ref.update(customer_fields(customer_doc.to_dict(), booking, service_name))
+            logger.info("Document client mis à jour pour %s", customer_email)
         else:
             # Le document n'existe pas, le créer
-            # Déterminer si c'est un massage ou un traitement
-            is_treatment = service_type == "soins"
-            
-            # Créer les tableaux appropriés
-            massage_types_list = []
-            treatment_types_list = []
-            massage_types_names_list = []
-            treatment_types_names_list = []
-            
-            if service_id:
-                if is_treatment:
-                    treatment_types_list = [service_id]
-                    treatment_types_names_list = [service_name if service_name else service_id]
-                else:
-                    massage_types_list = [service_id]
-                    massage_types_names_list = [service_name if service_name else service_id]
-            
             customer_ref.set({
                 "email": customer_email,
-                "name": customer_name,
-                "phone": customer_phone,
-                "massageTypes": massage_types_list,
-                "treatmentTypes": treatment_types_list,
-                "massageTypesNames": massage_types_names_list,
-                "treatmentTypesNames": treatment_types_names_list,
+                **customer_fields(None, booking, service_name),
                 "added_at": firestore.SERVER_TIMESTAMP,
             })
-            print(f"Nouveau document client créé pour {customer_email}")
+            logger.info("Nouveau document client créé pour %s", customer_email)
+    except Exception as e:
+        logger.exception("Erreur lors de la création/mise à jour du document client")
+
+
+BOOKING_HISTORY_COLLECTION = "bookingHistory"
+
+
+def booking_history_write(db: Any, booking: dict, booking_id: str) -> tuple[Any, dict] | None:
+    """
+    (document, données à écrire en set merge) de l'entrée de la réservation dans
+    l'historique du client, None si la réservation n'a pas d'email
+    """
+    customer_email = booking.get("email")
+    if not customer_email:
+        return None
+    service_ref = get_service_ref(booking)
+    history_ref = (
+        db.collection("customers").document(customer_email)
+        .collection(BOOKING_HISTORY_COLLECTION).document(booking_id)
+    )
+    return history_ref, {
+        "date": booking.get("date"),
+        "time": booking.get("time", ""),
+        "serviceId": service_ref[1] if service_ref else "",
+        "serviceType": booking.get("serviceType", "massage"),
+        "status": booking.get("status", "en_attente"),
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+
+
+def record_booking_history(booking: dict, booking_id: str) -> None:
+    """
+    Met à jour l'historique compact des réservations du client :
+    customers/{email}/bookingHistory/{bookingId} contient
+    {date, time, serviceId, serviceType, status} (un document par réservation, taille bornée)
+    L'historique s'affiche en une requête sur la sous-collection, sans parcourir "bookings" ;
+    l'écriture (set merge) ne nécessite aucune lecture
+    """
+    try:
+        write = booking_history_write(firestore.client(), booking, booking_id)
+        if write is None:
+            return
+        history_ref, data = write
+        history_ref.set(data, merge=True)
     except Exception as e:
-        print(f"Erreur lors de la création/mise à jour du document client: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur lors de la mise à jour de l'historique du client pour la réservation %s", booking_id)
 
 
-@firestore_fn.on_document_created(
+@bookings_dispatcher.handler(CREATED, firestore_fn.on_document_created(
     document="bookings/{bookingId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
+@skip_imported
 def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'une nouvelle réservation est créée
@@ -617,7 +815,7 @@ def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_f
         # Récupérer les données de la réservation depuis l'événement Firestore
         snapshot = event.data
         if snapshot is None:
-            print("Aucune donnée dans l'événement")
+            logger.warning("Aucune donnée dans l'événement")
             return
         
         # Récupérer les données du document
@@ -625,9 +823,12 @@ def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_f
         booking_id = snapshot.id
         
         if booking is None:
-            print(f"Aucune donnée trouvée pour la réservation {booking_id}")
+            logger.warning("Aucune donnée trouvée pour la réservation %s", booking_id)
             return
         
+        # Historique du client, indépendant de l'envoi des emails
+        record_booking_history(booking, booking_id)
+        
         # Formater la date en français
         date_timestamp = booking.get("date")
         if date_timestamp:
@@ -646,16 +847,16 @@ def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_f
         # Vérifier que Resend API Key est configurée
         api_key = get_resend_api_key()
         if not api_key:
-            print(f"ERREUR: RESEND_API_KEY non configurée pour la réservation {booking_id}")
+            logger.error("RESEND_API_KEY non configurée pour la réservation %s", booking_id)
             return
-        resend.api_key = api_key
+        configure_resend(api_key)
         
         # Vérifier le statut de la réservation
         booking_status = booking.get("status", "en_attente")
         
         # Si la réservation est confirmée (créée par l'admin), envoyer uniquement la confirmation au client
         if booking_status == "confirmed":
-            print(f"Réservation {booking_id} créée avec statut 'confirmed' - Envoi uniquement de la confirmation au client")
+            logger.info("Réservation %s créée avec statut 'confirmed' - Envoi uniquement de la confirmation au client", booking_id)
             
             # Créer ou mettre à jour le document client dans la collection "customers"
             create_or_update_customer(booking, booking_id)
@@ -665,37 +866,37 @@ def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_f
                 try:
                     client_html = get_html_template_confirmed(booking, date_formatted)
                     
-                    result = resend.Emails.send({
+                    result = send_email({
                         "from": FROM_EMAIL,
                         "to": client_email,
                         "subject": "Confirmation de votre réservation - Harmonya",
                         "html": client_html,
-                    })
-                    print(f"Email de confirmation envoyé avec succès au client pour la réservation {booking_id}: {result}")
+                    }, "booking_confirmed")
+                    logger.info("Email de confirmation envoyé avec succès au client pour la réservation %s: %s", booking_id, result)
                 except Exception as e:
-                    print(f"Erreur lors de l'envoi de l'email de confirmation au client: {str(e)}")
-                    import traceback
-                    traceback.print_exc()
+                    logger.exception("Erreur lors de l'envoi de l'email de confirmation au client")
             else:
-                print(f"Pas d'email client trouvé pour la réservation {booking_id}")
+                logger.info("Pas d'email client trouvé pour la réservation %s", booking_id)
             return
         
         # Pour les réservations en attente (créées par le client), envoyer à l'admin et au client
         # Envoyer l'email à l'administrateur
         try:
-            admin_html = get_html_template_admin(booking, booking_id, date_formatted)
-            
-            result = resend.Emails.send({
-                "from": FROM_EMAIL,
-                "to": ADMIN_EMAIL,
-                "subject": f"Nouvelle réservation - {booking.get('name', '')}",
-                "html": admin_html,
-            })
-            print(f"Email admin envoyé avec succès pour la réservation {booking_id}: {result}")
+            result = notify_admin(
+                "booking_admin",
+                f"Nouvelle réservation - {booking.get('name', '')}",
+                lambda: get_html_template_admin(booking, booking_id, date_formatted),
+                lambda: {
+                    "Client": booking.get("name", ""),
+                    "Email": booking.get("email", ""),
+                    "Téléphone": booking.get("phone", ""),
+                    "Prestation": get_service_name_and_label(booking)[0],
+                    "Date": f"{date_formatted} à {booking.get('time', '')}",
+                },
+            )
+            logger.info("Email admin envoyé avec succès pour la réservation %s: %s", booking_id, result)
         except Exception as e:
-            print(f"Erreur lors de l'envoi de l'email admin: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Erreur lors de l'envoi de l'email admin")
         
         # Envoyer l'email de confirmation au client
         client_email = booking.get("email")
@@ -703,31 +904,30 @@ def send_booking_email(event: firestore_fn.Event[firestore_fn.Change[firestore_f
             try:
                 client_html = get_html_template_client(booking, date_formatted)
                 
-                result = resend.Emails.send({
+                result = send_email({
                     "from": FROM_EMAIL,
                     "to": client_email,
                     "subject": "Confirmation de votre réservation - Harmonya",
                     "html": client_html,
-                })
-                print(f"Email client envoyé avec succès pour la réservation {booking_id}: {result}")
+                }, "booking_client")
+                logger.info("Email client envoyé avec succès pour la réservation %s: %s", booking_id, result)
             except Exception as e:
-                print(f"Erreur lors de l'envoi de l'email client: {str(e)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Erreur lors de l'envoi de l'email client")
         else:
-            print(f"Pas d'email client trouvé pour la réservation {booking_id}")
+            logger.info("Pas d'email client trouvé pour la réservation %s", booking_id)
             
     except Exception as e:
-        print(f"Erreur générale dans send_booking_email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_booking_email")
 
 
-@firestore_fn.on_document_updated(
+@bookings_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
     document="bookings/{bookingId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
+@skip_imported
+@watch_fields("status")
 def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'une réservation est mise à jour
@@ -739,7 +939,7 @@ def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[fire
         after_snapshot = event.data.after
         
         if before_snapshot is None or after_snapshot is None:
-            print("Données manquantes dans l'événement de mise à jour")
+            logger.warning("Données manquantes dans l'événement de mise à jour")
             return
         
         booking_before = before_snapshot.to_dict()
@@ -747,7 +947,7 @@ def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[fire
         booking_id = after_snapshot.id
         
         if booking_before is None or booking_after is None:
-            print(f"Aucune donnée trouvée pour la réservation {booking_id}")
+            logger.warning("Aucune donnée trouvée pour la réservation %s", booking_id)
             return
         
         # Vérifier si le statut a changé
@@ -756,11 +956,19 @@ def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[fire
         
         # Ne rien faire si le statut n'a pas changé ou si ce n'est pas une confirmation/annulation
         if old_status == new_status:
-            print(f"Statut inchangé pour la réservation {booking_id}: {new_status}")
+            logger.debug("Statut inchangé pour la réservation %s: %s", booking_id, new_status)
+            return
+        
+        # Statut changé par update_bookings_status, qui a déjà fait l'historique, le client et l'email
+        batch_action = booking_after.get(BATCH_ACTION_FIELD)
+        if batch_action and batch_action != booking_before.get(BATCH_ACTION_FIELD):
+            logger.debug("Réservation %s traitée par l'action groupée %s", booking_id, batch_action)
             return
         
+        record_booking_history(booking_after, booking_id)
+        
         if new_status not in ["confirmed", "cancelled"]:
-            print(f"Statut {new_status} ne nécessite pas d'email pour la réservation {booking_id}")
+            logger.debug("Statut %s ne nécessite pas d'email pour la réservation %s", new_status, booking_id)
             return
         
         # Formater la date en français
@@ -781,14 +989,14 @@ def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[fire
         # Vérifier que Resend API Key est configurée
         api_key = get_resend_api_key()
         if not api_key:
-            print(f"ERREUR: RESEND_API_KEY non configurée pour la réservation {booking_id}")
+            logger.error("RESEND_API_KEY non configurée pour la réservation %s", booking_id)
             return
-        resend.api_key = api_key
+        configure_resend(api_key)
         
         # Envoyer l'email au client selon le statut
         client_email = booking_after.get("email")
         if not client_email:
-            print(f"Pas d'email client trouvé pour la réservation {booking_id}")
+            logger.info("Pas d'email client trouvé pour la réservation %s", booking_id)
             return
         
         try:
@@ -806,25 +1014,22 @@ def send_booking_status_email(event: firestore_fn.Event[firestore_fn.Change[fire
             else:
                 return
             
-            result = resend.Emails.send({
+            result = send_email({
                 "from": FROM_EMAIL,
                 "to": client_email,
                 "subject": subject,
                 "html": html_content,
-            })
-            print(f"Email de statut ({new_status}) envoyé avec succès pour la réservation {booking_id}: {result}")
+            }, f"booking_{new_status}")
+            logger.info("Email de statut (%s) envoyé avec succès pour la réservation %s: %s", new_status, booking_id, result)
             
         except Exception as e:
-            print(f"Erreur lors de l'envoi de l'email de statut: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Erreur lors de l'envoi de l'email de statut")
             
     except Exception as e:
-        print(f"Erreur générale dans send_booking_status_email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_booking_status_email")
 
 
+@email_template
 def get_html_template_review_admin(review: dict, review_id: str, date_formatted: str) -> str:
     """Génère le template HTML pour l'email admin lors d'un nouveau commentaire"""
     # Générer les étoiles pour la note
@@ -906,11 +1111,12 @@ def get_html_template_review_admin(review: dict, review_id: str, date_formatted:
 """
 
 
-@firestore_fn.on_document_created(
+@reviews_dispatcher.handler(CREATED, firestore_fn.on_document_created(
     document="reviews/{reviewId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
 def send_review_notification_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'un nouveau commentaire est créé
@@ -920,16 +1126,23 @@ def send_review_notification_email(event: firestore_fn.Event[firestore_fn.Change
         # Récupérer les données du commentaire
         snapshot = event.data
         if snapshot is None:
-            print("Aucune donnée dans l'événement")
+            logger.warning("Aucune donnée dans l'événement")
             return
         
         review = snapshot.to_dict()
         review_id = snapshot.id
         
         if review is None:
-            print(f"Aucune donnée trouvée pour le commentaire {review_id}")
+            logger.warning("Aucune donnée trouvée pour le commentaire %s", review_id)
             return
         
+        # Un commentaire créé déjà approuvé (saisi par l'admin) compte tout de suite
+        if review.get("approved") is True:
+            try:
+                record_review(firestore.client(), review_id, review)
+            except Exception as e:
+                logger.exception("Erreur lors de la mise à jour de l'agrégat des notes pour le commentaire %s", review_id)
+        
         # Formater la date en français
         date_timestamp = review.get("createdAt")
         if date_timestamp:
@@ -948,38 +1161,76 @@ def send_review_notification_email(event: firestore_fn.Event[firestore_fn.Change
         # Vérifier que Resend API Key est configurée
         api_key = get_resend_api_key()
         if not api_key:
-            print(f"ERREUR: RESEND_API_KEY non configurée pour le commentaire {review_id}")
+            logger.error("RESEND_API_KEY non configurée pour le commentaire %s", review_id)
             return
-        resend.api_key = api_key
+        configure_resend(api_key)
         
         # Envoyer l'email à l'administrateur
         try:
-            admin_html = get_html_template_review_admin(review, review_id, date_formatted)
-            
             # Nom de l'auteur pour le sujet
             prenom = review.get("prenom", "")
             name = review.get("name", "")
             reviewer_name = f"{prenom} {name}".strip() if prenom or name else "Anonyme"
             rating = review.get("rating", 5)
             
-            result = resend.Emails.send({
-                "from": FROM_EMAIL,
-                "to": ADMIN_EMAIL,
-                "subject": f"Nouveau commentaire - {rating}/5 étoiles de {reviewer_name}",
-                "html": admin_html,
-            })
-            print(f"Email admin envoyé avec succès pour le commentaire {review_id}: {result}")
+            result = notify_admin(
+                "review_admin",
+                f"Nouveau commentaire - {rating}/5 étoiles de {reviewer_name}",
+                lambda: get_html_template_review_admin(review, review_id, date_formatted),
+                lambda: {
+                    "Auteur": reviewer_name,
+                    "Note": f"{rating}/5",
+                    "Commentaire": review.get("comment", ""),
+                },
+            )
+            logger.info("Email admin envoyé avec succès pour le commentaire %s: %s", review_id, result)
         except Exception as e:
-            print(f"Erreur lors de l'envoi de l'email admin: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Erreur lors de l'envoi de l'email admin")
             
     except Exception as e:
-        print(f"Erreur générale dans send_review_notification_email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_review_notification_email")
+
+
+@reviews_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
+    document="reviews/{reviewId}",
+    region="europe-west9"
+))
+@instrumented
+@watch_fields("approved", "rating")
+def update_review_stats(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
+    """
+    Fonction déclenchée lorsqu'un commentaire est approuvé, désapprouvé ou change de note
+    Met à jour l'agrégat des notes (reviewStats/summary)
+    """
+    try:
+        after = event.data.after
+        if after is None:
+            return
+        record_review(firestore.client(), after.id, after.to_dict())
+    except Exception as e:
+        logger.exception("Erreur générale dans update_review_stats")
+
+
+@reviews_dispatcher.handler(DELETED, firestore_fn.on_document_deleted(
+    document="reviews/{reviewId}",
+    region="europe-west9"
+))
+@instrumented
+def remove_review_stats(event: firestore_fn.Event[firestore_fn.DocumentSnapshot | None]) -> None:
+    """
+    Fonction déclenchée lorsqu'un commentaire est supprimé (refusé par l'admin)
+    Retire sa note de l'agrégat s'il y était compté
+    """
+    try:
+        snapshot = event.data
+        if snapshot is None:
+            return
+        record_review(firestore.client(), snapshot.id, None)
+    except Exception as e:
+        logger.exception("Erreur générale dans remove_review_stats")
 
 
+@email_template
 def get_html_template_voucher_purchaser(voucher: dict, voucher_id: str) -> str:
     """Génère le template HTML pour l'email de confirmation à l'acheteur"""
     message_html = ""
@@ -998,7 +1249,7 @@ def get_html_template_voucher_purchaser(voucher: dict, voucher_id: str) -> str:
             expires_formatted = format_date_french(parsed_date)
         else:
             # Debug: log the actual format we received
-            print(f"DEBUG: Could not parse expiresAt: {type(expires_date)}, value: {expires_date}")
+            logger.debug("Could not parse expiresAt: %s, value: %s", type(expires_date), expires_date)
     
     return f"""
 <!DOCTYPE html>
@@ -1059,6 +1310,7 @@ def get_html_template_voucher_purchaser(voucher: dict, voucher_id: str) -> str:
 """
 
 
+@email_template
 def get_html_template_voucher_recipient(voucher: dict, voucher_id: str) -> str:
     """Génère le template HTML pour l'email envoyé au destinataire du bon cadeau"""
     message_html = ""
@@ -1082,7 +1334,7 @@ def get_html_template_voucher_recipient(voucher: dict, voucher_id: str) -> str:
             expires_formatted = format_date_french(parsed_date)
         else:
             # Debug: log the actual format we received
-            print(f"DEBUG: Could not parse expiresAt: {type(expires_date)}, value: {expires_date}")
+            logger.debug("Could not parse expiresAt: %s, value: %s", type(expires_date), expires_date)
     
     return f"""
 <!DOCTYPE html>
@@ -1141,6 +1393,68 @@ def get_html_template_voucher_recipient(voucher: dict, voucher_id: str) -> str:
 """
 
 
+@email_template
+def get_html_template_voucher_expiring(voucher: dict, voucher_id: str) -> str:
+    """Génère le template HTML de l'avis d'expiration prochaine envoyé au destinataire du bon cadeau"""
+    expires_formatted = format_date_french(voucher.get("expiresAt"))
+    
+    return f"""
+<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="UTF-8">
+  <style>
+    body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+    .header {{ background-color: #6B4423; color: white; padding: 20px; text-align: center; }}
+    .content {{ background-color: #F5F1E8; padding: 20px; }}
+    .info-row {{ margin: 10px 0; }}
+    .label {{ font-weight: bold; color: #6B4423; }}
+    .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
+    .gift-box {{ background-color: #fff; border: 2px dashed #6B4423; border-radius: 10px; padding: 30px; margin: 20px 0; text-align: center; }}
+    .amount {{ font-size: 48px; font-weight: bold; color: #6B4423; margin: 20px 0; }}
+  </style>
+</head>
+<body>
+  <div class="container">
+    <div class="header">
+      <h1>🎁 Votre bon cadeau expire bientôt</h1>
+    </div>
+    <div class="content">
+      <p>Bonjour {voucher.get("recipientName", "")},</p>
+      <p>Le bon cadeau Harmonya offert par <strong>{voucher.get("purchaserName", "quelqu'un qui vous aime")}</strong> n'a pas encore été utilisé.</p>
+      <div class="gift-box">
+        <div class="amount">{voucher.get("amount", 0)}€</div>
+        <p style="font-size: 18px; color: #6B4423; font-weight: bold;">
+          Bon cadeau Harmonya
+        </p>
+      </div>
+      <div class="info-row">
+        <span class="label">Valable jusqu'au:</span> {expires_formatted}
+      </div>
+      <p style="margin-top: 20px;">
+        Pensez à réserver votre massage avant cette date sur notre site web ou en nous contactant directement.
+      </p>
+      <p style="margin-top: 20px;">
+        <a href="https://harmonyamassage.fr" style="background-color: #6B4423; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; display: inline-block;">
+          Réserver maintenant
+        </a>
+      </p>
+      <p>Cordialement,<br><strong>L'équipe Harmonya</strong></p>
+    </div>
+    <div class="footer">
+      <p><strong>Harmonya</strong></p>
+      <p>1 A rue de la poste<br>67400 ILLKIRCH GRAFFENSTADEN</p>
+      <p>Téléphone: 06 26 14 25 89</p>
+      <p><a href="https://harmonyamassage.fr" style="color: #6B4423; text-decoration: none;">harmonyamassage.fr</a></p>
+    </div>
+  </div>
+</body>
+</html>
+"""
+
+
+@email_template
 def get_html_template_voucher_admin(voucher: dict, voucher_id: str) -> str:
     """Génère le template HTML pour l'email admin lors d'un achat de bon cadeau"""
     message_html = ""
@@ -1159,7 +1473,7 @@ def get_html_template_voucher_admin(voucher: dict, voucher_id: str) -> str:
             expires_formatted = format_date_french(parsed_date)
         else:
             # Debug: log the actual format we received
-            print(f"DEBUG: Could not parse expiresAt: {type(expires_date)}, value: {expires_date}")
+            logger.debug("Could not parse expiresAt: %s, value: %s", type(expires_date), expires_date)
     
     paid_date = voucher.get("paidAt")
     paid_formatted = "Non payé"
@@ -1230,65 +1544,46 @@ def get_html_template_voucher_admin(voucher: dict, voucher_id: str) -> str:
 """
 
 
-def _send_email_with_retry(email_data: dict, email_type: str, voucher_id: str, max_retries: int = 3) -> bool:
+def _send_email_with_retry(email_data: dict, email_type: str, voucher_id: str) -> bool:
     """
-    Helper function pour envoyer un email avec retry en cas de rate limit
-    Resend limite à 2 requêtes par seconde
+    Helper function pour envoyer un email de bon cadeau
+    Les retries (rate limit Resend, erreurs temporaires) sont gérés par send_email
     """
-    for attempt in range(max_retries):
-        try:
-            result = resend.Emails.send(email_data)
-            print(f"Email {email_type} envoyé avec succès pour le bon cadeau {voucher_id}: {result}")
-            return True
-        except Exception as e:
-            error_str = str(e)
-            # Vérifier si c'est une erreur de rate limit
-            if "rate limit" in error_str.lower() or "too many requests" in error_str.lower():
-                if attempt < max_retries - 1:
-                    # Attendre avec backoff exponentiel: 0.6s, 1.2s, 2.4s
-                    wait_time = 0.6 * (2 ** attempt)
-                    print(f"Rate limit atteint pour {email_type}, attente de {wait_time}s avant retry (tentative {attempt + 1}/{max_retries})")
-                    time.sleep(wait_time)
-                    continue
-                else:
-                    print(f"ERREUR: Rate limit toujours atteint après {max_retries} tentatives pour {email_type}")
-                    import traceback
-                    traceback.print_exc()
-                    return False
-            else:
-                # Autre erreur, ne pas retry
-                print(f"ERREUR lors de l'envoi de l'email {email_type}: {error_str}")
-                import traceback
-                traceback.print_exc()
-                return False
-    return False
+    try:
+        result = send_email(email_data, f"voucher_{email_type}")
+        logger.info("Email %s envoyé avec succès pour le bon cadeau %s: %s", email_type, voucher_id, result)
+        return True
+    except Exception:
+        logger.exception("Erreur lors de l'envoi de l'email %s", email_type)
+        return False
 
 
 def _send_voucher_emails_helper(voucher: dict, voucher_id: str) -> None:
     """
     Helper function pour envoyer les emails de bon cadeau
-    Respecte la limite de rate de Resend (2 requêtes/seconde)
+    La limite de rate de Resend (2 requêtes/seconde) est gérée par send_email
+    (429 réessayé selon Retry-After), sans attente fixe entre les emails
     """
-    print(f"DEBUG _send_voucher_emails_helper: Début envoi emails pour voucher {voucher_id}")
+    logger.debug("Début envoi emails pour voucher %s", voucher_id)
     
     # Vérifier que Resend API Key est configurée
     api_key = get_resend_api_key()
     if not api_key:
-        print(f"ERREUR: RESEND_API_KEY non configurée pour le bon cadeau {voucher_id}")
+        logger.error("RESEND_API_KEY non configurée pour le bon cadeau %s", voucher_id)
         return
-    resend.api_key = api_key
+    configure_resend(api_key)
     
     # Envoyer l'email à l'acheteur (seulement si différent du destinataire)
     purchaser_email = voucher.get("purchaserEmail")
     recipient_email = voucher.get("recipientEmail")
     
-    print(f"DEBUG _send_voucher_emails_helper: purchaser_email={purchaser_email}, recipient_email={recipient_email}")
+    logger.debug("purchaser_email=%s, recipient_email=%s", purchaser_email, recipient_email)
     
     if not recipient_email:
-        print(f"ERREUR: Aucun email destinataire trouvé pour le bon cadeau {voucher_id}")
+        logger.error("Aucun email destinataire trouvé pour le bon cadeau %s", voucher_id)
         return
     
-    # Liste des emails à envoyer (pour respecter le rate limit)
+    # Liste des emails à envoyer
     emails_to_send = []
     
     if purchaser_email and purchaser_email != recipient_email:
@@ -1300,7 +1595,7 @@ def _send_voucher_emails_helper(voucher: dict, voucher_id: str) -> None:
             "html": purchaser_html,
         })
     elif purchaser_email == recipient_email:
-        print(f"Email acheteur ignoré pour le bon cadeau {voucher_id} (même email que le destinataire)")
+        logger.info("Email acheteur ignoré pour le bon cadeau %s (même email que le destinataire)", voucher_id)
     
     # Email destinataire (prioritaire)
     recipient_html = get_html_template_voucher_recipient(voucher, voucher_id)
@@ -1311,23 +1606,8 @@ def _send_voucher_emails_helper(voucher: dict, voucher_id: str) -> None:
         "html": recipient_html,
     })
     
-    # Email admin
-    admin_html = get_html_template_voucher_admin(voucher, voucher_id)
-    emails_to_send.append({
-        "type": "admin",
-        "to": ADMIN_EMAIL,
-        "subject": f"Nouveau bon cadeau - {voucher.get('amount', 0)}€",
-        "html": admin_html,
-    })
-    
-    # Envoyer les emails avec délai entre chaque pour respecter le rate limit (2 req/s)
-    # Attendre 0.6 secondes entre chaque email pour être sûr de rester sous la limite
-    for i, email_info in enumerate(emails_to_send):
-        if i > 0:
-            # Attendre avant d'envoyer le prochain email (sauf pour le premier)
-            time.sleep(0.6)
-        
-        print(f"DEBUG _send_voucher_emails_helper: Envoi email {email_info['type']} à {email_info['to']}")
+    for email_info in emails_to_send:
+        logger.debug("Envoi email %s à %s", email_info['type'], email_info['to'])
         
         email_data = {
             "from": FROM_EMAIL,
@@ -1337,13 +1617,31 @@ def _send_voucher_emails_helper(voucher: dict, voucher_id: str) -> None:
         }
         
         _send_email_with_retry(email_data, email_info["type"], voucher_id)
+    
+    # Email admin (ou ajout au récapitulatif en mode digest)
+    try:
+        result = notify_admin(
+            "voucher_admin",
+            f"Nouveau bon cadeau - {voucher.get('amount', 0)}€",
+            lambda: get_html_template_voucher_admin(voucher, voucher_id),
+            lambda: {
+                "Montant": f"{voucher.get('amount', 0)}€",
+                "Acheteur": voucher.get("purchaserName") or purchaser_email or "",
+                "Destinataire": voucher.get("recipientName") or recipient_email,
+                "Bon cadeau": voucher_id,
+            },
+        )
+        logger.info("Email admin envoyé avec succès pour le bon cadeau %s: %s", voucher_id, result)
+    except Exception:
+        logger.exception("Erreur lors de l'envoi de l'email admin")
 
 
-@firestore_fn.on_document_created(
+@vouchers_dispatcher.handler(CREATED, firestore_fn.on_document_created(
     document="giftVouchers/{voucherId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
 def send_voucher_emails_on_create(event: firestore_fn.Event[firestore_fn.DocumentSnapshot]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'un bon cadeau est créé avec statut "paid"
@@ -1352,36 +1650,36 @@ def send_voucher_emails_on_create(event: firestore_fn.Event[firestore_fn.Documen
     try:
         snapshot = event.data
         if snapshot is None:
-            print("Aucune donnée dans l'événement (create)")
+            logger.warning("Aucune donnée dans l'événement (create)")
             return
         
         voucher = snapshot.to_dict()
         voucher_id = snapshot.id
         
         if voucher is None:
-            print(f"Aucune donnée trouvée pour le bon cadeau {voucher_id} (create)")
+            logger.warning("Aucune donnée trouvée pour le bon cadeau %s (create)", voucher_id)
             return
         
         status = voucher.get("status") or "pending"
-        print(f"DEBUG send_voucher_emails_on_create: Voucher {voucher_id} créé avec statut: {status}")
+        logger.debug("Voucher %s créé avec statut: %s", voucher_id, status)
         
         if status == "paid":
-            print(f"DEBUG send_voucher_emails_on_create: Voucher {voucher_id} créé avec statut 'paid', envoi des emails...")
+            logger.debug("Voucher %s créé avec statut 'paid', envoi des emails...", voucher_id)
             _send_voucher_emails_helper(voucher, voucher_id)
         else:
-            print(f"DEBUG send_voucher_emails_on_create: Voucher {voucher_id} créé avec statut '{status}', pas d'envoi d'email")
+            logger.debug("Voucher %s créé avec statut '%s', pas d'envoi d'email", voucher_id, status)
                 
     except Exception as e:
-        print(f"Erreur générale dans send_voucher_emails_on_create: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_voucher_emails_on_create")
 
 
-@firestore_fn.on_document_updated(
+@vouchers_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
     document="giftVouchers/{voucherId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
+@watch_fields("status")
 def send_voucher_emails(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'un bon cadeau est mis à jour (paiement confirmé)
@@ -1390,7 +1688,7 @@ def send_voucher_emails(event: firestore_fn.Event[firestore_fn.Change[firestore_
     try:
         snapshot = event.data
         if snapshot is None:
-            print("Aucune donnée dans l'événement (update)")
+            logger.warning("Aucune donnée dans l'événement (update)")
             return
         
         voucher_after = snapshot.after.to_dict()
@@ -1398,28 +1696,27 @@ def send_voucher_emails(event: firestore_fn.Event[firestore_fn.Change[firestore_
         voucher_id = snapshot.after.id
         
         if voucher_after is None:
-            print(f"Aucune donnée trouvée pour le bon cadeau {voucher_id} (update)")
+            logger.warning("Aucune donnée trouvée pour le bon cadeau %s (update)", voucher_id)
             return
         
         # Vérifier si le statut a changé de "pending" à "paid"
         status_before = voucher_before.get("status") or "pending"
         status_after = voucher_after.get("status") or "pending"
         
-        print(f"DEBUG send_voucher_emails: Voucher {voucher_id} - Status before: {status_before}, Status after: {status_after}")
+        logger.debug("Voucher %s - Status before: %s, Status after: %s", voucher_id, status_before, status_after)
         
         if status_before != "paid" and status_after == "paid":
             # Le bon cadeau vient d'être payé, envoyer les emails
-            print(f"DEBUG send_voucher_emails: Voucher {voucher_id} vient d'être payé, préparation des emails...")
+            logger.debug("Voucher %s vient d'être payé, préparation des emails...", voucher_id)
             _send_voucher_emails_helper(voucher_after, voucher_id)
         else:
-            print(f"DEBUG send_voucher_emails: Voucher {voucher_id} - Pas de changement de statut vers 'paid' (before={status_before}, after={status_after})")
+            logger.debug("Voucher %s - Pas de changement de statut vers 'paid' (before=%s, after=%s)", voucher_id, status_before, status_after)
                 
     except Exception as e:
-        print(f"Erreur générale dans send_voucher_emails: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_voucher_emails")
 
 
+@email_template
 def get_html_template_contact_message(contact: dict, contact_id: str, date_formatted: str) -> str:
     """
     Génère le template HTML pour l'email admin lors d'un nouveau message de contact
@@ -1531,11 +1828,12 @@ def get_html_template_contact_message(contact: dict, contact_id: str, date_forma
     """
 
 
-@firestore_fn.on_document_created(
+@contact_messages_dispatcher.handler(CREATED, firestore_fn.on_document_created(
     document="contactMessages/{contactId}",
     region="europe-west9",
     secrets=["RESEND_API_KEY"]
-)
+))
+@instrumented
 def send_contact_message_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée automatiquement lorsqu'un nouveau message de contact est créé
@@ -1545,14 +1843,14 @@ def send_contact_message_email(event: firestore_fn.Event[firestore_fn.Change[fir
         # Récupérer les données du message de contact
         snapshot = event.data
         if snapshot is None:
-            print("Aucune donnée dans l'événement")
+            logger.warning("Aucune donnée dans l'événement")
             return
         
         contact = snapshot.to_dict()
         contact_id = snapshot.id
         
         if contact is None:
-            print(f"Aucune donnée trouvée pour le message de contact {contact_id}")
+            logger.warning("Aucune donnée trouvée pour le message de contact %s", contact_id)
             return
         
         # Formater la date en français
@@ -1573,14 +1871,12 @@ def send_contact_message_email(event: firestore_fn.Event[firestore_fn.Change[fir
         # Vérifier que Resend API Key est configurée
         api_key = get_resend_api_key()
         if not api_key:
-            print(f"ERREUR: RESEND_API_KEY non configurée pour le message de contact {contact_id}")
+            logger.error("RESEND_API_KEY non configurée pour le message de contact %s", contact_id)
             return
-        resend.api_key = api_key
+        configure_resend(api_key)
         
         # Envoyer l'email à l'administrateur
         try:
-            admin_html = get_html_template_contact_message(contact, contact_id, date_formatted)
-            
             # Nom pour le sujet
             name = contact.get("name", "Anonyme")
             contact_method = contact.get("contactMethod", "")
@@ -1596,31 +1892,118 @@ def send_contact_message_email(event: firestore_fn.Event[firestore_fn.Change[fir
                 if phone:
                     subject += f" ({phone})"
             
-            result = resend.Emails.send({
-                "from": FROM_EMAIL,
-                "to": ADMIN_EMAIL,
-                "subject": subject,
-                "html": admin_html,
-            })
-            print(f"Email admin envoyé avec succès pour le message de contact {contact_id}: {result}")
+            result = notify_admin(
+                "contact_admin",
+                subject,
+                lambda: get_html_template_contact_message(contact, contact_id, date_formatted),
+                lambda: {
+                    "Nom": name,
+                    "Contact": contact.get("email") or contact.get("phone") or "",
+                    "Message": contact.get("message", ""),
+                },
+            )
+            logger.info("Email admin envoyé avec succès pour le message de contact %s: %s", contact_id, result)
         except Exception as e:
-            print(f"Erreur lors de l'envoi de l'email admin: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Erreur lors de l'envoi de l'email admin")
             
     except Exception as e:
-        print(f"Erreur générale dans send_contact_message_email: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_contact_message_email")
 
 
-@firestore_fn.on_document_updated(
-    document="contactMessages/{contactId}",
-    region="europe-west9",
-    secrets=["RESEND_API_KEY"]
-)
-def send_contact_answer_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
-    """
+@email_template
+def get_html_template_contact_answer(name: str, original_message: str, answer: str) -> str:
+    """Génère le template HTML pour l'email de réponse à un message de contact"""
+    return f"""
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+            line-height: 1.6;
+            color: #333;
+            max-width: 600px;
+            margin: 0 auto;
+            padding: 20px;
+        }}
+        .header {{
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 30px;
+            text-align: center;
+            border-radius: 10px 10px 0 0;
+        }}
+        .content {{
+            background: #f9f9f9;
+            padding: 30px;
+            border-radius: 0 0 10px 10px;
+        }}
+        .message-box {{
+            background: white;
+            padding: 20px;
+            border-radius: 8px;
+            margin: 20px 0;
+            border-left: 4px solid #667eea;
+        }}
+        .original-message-box {{
+            background: #f0f0f0;
+            padding: 20px;
+            border-radius: 8px;
+            margin: 20px 0;
+            border-left: 4px solid #999;
+        }}
+        .footer {{
+            text-align: center;
+            margin-top: 30px;
+            padding-top: 20px;
+            border-top: 1px solid #ddd;
+            color: #666;
+            font-size: 12px;
+        }}
+    </style>
+</head>
+<body>
+    <div class="header">
+        <h1>Réponse à votre message</h1>
+    </div>
+    <div class="content">
+        <p>Bonjour {name},</p>
+        <p>Nous avons bien reçu votre message et nous vous répondons ci-dessous :</p>
+        <div class="original-message-box">
+            <p style="font-weight: bold; margin-top: 0; color: #666;">Votre message :</p>
+            <p style="white-space: pre-wrap; margin: 0;">{original_message}</p>
+        </div>
+        <div class="message-box">
+            <p style="font-weight: bold; margin-top: 0; color: #667eea;">Notre réponse :</p>
+            <p style="white-space: pre-wrap; margin: 0;">{answer}</p>
+        </div>
+        <p>N'hésitez pas à nous contacter si vous avez d'autres questions.</p>
+        <p>Cordialement,<br>L'équipe Harmonya</p>
+        <p style="text-align: center; margin-top: 20px;">
+            <a href="https://harmonyamassage.fr" style="display: inline-block; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; font-weight: bold;">Visitez notre site web</a>
+        </p>
+    </div>
+    <div class="footer">
+        <p>Harmonya Massage & Bien-être</p>
+        <p>1 A rue de la poste, 67400 ILLKIRCH GRAFFENSTADEN</p>
+        <p>Téléphone: 06 26 14 25 89</p>
+        <p><a href="https://harmonyamassage.fr" style="color: #667eea; text-decoration: none;">https://harmonyamassage.fr</a></p>
+    </div>
+</body>
+</html>
+"""
+
+
+@contact_messages_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
+    document="contactMessages/{contactId}",
+    region="europe-west9",
+    secrets=["RESEND_API_KEY"]
+))
+@instrumented
+@watch_fields("answered")
+def send_contact_answer_email(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
+    """
     Fonction déclenchée lorsqu'un message de contact est mis à jour
     Envoie un email au client avec la réponse si le message a été répondu
     """
@@ -1630,7 +2013,7 @@ def send_contact_answer_email(event: firestore_fn.Event[firestore_fn.Change[fire
         after_snapshot = event.data.after
         
         if before_snapshot is None or after_snapshot is None:
-            print("Données manquantes dans l'événement de mise à jour")
+            logger.warning("Données manquantes dans l'événement de mise à jour")
             return
         
         before_data = before_snapshot.to_dict()
@@ -1638,46 +2021,46 @@ def send_contact_answer_email(event: firestore_fn.Event[firestore_fn.Change[fire
         contact_id = after_snapshot.id
         
         if before_data is None or after_data is None:
-            print(f"Aucune donnée trouvée pour le message de contact {contact_id}")
+            logger.warning("Aucune donnée trouvée pour le message de contact %s", contact_id)
             return
         
         # Vérifier les conditions:
         # 1. contactMethod == 'email'
         contact_method = after_data.get("contactMethod", "")
         if contact_method != "email":
-            print(f"Message {contact_id} n'est pas un email, pas d'envoi de réponse")
+            logger.debug("Message %s n'est pas un email, pas d'envoi de réponse", contact_id)
             return
         
         # 2. answered == true dans le nouveau document
         answered = after_data.get("answered", False)
         if not answered:
-            print(f"Message {contact_id} n'est pas marqué comme répondu")
+            logger.debug("Message %s n'est pas marqué comme répondu", contact_id)
             return
         
         # 3. answered == false dans l'ancien document (vient d'être répondu)
         old_answered = before_data.get("answered", False)
         if old_answered:
-            print(f"Message {contact_id} était déjà répondu, pas d'envoi de réponse")
+            logger.debug("Message %s était déjà répondu, pas d'envoi de réponse", contact_id)
             return
         
         # 4. Le document a la clé "answer" et elle n'est pas vide
         answer = after_data.get("answer", "")
         if not answer or answer.strip() == "":
-            print(f"Message {contact_id} n'a pas de réponse valide")
+            logger.info("Message %s n'a pas de réponse valide", contact_id)
             return
         
         # Récupérer l'email du client
         email = after_data.get("email", "")
         if not email or email.strip() == "":
-            print(f"Message {contact_id} n'a pas d'email valide")
+            logger.info("Message %s n'a pas d'email valide", contact_id)
             return
         
         # Vérifier que Resend API Key est configurée
         api_key = get_resend_api_key()
         if not api_key:
-            print(f"ERREUR: RESEND_API_KEY non configurée pour la réponse au message {contact_id}")
+            logger.error("RESEND_API_KEY non configurée pour la réponse au message %s", contact_id)
             return
-        resend.api_key = api_key
+        configure_resend(api_key)
         
         # Récupérer le nom du client pour personnaliser l'email
         name = after_data.get("name", "Client")
@@ -1687,193 +2070,33 @@ def send_contact_answer_email(event: firestore_fn.Event[firestore_fn.Change[fire
         
         # Envoyer l'email au client avec la réponse
         try:
-            # Créer le template HTML pour l'email de réponse
-            html_body = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <meta charset="UTF-8">
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        line-height: 1.6;
-                        color: #333;
-                        max-width: 600px;
-                        margin: 0 auto;
-                        padding: 20px;
-                    }}
-                    .header {{
-                        background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                        color: white;
-                        padding: 30px;
-                        text-align: center;
-                        border-radius: 10px 10px 0 0;
-                    }}
-                    .content {{
-                        background: #f9f9f9;
-                        padding: 30px;
-                        border-radius: 0 0 10px 10px;
-                    }}
-                    .message-box {{
-                        background: white;
-                        padding: 20px;
-                        border-radius: 8px;
-                        margin: 20px 0;
-                        border-left: 4px solid #667eea;
-                    }}
-                    .original-message-box {{
-                        background: #f0f0f0;
-                        padding: 20px;
-                        border-radius: 8px;
-                        margin: 20px 0;
-                        border-left: 4px solid #999;
-                    }}
-                    .footer {{
-                        text-align: center;
-                        margin-top: 30px;
-                        padding-top: 20px;
-                        border-top: 1px solid #ddd;
-                        color: #666;
-                        font-size: 12px;
-                    }}
-                </style>
-            </head>
-            <body>
-                <div class="header">
-                    <h1>Réponse à votre message</h1>
-                </div>
-                <div class="content">
-                    <p>Bonjour {name},</p>
-                    <p>Nous avons bien reçu votre message et nous vous répondons ci-dessous :</p>
-                    <div class="original-message-box">
-                        <p style="font-weight: bold; margin-top: 0; color: #666;">Votre message :</p>
-                        <p style="white-space: pre-wrap; margin: 0;">{original_message}</p>
-                    </div>
-                    <div class="message-box">
-                        <p style="font-weight: bold; margin-top: 0; color: #667eea;">Notre réponse :</p>
-                        <p style="white-space: pre-wrap; margin: 0;">{answer}</p>
-                    </div>
-                    <p>N'hésitez pas à nous contacter si vous avez d'autres questions.</p>
-                    <p>Cordialement,<br>L'équipe Harmonya</p>
-                    <p style="text-align: center; margin-top: 20px;">
-                        <a href="https://harmonyamassage.fr" style="display: inline-block; background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; font-weight: bold;">Visitez notre site web</a>
-                    </p>
-                </div>
-                <div class="footer">
-                    <p>Harmonya Massage & Bien-être</p>
-                    <p>1 A rue de la poste, 67400 ILLKIRCH GRAFFENSTADEN</p>
-                    <p>Téléphone: 06 26 14 25 89</p>
-                    <p><a href="https://harmonyamassage.fr" style="color: #667eea; text-decoration: none;">https://harmonyamassage.fr</a></p>
-                </div>
-            </body>
-            </html>
-            """
+            html_body = get_html_template_contact_answer(name, original_message, answer)
             
-            result = resend.Emails.send({
+            result = send_email({
                 "from": FROM_EMAIL,
                 "to": email.strip(),
                 "subject": f"Réponse à votre message - Harmonya",
                 "html": html_body,
-            })
-            print(f"Email de réponse envoyé avec succès pour le message {contact_id} à {email}: {result}")
+            }, "contact_answer")
+            logger.info("Email de réponse envoyé avec succès pour le message %s à %s: %s", contact_id, email, result)
         except Exception as e:
-            print(f"Erreur lors de l'envoi de l'email de réponse: {str(e)}")
-            import traceback
-            traceback.print_exc()
-            
-    except Exception as e:
-        print(f"Erreur générale dans send_contact_answer_email: {str(e)}")
-        import traceback
-        traceback.print_exc()
-
-
-def update_customer_service_names(
-    service_id: str,
-    new_name: str,
-    service_type_field: str,
-    service_names_field: str,
-    service_type_label: str
-) -> None:
-    """
-    Fonction générique pour mettre à jour les noms de service dans les documents clients
-    
-    Args:
-        service_id: L'ID du service (massage ou traitement)
-        new_name: Le nouveau nom du service
-        service_type_field: Le nom du champ contenant les IDs (ex: "massageTypes" ou "treatmentTypes")
-        service_names_field: Le nom du champ contenant les noms (ex: "massageTypesNames" ou "treatmentTypesNames")
-        service_type_label: Le label pour les logs (ex: "massage" ou "traitement")
-    """
-    try:
-        print(f"Le nom du {service_type_label} {service_id} a changé vers '{new_name}'")
-        
-        # Récupérer tous les clients qui ont ce service dans leur liste
-        db = firestore.client()
-        customers_ref = db.collection("customers")
-        
-        # Query pour trouver les clients avec ce service ID dans le tableau approprié
-        customers_query = customers_ref.where(service_type_field, "array_contains", service_id).stream()
-        
-        # Collecter toutes les mises à jour
-        updates = []
-        for customer_doc in customers_query:
-            try:
-                customer_data = customer_doc.to_dict()
-                service_types = customer_data.get(service_type_field, [])
-                service_types_names = customer_data.get(service_names_field, [])
-                
-                # Trouver l'index du service ID dans le tableau
-                if service_id in service_types:
-                    index = service_types.index(service_id)
-                    # Mettre à jour le nom correspondant
-                    if index < len(service_types_names):
-                        service_types_names[index] = new_name
-                    else:
-                        # Si le tableau des noms est plus court, l'étendre
-                        while len(service_types_names) < index:
-                            service_types_names.append("")
-                        service_types_names.append(new_name)
-                    
-                    # Ajouter à la liste des mises à jour
-                    updates.append((customer_doc.reference, service_types_names))
-            except Exception as e:
-                print(f"Erreur lors du traitement du client {customer_doc.id}: {str(e)}")
-                import traceback
-                traceback.print_exc()
-        
-        # Effectuer les mises à jour par batch (max 500 par batch)
-        batch_size = 500
-        updated_count = 0
-        for i in range(0, len(updates), batch_size):
-            batch = db.batch()
-            batch_updates = updates[i:i + batch_size]
+            logger.exception("Erreur lors de l'envoi de l'email de réponse")
             
-            for customer_ref, service_types_names in batch_updates:
-                batch.update(customer_ref, {
-                    service_names_field: service_types_names
-                })
-            
-            # Commiter le batch
-            batch.commit()
-            updated_count += len(batch_updates)
-            print(f"Batch {i // batch_size + 1}: Mis à jour {len(batch_updates)} client(s)")
-        
-        print(f"Mis à jour {updated_count} client(s) au total pour le {service_type_label} {service_id}")
-        
     except Exception as e:
-        print(f"Erreur dans update_customer_service_names: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_contact_answer_email")
 
 
-@firestore_fn.on_document_updated(
+@massages_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
     document="massages/{massageId}",
     region="europe-west9"
-)
+))
+@instrumented
+@watch_fields("name")
 def update_customer_massage_names(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée lorsqu'un massage est mis à jour
-    Met à jour les noms de massage dans les documents clients si le nom a changé
+    Si le nom a changé, met la prestation en attente de mise à jour des documents
+    clients (appliquée par flush_service_renames, voir service_renames.py)
     """
     try:
         before_snapshot = event.data.before
@@ -1894,29 +2117,24 @@ def update_customer_massage_names(event: firestore_fn.Event[firestore_fn.Change[
             # Le nom n'a pas changé ou est vide, pas besoin de mettre à jour
             return
         
-        # Appeler la fonction générique
-        update_customer_service_names(
-            service_id=massage_id,
-            new_name=new_name,
-            service_type_field="massageTypes",
-            service_names_field="massageTypesNames",
-            service_type_label="massage"
-        )
+        logger.info("Le nom du massage %s a changé vers '%s'", massage_id, new_name)
+        queue_service_rename(firestore.client(), "massages", massage_id)
         
     except Exception as e:
-        print(f"Erreur dans update_customer_massage_names: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur dans update_customer_massage_names")
 
 
-@firestore_fn.on_document_updated(
+@treatments_dispatcher.handler(UPDATED, firestore_fn.on_document_updated(
     document="treatments/{treatmentId}",
     region="europe-west9"
-)
+))
+@instrumented
+@watch_fields("name")
 def update_customer_treatment_names(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
     """
     Fonction déclenchée lorsqu'un traitement est mis à jour
-    Met à jour les noms de traitement dans les documents clients si le nom a changé
+    Si le nom a changé, met la prestation en attente de mise à jour des documents
+    clients (appliquée par flush_service_renames, voir service_renames.py)
     """
     try:
         before_snapshot = event.data.before
@@ -1937,22 +2155,578 @@ def update_customer_treatment_names(event: firestore_fn.Event[firestore_fn.Chang
             # Le nom n'a pas changé ou est vide, pas besoin de mettre à jour
             return
         
-        # Appeler la fonction générique
-        update_customer_service_names(
-            service_id=treatment_id,
-            new_name=new_name,
-            service_type_field="treatmentTypes",
-            service_names_field="treatmentTypesNames",
-            service_type_label="traitement"
+        logger.info("Le nom du traitement %s a changé vers '%s'", treatment_id, new_name)
+        queue_service_rename(firestore.client(), "treatments", treatment_id)
+        
+    except Exception as e:
+        logger.exception("Erreur dans update_customer_treatment_names")
+
+
+@massages_dispatcher.handler(WRITTEN, firestore_fn.on_document_written(
+    document="massages/{massageId}",
+    region="europe-west9"
+))
+@instrumented
+def rebuild_catalog_on_massage_change(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+    """
+    Fonction déclenchée à chaque création, modification ou suppression d'un massage
+    Rattache les variantes de sa photo si besoin et reconstruit l'instantané
+    public du catalogue (catalog/snapshot)
+    """
+    try:
+        db = firestore.client()
+        after = event.data.after if event.data is not None else None
+        if after is not None:
+            try:
+                attach_existing_variants(db, "massages", after.id, after.to_dict())
+            except Exception as e:
+                logger.exception("Erreur lors du rattachement des variantes d'image pour %s", after.id)
+        rebuild_catalog_snapshot(db)
+    except Exception as e:
+        logger.exception("Erreur générale dans rebuild_catalog_on_massage_change")
+
+
+@treatments_dispatcher.handler(WRITTEN, firestore_fn.on_document_written(
+    document="treatments/{treatmentId}",
+    region="europe-west9"
+))
+@instrumented
+def rebuild_catalog_on_treatment_change(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+    """
+    Fonction déclenchée à chaque création, modification ou suppression d'un soin
+    Rattache les variantes de sa photo si besoin et reconstruit l'instantané
+    public du catalogue (catalog/snapshot)
+    """
+    try:
+        db = firestore.client()
+        after = event.data.after if event.data is not None else None
+        if after is not None:
+            try:
+                attach_existing_variants(db, "treatments", after.id, after.to_dict())
+            except Exception as e:
+                logger.exception("Erreur lors du rattachement des variantes d'image pour %s", after.id)
+        rebuild_catalog_snapshot(db)
+    except Exception as e:
+        logger.exception("Erreur générale dans rebuild_catalog_on_treatment_change")
+
+
+@storage_fn.on_object_finalized(
+    region="europe-west9",
+    memory=options.MemoryOption.GB_1,
+    timeout_sec=300
+)
+@instrumented
+def generate_image_variants(event: storage_fn.CloudEvent[storage_fn.StorageObjectData]) -> None:
+    """
+    Fonction déclenchée à la fin de chaque envoi dans Storage
+    Pour une photo de massage ou de soin, génère les variantes WebP/JPEG
+    redimensionnées et enregistre leurs URL sur la prestation (image_variants.py)
+    """
+    try:
+        storage_object = event.data
+        object_name = storage_object.name
+        # Variantes (métadonnée resized) et autres fichiers : rien à faire
+        if parse_source_path(object_name) is None or (storage_object.metadata or {}).get("resized") == "true":
+            return
+        if not (storage_object.content_type or "").startswith("image/"):
+            logger.debug("Fichier %s ignoré (type %s)", object_name, storage_object.content_type)
+            return
+        record = generate_variants(storage.bucket(storage_object.bucket), object_name)
+        record_variants(firestore.client(), object_name, record)
+    except Exception as e:
+        logger.exception("Erreur générale dans generate_image_variants")
+
+
+@scheduler_fn.on_schedule(
+    schedule="every 10 minutes",
+    region="europe-west9",
+    secrets=["RESEND_API_KEY"]
+)
+@instrumented
+def retry_deferred_emails(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui renvoie les emails différés pendant une panne de Resend
+    (circuit breaker ouvert, voir email_sender.py)
+    """
+    try:
+        api_key = get_resend_api_key()
+        if not api_key:
+            logger.error("RESEND_API_KEY non configurée pour le renvoi des emails différés")
+            return
+        configure_resend(api_key)
+        
+        replay_deferred_emails()
+        
+    except Exception as e:
+        logger.exception("Erreur générale dans retry_deferred_emails")
+
+
+@scheduler_fn.on_schedule(
+    schedule=RENAME_FLUSH_SCHEDULE,
+    region="europe-west9"
+)
+@instrumented
+def flush_service_renames(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui applique aux documents clients, en une passe, les
+    renommages de prestations regroupés (voir service_renames.py)
+    """
+    try:
+        apply_service_renames(firestore.client())
+    except Exception as e:
+        logger.exception("Erreur générale dans flush_service_renames")
+
+
+def get_booking_start(booking: dict) -> datetime | None:
+    """Date et heure de début d'une réservation (champ date + champ time "HH:MM"), dans BUSINESS_TIMEZONE"""
+    day = parse_firestore_date(booking.get("date"))
+    if day is None:
+        return None
+    if day.tzinfo is None:
+        # parse_firestore_date retourne l'heure UTC du serveur pour un Timestamp Firestore
+        day = day.replace(tzinfo=timezone.utc)
+    try:
+        hours, minutes = (int(part) for part in str(booking.get("time", "")).split(":")[:2])
+    except ValueError:
+        hours, minutes = 0, 0
+    local_day = day.astimezone(BUSINESS_TIMEZONE)
+    return local_day.replace(hour=hours, minute=minutes, second=0, microsecond=0)
+
+
+@scheduler_fn.on_schedule(
+    schedule=REMINDER_SCHEDULE,
+    region="europe-west9",
+    secrets=["RESEND_API_KEY"]
+)
+@instrumented
+def send_booking_reminders(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui envoie un rappel aux clients ayant une réservation confirmée
+    dans les REMINDER_HOURS_AHEAD prochaines heures
+    - requête indexée (status + date) limitée à la fenêtre, jamais de scan de "bookings"
+    - marqueur reminderSentAt posé avant l'envoi pour ne jamais envoyer deux rappels
+    - envoi groupé via l'API batch de Resend (send_batch)
+    """
+    try:
+        api_key = get_resend_api_key()
+        if not api_key:
+            logger.error("RESEND_API_KEY non configurée pour les rappels de rendez-vous")
+            return
+        configure_resend(api_key)
+        
+        now = datetime.now(BUSINESS_TIMEZONE)
+        window_end = now + timedelta(hours=REMINDER_HOURS_AHEAD)
+        # Le champ date contient le jour du rendez-vous (minuit) : partir du début de la journée
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        
+        db = firestore.client()
+        docs = (
+            db.collection("bookings")
+            .where("status", "==", "confirmed")
+            .where("date", ">=", day_start.astimezone(timezone.utc))
+            .where("date", "<=", window_end.astimezone(timezone.utc))
+            .select(["name", "email", "date", "time", "massageType", "serviceType",
+                     "isAtHome", "homeAddress", "reminderSentAt"])
+            .stream()
         )
         
+        due = []
+        for doc in docs:
+            metrics.count_reads()
+            booking = doc.to_dict() or {}
+            if booking.get("reminderSentAt") or not booking.get("email"):
+                continue
+            start = get_booking_start(booking)
+            if start is None or not now < start <= window_end:
+                continue
+            due.append((doc, booking, start))
+        
+        if not due:
+            logger.info("Aucun rappel de rendez-vous à envoyer")
+            return
+        
+        # Poser le marqueur avant l'envoi : un rappel différé sera renvoyé par retry_deferred_emails
+        for chunk_start in range(0, len(due), 500):
+            batch = db.batch()
+            for doc, _, _ in due[chunk_start:chunk_start + 500]:
+                batch.update(doc.reference, {"reminderSentAt": firestore.SERVER_TIMESTAMP})
+            batch.commit()
+        
+        service_names = get_service_names([booking for _, booking, _ in due])
+        emails = []
+        for _, booking, start in due:
+            service_name, service_label = get_service_name_and_label(booking, service_names)
+            emails.append({
+                "from": FROM_EMAIL,
+                "to": booking["email"],
+                "subject": f"Rappel de votre rendez-vous du {format_date_french(start)} à {booking.get('time', '')} - Harmonya",
+                "html": get_html_template_reminder(booking, format_date_french(start), service_name, service_label),
+            })
+        
+        results = send_batch(emails, "booking_reminder")
+        failed = [doc.id for (doc, _, _), result in zip(due, results) if result is None]
+        if failed:
+            logger.error("Rappels non envoyés (erreur définitive) pour les réservations: %s", ", ".join(failed))
+        logger.info("%s rappel(s) de rendez-vous traité(s)", len(due) - len(failed))
+        
     except Exception as e:
-        print(f"Erreur dans update_customer_treatment_names: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Erreur générale dans send_booking_reminders")
+
+
+def _paid_vouchers_query(db: Any, start: datetime | None, end: datetime) -> Any:
+    """Bons cadeaux payés dont expiresAt est dans [start, end[ (index giftVouchers status + expiresAt)"""
+    query = db.collection("giftVouchers").where("status", "==", "paid")
+    if start is not None:
+        query = query.where("expiresAt", ">=", start)
+    return query.where("expiresAt", "<", end).order_by("expiresAt").limit(VOUCHER_SWEEP_PAGE_SIZE)
+
+
+def expire_gift_vouchers(db: Any, now: datetime) -> tuple[int, bool]:
+    """
+    Passe au statut "expired" les bons cadeaux payés dont la date d'expiration est dépassée
+    Parcourt les bons concernés par pages (curseur sur expiresAt) et écrit via un BulkWriter
+    Retourne (nombre de bons expirés, True si le parcours est complet)
+    S'arrête avant la fin du budget de l'invocation : les bons restants ont toujours le
+    statut "paid" et seront repris par la requête au prochain passage
+    """
+    expired = 0
+    failures = []
+    bulk_writer = db.bulk_writer()
+    
+    def on_write_error(failure: Any, writer: Any) -> bool:
+        # Réessayer les erreurs temporaires, abandonner le reste (repris au prochain passage)
+        if failure.attempts < 3:
+            return True
+        failures.append(failure.operation.reference.id)
+        return False
+    
+    bulk_writer.on_write_error(on_write_error)
+    query = _paid_vouchers_query(db, None, now)
+    complete = False
+    try:
+        while True:
+            page = list(query.stream())
+            metrics.count_reads(len(page))
+            for doc in page:
+                bulk_writer.update(doc.reference, {
+                    "status": "expired",
+                    "expiredAt": firestore.SERVER_TIMESTAMP,
+                })
+            expired += len(page)
+            if len(page) < VOUCHER_SWEEP_PAGE_SIZE:
+                complete = True
+                break
+            if remaining_budget() < 10:
+                logger.warning("Budget de l'invocation presque épuisé, expiration des bons reprise au prochain passage")
+                break
+            query = _paid_vouchers_query(db, None, now).start_after(page[-1])
+    finally:
+        bulk_writer.close()
+    
+    if failures:
+        logger.error("Bons cadeaux non expirés (repris au prochain passage): %s", ", ".join(failures))
+    metrics.inc("gift_vouchers_expired_total", expired - len(failures))
+    return expired - len(failures), complete
+
+
+def send_voucher_expiry_notices(db: Any, now: datetime) -> int:
+    """
+    Envoie un avis aux destinataires des bons cadeaux qui expirent dans les
+    VOUCHER_EXPIRY_NOTICE_DAYS prochains jours ; le marqueur expiryNoticeSentAt,
+    posé avant l'envoi, évite les avis en double
+    """
+    due = []
+    query = _paid_vouchers_query(db, now, now + timedelta(days=VOUCHER_EXPIRY_NOTICE_DAYS))
+    while True:
+        page = list(query.stream())
+        metrics.count_reads(len(page))
+        for doc in page:
+            # to_dict : DocumentSnapshot.get lève KeyError pour un champ absent (marqueur pas encore posé)
+            data = doc.to_dict() or {}
+            if not data.get("expiryNoticeSentAt") and data.get("recipientEmail"):
+                due.append(doc)
+        if len(page) < VOUCHER_SWEEP_PAGE_SIZE or remaining_budget() < 15:
+            break
+        query = query.start_after(page[-1])
+    
+    if not due:
+        return 0
+    
+    bulk_writer = db.bulk_writer()
+    for doc in due:
+        bulk_writer.update(doc.reference, {"expiryNoticeSentAt": firestore.SERVER_TIMESTAMP})
+    bulk_writer.close()
+    
+    emails = []
+    for doc in due:
+        voucher = doc.to_dict() or {}
+        emails.append({
+            "from": FROM_EMAIL,
+            "to": voucher["recipientEmail"],
+            "subject": "⏳ Votre bon cadeau Harmonya expire bientôt",
+            "html": get_html_template_voucher_expiring(voucher, doc.id),
+        })
+    results = send_batch(emails, "voucher_expiring")
+    return sum(1 for result in results if result is not None)
+
+
+@scheduler_fn.on_schedule(
+    schedule=VOUCHER_SWEEP_SCHEDULE,
+    timezone=scheduler_fn.Timezone("Europe/Paris"),
+    region="europe-west9",
+    secrets=["RESEND_API_KEY"]
+)
+@instrumented
+def sweep_gift_vouchers(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui marque les bons cadeaux expirés et, si
+    VOUCHER_EXPIRY_NOTICE_DAYS > 0, prévient les destinataires des bons qui expirent bientôt
+    Le coût dépend du nombre de bons concernés, pas de la taille de la collection
+    """
+    try:
+        db = firestore.client()
+        now = datetime.now(timezone.utc)
+        
+        expired, complete = expire_gift_vouchers(db, now)
+        logger.info("%s bon(s) cadeau(x) expiré(s)%s", expired, "" if complete else " (reste à traiter)")
+        
+        notices = 0
+        if VOUCHER_EXPIRY_NOTICE_DAYS > 0:
+            api_key = get_resend_api_key()
+            if not api_key:
+                logger.error("RESEND_API_KEY non configurée pour les avis d'expiration des bons cadeaux")
+            else:
+                configure_resend(api_key)
+                notices = send_voucher_expiry_notices(db, now)
+                logger.info("%s avis d'expiration de bon cadeau envoyé(s)", notices)
+        
+        # Suivi des passages ; la reprise ne dépend pas de cet état : les bons non traités
+        # restent "paid" et sont retrouvés par la requête au passage suivant
+        db.collection("sweeperState").document("giftVouchers").set({
+            "lastRunAt": firestore.SERVER_TIMESTAMP,
+            "lastExpired": expired,
+            "lastNotices": notices,
+            "complete": complete,
+            "totalExpired": firestore.Increment(expired),
+        }, merge=True)
+        
+    except Exception as e:
+        logger.exception("Erreur générale dans sweep_gift_vouchers")
+
+
+@scheduler_fn.on_schedule(
+    schedule=BOOKING_ARCHIVE_SCHEDULE,
+    timezone=scheduler_fn.Timezone("Europe/Paris"),
+    region="europe-west9"
+)
+@instrumented
+def archive_old_bookings(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui déplace les réservations anciennes dans "bookingsArchive"
+    et tient à jour les agrégats mensuels (voir booking_archive.py)
+    """
+    try:
+        db = firestore.client()
+        archived, complete = archive_bookings(db, datetime.now(timezone.utc))
+        
+        # Suivi des passages, comme pour les bons cadeaux
+        db.collection("sweeperState").document("bookings").set({
+            "lastRunAt": firestore.SERVER_TIMESTAMP,
+            "lastArchived": archived,
+            "complete": complete,
+            "totalArchived": firestore.Increment(archived),
+        }, merge=True)
+        
+    except Exception as e:
+        logger.exception("Erreur générale dans archive_old_bookings")
+
+
+ADMIN_DIGEST_SECTIONS = {
+    "booking_admin": "Nouvelles réservations",
+    "review_admin": "Nouveaux commentaires",
+    "contact_admin": "Nouveaux messages de contact",
+    "voucher_admin": "Nouveaux bons cadeaux",
+}
+
+
+@email_template
+def get_html_template_admin_digest(notifications: list[dict]) -> str:
+    """Génère le template HTML du récapitulatif des notifications admin"""
+    sections_html = ""
+    for notification_type, title in list(ADMIN_DIGEST_SECTIONS.items()) + [("", "Autres notifications")]:
+        if notification_type:
+            items = [n for n in notifications if n.get("type") == notification_type]
+        else:
+            items = [n for n in notifications if n.get("type") not in ADMIN_DIGEST_SECTIONS]
+        if not items:
+            continue
+        items_html = ""
+        for item in items:
+            rows_html = "".join(
+                f"""
+        <div class="info-row">
+          <span class="label">{label}:</span> {value}
+        </div>"""
+                for label, value in (item.get("summary") or {}).items()
+                if value
+            )
+            items_html += f"""
+      <div class="item">
+        <p class="subject">{item.get("subject", "")}</p>{rows_html}
+      </div>"""
+        sections_html += f"""
+      <h2>{title} ({len(items)})</h2>{items_html}"""
+    
+    return f"""
+<!DOCTYPE html>
+<html>
+<head>
+  <meta charset="UTF-8">
+  <style>
+    body {{ font-family: Arial, sans-serif; line-height: 1.6; color: #333; }}
+    .container {{ max-width: 600px; margin: 0 auto; padding: 20px; }}
+    .header {{ background-color: #6B4423; color: white; padding: 20px; text-align: center; }}
+    .content {{ background-color: #F5F1E8; padding: 20px; }}
+    h2 {{ color: #6B4423; font-size: 18px; border-bottom: 1px solid #6B4423; padding-bottom: 5px; }}
+    .item {{ background-color: white; padding: 10px 15px; margin: 10px 0; border-left: 4px solid #6B4423; }}
+    .subject {{ font-weight: bold; margin: 0 0 5px 0; }}
+    .info-row {{ margin: 5px 0; }}
+    .label {{ font-weight: bold; color: #6B4423; }}
+    .footer {{ text-align: center; margin-top: 20px; color: #666; font-size: 12px; }}
+  </style>
+</head>
+<body>
+  <div class="container">
+    <div class="header">
+      <h1>Récapitulatif des notifications</h1>
+    </div>
+    <div class="content">
+      <p>{len(notifications)} notification(s) depuis le dernier récapitulatif :</p>
+      {sections_html}
+    </div>
+    <div class="footer">
+      <p>Harmonya - Massage & Bien-être</p>
+      <p>1 A rue de la poste 67400 ILLKIRCH GRAFFENSTADEN</p>
+      <p><a href="https://harmonyamassage.fr" style="color: #6B4423; text-decoration: none;">harmonyamassage.fr</a></p>
+    </div>
+  </div>
+</body>
+</html>
+"""
+
+
+@scheduler_fn.on_schedule(
+    schedule=ADMIN_DIGEST_SCHEDULE,
+    region="europe-west9",
+    secrets=["RESEND_API_KEY"]
+)
+@instrumented
+def send_admin_digest(event: scheduler_fn.ScheduledEvent) -> None:
+    """
+    Fonction planifiée qui envoie à l'administrateur un seul email récapitulant
+    les notifications accumulées en mode digest (voir admin_digest.py)
+    """
+    try:
+        docs = pending_notifications()
+        if not docs:
+            logger.debug("Aucune notification admin en attente")
+            return
+        
+        api_key = get_resend_api_key()
+        if not api_key:
+            logger.error("RESEND_API_KEY non configurée pour le récapitulatif admin")
+            return
+        configure_resend(api_key)
+        
+        notifications = [doc.to_dict() or {} for doc in docs]
+        result = send_email({
+            "from": FROM_EMAIL,
+            "to": ADMIN_EMAIL,
+            "subject": f"Récapitulatif Harmonya - {len(notifications)} notification(s)",
+            "html": get_html_template_admin_digest(notifications),
+        }, "admin_digest")
+        # Un récapitulatif différé (panne Resend) sera renvoyé par retry_deferred_emails
+        clear_notifications(docs)
+        logger.info("Récapitulatif admin envoyé (%s notifications): %s", len(notifications), result)
+        
+    except Exception as e:
+        logger.exception("Erreur générale dans send_admin_digest")
+
+
+if bookings_dispatcher.dispatching:
+    @firestore_fn.on_document_written(
+        document="bookings/{bookingId}",
+        region="europe-west9",
+        secrets=["RESEND_API_KEY"]
+    )
+    def bookings_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "bookings" : création (send_booking_email)
+        et mise à jour (send_booking_status_email)
+        """
+        bookings_dispatcher.dispatch(event)
+
+    @firestore_fn.on_document_written(
+        document="giftVouchers/{voucherId}",
+        region="europe-west9",
+        secrets=["RESEND_API_KEY"]
+    )
+    def gift_vouchers_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "giftVouchers" : création (send_voucher_emails_on_create)
+        et mise à jour (send_voucher_emails)
+        """
+        vouchers_dispatcher.dispatch(event)
+
+    @firestore_fn.on_document_written(
+        document="contactMessages/{contactId}",
+        region="europe-west9",
+        secrets=["RESEND_API_KEY"]
+    )
+    def contact_messages_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "contactMessages" : création (send_contact_message_email)
+        et mise à jour (send_contact_answer_email)
+        """
+        contact_messages_dispatcher.dispatch(event)
+
+    @firestore_fn.on_document_written(
+        document="reviews/{reviewId}",
+        region="europe-west9",
+        secrets=["RESEND_API_KEY"]
+    )
+    def reviews_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "reviews" : création (send_review_notification_email),
+        approbation ou changement de note (update_review_stats) et suppression (remove_review_stats)
+        """
+        reviews_dispatcher.dispatch(event)
+
+    @firestore_fn.on_document_written(
+        document="massages/{massageId}",
+        region="europe-west9"
+    )
+    def massages_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "massages" : renommage (update_customer_massage_names)
+        et instantané du catalogue (rebuild_catalog_on_massage_change)
+        """
+        massages_dispatcher.dispatch(event)
+
+    @firestore_fn.on_document_written(
+        document="treatments/{treatmentId}",
+        region="europe-west9"
+    )
+    def treatments_trigger(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+        """
+        Trigger unique de la collection "treatments" : renommage (update_customer_treatment_names)
+        et instantané du catalogue (rebuild_catalog_on_treatment_change)
+        """
+        treatments_dispatcher.dispatch(event)
 
 
 @https_fn.on_request(region="europe-west9")
+@instrumented
 def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
     """
     Handle PayPal webhook events
@@ -1999,7 +2773,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
         # 
         # For now, skipping verification for testing (NOT RECOMMENDED FOR PRODUCTION)
         
-        print(f"Received PayPal webhook event: {event_type}")
+        logger.info("Received PayPal webhook event: %s", event_type)
         
         # Handle different event types
         if event_type == "PAYMENT.CAPTURE.COMPLETED":
@@ -2020,13 +2794,14 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             if custom_id:
                 # Update voucher status in Firestore
                 collection_name = "giftVouchers"  # Explicitly set collection name
-                print(f"DEBUG: Attempting to update voucher {custom_id} in collection '{collection_name}'")
+                logger.debug("Attempting to update voucher %s in collection '%s'", custom_id, collection_name)
                 voucher_ref = firestore.client().collection(collection_name).document(custom_id)
                 
                 # Check if document exists first
                 doc = voucher_ref.get()
+                metrics.count_reads()
                 if not doc.exists:
-                    print(f"ERROR: Voucher document {custom_id} does not exist in collection '{collection_name}'")
+                    logger.error("Voucher document %s does not exist in collection '%s'", custom_id, collection_name)
                     return https_fn.Response(
                         json.dumps({"error": f"Voucher {custom_id} not found in collection '{collection_name}'"}),
                         status=404,
@@ -2039,12 +2814,12 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
                         "paidAt": firestore.SERVER_TIMESTAMP,
                         "paypalOrderId": order_id,
                     })
-                    print(f"Updated voucher {custom_id} to paid status in collection '{collection_name}'")
+                    logger.info("Updated voucher %s to paid status in collection '%s'", custom_id, collection_name)
                 except Exception as update_error:
-                    print(f"ERROR updating voucher {custom_id}: {str(update_error)}")
+                    logger.error("Error updating voucher %s: %s", custom_id, update_error)
                     raise update_error
             else:
-                print(f"Warning: No custom_id found in webhook for order {order_id}")
+                logger.warning("No custom_id found in webhook for order %s", order_id)
             
             return https_fn.Response(
                 json.dumps({"status": "success"}),
@@ -2066,7 +2841,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             
             if custom_id:
                 # Optionally update voucher status or send notification
-                print(f"Payment denied for voucher {custom_id}")
+                logger.info("Payment denied for voucher %s", custom_id)
             
             return https_fn.Response(
                 json.dumps({"status": "received"}),
@@ -2089,13 +2864,14 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             if custom_id:
                 # Update voucher status
                 collection_name = "giftVouchers"  # Explicitly set collection name
-                print(f"DEBUG: Attempting to update voucher {custom_id} in collection '{collection_name}'")
+                logger.debug("Attempting to update voucher %s in collection '%s'", custom_id, collection_name)
                 voucher_ref = firestore.client().collection(collection_name).document(custom_id)
                 
                 # Check if document exists first
                 doc = voucher_ref.get()
+                metrics.count_reads()
                 if not doc.exists:
-                    print(f"ERROR: Voucher document {custom_id} does not exist in collection '{collection_name}'")
+                    logger.error("Voucher document %s does not exist in collection '%s'", custom_id, collection_name)
                     return https_fn.Response(
                         json.dumps({"error": f"Voucher {custom_id} not found in collection '{collection_name}'"}),
                         status=404,
@@ -2106,9 +2882,9 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
                     voucher_ref.update({
                         "status": "refunded",
                     })
-                    print(f"Updated voucher {custom_id} to refunded status in collection '{collection_name}'")
+                    logger.info("Updated voucher %s to refunded status in collection '%s'", custom_id, collection_name)
                 except Exception as update_error:
-                    print(f"ERROR updating voucher {custom_id}: {str(update_error)}")
+                    logger.error("Error updating voucher %s: %s", custom_id, update_error)
                     raise update_error
             
             return https_fn.Response(
@@ -2119,7 +2895,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
         
         else:
             # Unknown event type - log but don't fail
-            print(f"Unhandled event type: {event_type}")
+            logger.info("Unhandled event type: %s", event_type)
             return https_fn.Response(
                 json.dumps({"status": "received"}),
                 status=200,
@@ -2127,12 +2903,274 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             )
     
     except Exception as e:
-        print(f"Error processing PayPal webhook: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing PayPal webhook")
         
         return https_fn.Response(
             json.dumps({"error": str(e)}),
             status=500,
             mimetype="application/json"
         )
+
+
+@https_fn.on_request(region="europe-west9", cors=ADMIN_CORS)
+@instrumented
+def search_customers(req: https_fn.Request) -> https_fn.Response:
+    """
+    Recherche de clients par préfixe de nom, email ou téléphone (admin authentifié)
+    GET ?q=<saisie>&limit=<nombre> -> {"results": [{id, name, email, phone, score}, ...]}
+    Une seule requête indexée sur "searchPrefixes" (customer_search.py)
+    """
+    try:
+        if authenticate(req) is None:
+            return unauthorized()
+        query = req.args.get("q", "").strip()
+        try:
+            limit = max(1, min(100, int(req.args.get("limit", SEARCH_DEFAULT_LIMIT))))
+        except ValueError:
+            return json_response({"error": "Invalid limit"}, status=400)
+        if not query:
+            return json_response({"results": []})
+        results = customer_search.search_customers(firestore.client(), query, limit)
+        return json_response({"results": results})
+    except Exception as e:
+        logger.exception("Erreur générale dans search_customers")
+        return json_response({"error": "Internal error"}, status=500)
+
+
+@firestore_fn.on_document_written(
+    document="customers/{customerEmail}",
+    region="europe-west9"
+)
+@instrumented
+@skip_imported
+@watch_fields("name", "email", "phone")
+def update_customer_search_prefixes(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot | None]]) -> None:
+    """
+    Fonction déclenchée à l'écriture d'un client dont le nom, l'email ou le téléphone change
+    (application d'administration notamment) : recalcule "searchPrefixes"
+    Sa propre écriture ne modifie aucun champ surveillé et est donc ignorée
+    """
+    try:
+        after = event.data.after if event.data is not None else None
+        if after is None:
+            return
+        data = after.to_dict() or {}
+        prefixes = customer_search.customer_prefixes(data, after.id)
+        if data.get(SEARCH_PREFIXES_FIELD) == prefixes:
+            # Déjà à jour (écrit par create_or_update_customer, l'import ou le backfill)
+            return
+        after.reference.update({SEARCH_PREFIXES_FIELD: prefixes})
+        logger.info("Préfixes de recherche mis à jour pour le client %s", after.id)
+    except Exception as e:
+        logger.exception("Erreur générale dans update_customer_search_prefixes")
+
+
+@https_fn.on_request(region="europe-west9", cors=options.CorsOptions(cors_origins="*", cors_methods=["get"]))
+@instrumented
+def get_catalog(req: https_fn.Request) -> https_fn.Response:
+    """
+    Catalogue public (massages et soins triés par order) pour la page d'accueil
+    Sert l'instantané catalog/snapshot avec ETag (304 si inchangé), Cache-Control et gzip
+    """
+    try:
+        if req.method not in ("GET", "HEAD"):
+            return json_response({"error": "Method not allowed"}, status=405, headers={"Allow": "GET, HEAD"})
+        snapshot = load_catalog_snapshot(firestore.client())
+        headers = cache_headers(snapshot["etag"])
+        if etag_matches(req.headers.get("If-None-Match", ""), snapshot["etag"]):
+            return https_fn.Response(status=304, headers=headers)
+        if "gzip" in req.headers.get("Accept-Encoding", "").lower():
+            headers["Content-Encoding"] = "gzip"
+            body = snapshot["gzip"]
+        else:
+            body = snapshot["json"].encode("utf-8")
+        return https_fn.Response(body, status=200, headers=headers, content_type="application/json; charset=utf-8")
+    except Exception as e:
+        logger.exception("Erreur générale dans get_catalog")
+        return json_response({"error": "Internal error"}, status=500)
+
+
+@https_fn.on_request(region="europe-west9", cors=ADMIN_CORS, memory=options.MemoryOption.MB_256, timeout_sec=540)
+@instrumented
+def export_data(req: https_fn.Request) -> https_fn.Response:
+    """
+    Export en flux d'une collection (admin authentifié), voir data_export.py
+    GET ?collection=bookings|bookingsArchive|customers|giftVouchers&format=csv|ndjson&from=AAAA-MM-JJ&to=AAAA-MM-JJ&status=...
+    """
+    try:
+        if authenticate(req) is None:
+            return unauthorized()
+        collection = req.args.get("collection", "")
+        export_format = req.args.get("format", "csv").lower()
+        statuses = [s.strip() for s in req.args.get("status", "").split(",") if s.strip()]
+        compress = "gzip" in req.headers.get("Accept-Encoding", "").lower()
+        try:
+            stream = export_stream(
+                firestore.client(),
+                collection,
+                export_format,
+                start=parse_day(req.args.get("from", "")),
+                end=parse_day(req.args.get("to", ""), end=True),
+                statuses=statuses,
+                compress=compress,
+            )
+        except ExportError as e:
+            return json_response({"error": str(e)}, status=400)
+        extension = "csv" if export_format == "csv" else "ndjson"
+        filename = f"{collection}-{datetime.now(BUSINESS_TIMEZONE).strftime('%Y%m%d-%H%M')}.{extension}"
+        headers = {
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Cache-Control": "no-store",
+        }
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+            headers["Vary"] = "Accept-Encoding"
+        logger.info("Export %s (%s) demandé", collection, export_format)
+        # Le flux est lu par le serveur après le retour de la fonction : il garde le contexte de l'invocation
+        return https_fn.Response(invocation_stream(stream), status=200, headers=headers,
+                                 content_type=EXPORT_FORMATS[export_format])
+    except Exception as e:
+        logger.exception("Erreur générale dans export_data")
+        return json_response({"error": "Internal error"}, status=500)
+
+
+def apply_booking_status_batch(db: Any, booking_ids: list[str], new_status: str) -> list[dict]:
+    """
+    Passe les réservations au statut `new_status` (confirmed ou cancelled) en une passe :
+    - lecture des réservations par get_all, noms des services lus une seule fois
+    - statuts et historiques écrits dans un seul batch (tout ou rien)
+    - clients mis à jour (confirmations) puis emails envoyés via l'API batch de Resend
+    Retourne un résultat par réservation, dans l'ordre des IDs :
+    {"id", "result": updated|unchanged|not_found, "email": sent|deferred|failed|no_email|None}
+    """
+    booking_ids = list(dict.fromkeys(booking_ids))
+    bookings_ref = db.collection("bookings")
+    snapshots = {}
+    for doc in db.get_all([bookings_ref.document(booking_id) for booking_id in booking_ids]):
+        metrics.count_reads()
+        if doc.exists:
+            snapshots[doc.id] = doc
+    
+    results = {}
+    changed = []
+    for booking_id in booking_ids:
+        doc = snapshots.get(booking_id)
+        if doc is None:
+            results[booking_id] = {"id": booking_id, "result": "not_found", "email": None}
+            continue
+        booking = doc.to_dict() or {}
+        if booking.get("status") == new_status:
+            results[booking_id] = {"id": booking_id, "result": "unchanged", "email": None}
+            continue
+        changed.append((doc, {**booking, "status": new_status}))
+    if not changed:
+        return [results[booking_id] for booking_id in booking_ids]
+    
+    # Statuts et historiques : un seul batch, le marqueur fait ignorer ces mises à jour
+    # par send_booking_status_email
+    action_id = uuid.uuid4().hex
+    batch = db.batch()
+    for doc, booking in changed:
+        batch.update(doc.reference, {"status": new_status, BATCH_ACTION_FIELD: action_id})
+        history = booking_history_write(db, booking, doc.id)
+        if history is not None:
+            batch.set(history[0], history[1], merge=True)
+    batch.commit()
+    logger.info("Action groupée %s: %s réservation(s) passée(s) au statut %s", action_id, len(changed), new_status)
+    
+    service_names = get_service_names([booking for _, booking in changed])
+    
+    # Clients : une lecture (get_all) et une écriture par client, même avec plusieurs réservations
+    if new_status == "confirmed":
+        customers_ref = db.collection("customers")
+        emails = list(dict.fromkeys(booking["email"] for _, booking in changed if booking.get("email")))
+        existing = {}
+        for doc in db.get_all([customers_ref.document(email) for email in emails]):
+            metrics.count_reads()
+            if doc.exists:
+                existing[doc.id] = doc.to_dict() or {}
+        customers = {}
+        for _, booking in changed:
+            email = booking.get("email")
+            if not email:
+                continue
+            service_name = booking.get("serviceName", "")
+            if not service_name and (booking.get("massageType") or "").strip():
+                service_name = get_service_name_and_label(booking, service_names)[0]
+            # Plusieurs réservations du même client : les services s'ajoutent aux champs déjà calculés
+            customers[email] = customer_fields(customers.get(email, existing.get(email)), booking, service_name)
+        batch = db.batch()
+        for email, fields in customers.items():
+            if email in existing:
+                batch.update(customers_ref.document(email), fields)
+            else:
+                batch.set(customers_ref.document(email), {"email": email, **fields, "added_at": firestore.SERVER_TIMESTAMP})
+        try:
+            batch.commit()
+        except Exception as e:
+            logger.exception("Erreur lors de la mise à jour des clients de l'action groupée %s", action_id)
+    
+    # Emails clients : un appel Resend par paquet de 100 (send_batch respecte le débit)
+    template = get_html_template_confirmed if new_status == "confirmed" else get_html_template_cancelled
+    subject = (
+        "Votre réservation est confirmée - Harmonya" if new_status == "confirmed"
+        else "Annulation de votre réservation - Harmonya"
+    )
+    outgoing = []
+    messages = []
+    for doc, booking in changed:
+        results[doc.id] = {"id": doc.id, "result": "updated", "email": "no_email"}
+        if booking.get("email"):
+            outgoing.append(doc.id)
+            messages.append({
+                "from": FROM_EMAIL,
+                "to": booking["email"],
+                "subject": subject,
+                "html": template(booking, format_date_french(booking.get("date")), service_names),
+            })
+    for booking_id, result in zip(outgoing, send_batch(messages, f"booking_{new_status}")):
+        if result is None:
+            results[booking_id]["email"] = "failed"
+        elif isinstance(result, dict) and "deferred" in result:
+            results[booking_id]["email"] = "deferred"
+        else:
+            results[booking_id]["email"] = "sent"
+    return [results[booking_id] for booking_id in booking_ids]
+
+
+@https_fn.on_request(region="europe-west9", cors=ADMIN_CORS, secrets=["RESEND_API_KEY"])
+@instrumented
+def update_bookings_status(req: https_fn.Request) -> https_fn.Response:
+    """
+    Confirme ou annule plusieurs réservations en une requête (admin authentifié)
+    POST {"ids": ["<bookingId>", ...], "status": "confirmed"|"cancelled"}
+    -> {"status": ..., "results": [{"id", "result", "email"}, ...]}
+    Voir apply_booking_status_batch ; send_booking_status_email ignore ces mises à jour
+    """
+    try:
+        if req.method != "POST":
+            return json_response({"error": "Method not allowed"}, status=405, headers={"Allow": "POST"})
+        if authenticate(req) is None:
+            return unauthorized()
+        payload = req.get_json(silent=True) or {}
+        booking_ids = payload.get("ids")
+        new_status = payload.get("status")
+        if new_status not in BATCH_ACTION_STATUSES:
+            return json_response({"error": f"Invalid status (expected {' or '.join(BATCH_ACTION_STATUSES)})"}, status=400)
+        if not isinstance(booking_ids, list) or not booking_ids \
+                or not all(isinstance(booking_id, str) and booking_id and "/" not in booking_id for booking_id in booking_ids):
+            return json_response({"error": "Invalid ids"}, status=400)
+        if len(booking_ids) > BATCH_ACTION_MAX_BOOKINGS:
+            return json_response({"error": f"Too many ids (max {BATCH_ACTION_MAX_BOOKINGS})"}, status=400)
+        
+        api_key = get_resend_api_key()
+        if not api_key:
+            logger.error("RESEND_API_KEY non configurée pour l'action groupée sur les réservations")
+            return json_response({"error": "Email not configured"}, status=500)
+        configure_resend(api_key)
+        
+        results = apply_booking_status_batch(firestore.client(), booking_ids, new_status)
+        return json_response({"status": new_status, "results": results})
+    except Exception as e:
+        logger.exception("Erreur générale dans update_bookings_status")
+        return json_response({"error": "Internal error"}, status=500)
@@ -0,0 +1,227 @@
+"""
+Métriques en mémoire (compteurs, jauges et histogrammes) pour les Cloud Functions
+
+Les valeurs sont agrégées par instance, puis publiées périodiquement :
+- METRICS_SINK=log (défaut) : une ligne de log JSON avec le snapshot complet
+- METRICS_SINK=firestore : un document par fonction et par heure dans la
+  collection "metrics" (metrics/{fonction}_{AAAAMMJJHH}), chaque instance y
+  écrit son snapshot dans la map "instances" ; le champ expiresAt porte la
+  politique TTL de la collection (METRICS_RETENTION_DAYS jours)
+- METRICS_SINK=none : aucune publication
+
+METRICS_FLUSH_INTERVAL (secondes, 60 par défaut) contrôle la fréquence de publication.
+La publication est déclenchée à la fin d'une invocation (voir instrumentation.py),
+jamais par un thread d'arrière-plan : le CPU d'une instance inactive est bridé.
+
+En local, METRICS_PORT expose en plus les métriques au format OpenMetrics
+(http://localhost:<port>/metrics).
+"""
+
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Iterator
+
+from structured_logging import current_context, get_logger
+
+logger = get_logger("metrics")
+
+METRICS_SINK = os.environ.get("METRICS_SINK", "log").lower()
+METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "60"))
+METRICS_PORT = os.environ.get("METRICS_PORT", "")
+METRICS_COLLECTION = "metrics"
+METRICS_RETENTION_DAYS = float(os.environ.get("METRICS_RETENTION_DAYS", "7"))
+
+# Bornes des histogrammes de latence (secondes)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SERVICE_NAME = os.environ.get("K_SERVICE", "local")
+INSTANCE_ID = f"{SERVICE_NAME}_{uuid.uuid4().hex[:12]}"
+
+_lock = threading.Lock()
+_counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+_gauges: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+_histograms: dict[tuple[str, tuple[tuple[str, str], ...]], dict[str, Any]] = {}
+_last_flush = time.monotonic()
+
+
+def _key(name: str, labels: dict[str, Any]) -> tuple[str, tuple[tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_key(key: tuple[str, tuple[tuple[str, str], ...]]) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def inc(name: str, value: float = 1, **labels: Any) -> None:
+    """Incrémente un compteur (ex: inc("emails_sent_total", type="booking_client"))"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels: Any) -> None:
+    """Fixe la valeur courante d'une jauge (ex: état d'un circuit breaker)"""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name: str, value: float, buckets: tuple[float, ...] = LATENCY_BUCKETS, **labels: Any) -> None:
+    """Enregistre une observation dans un histogramme"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = {"buckets": buckets, "counts": [0] * len(buckets), "count": 0, "sum": 0.0}
+            _histograms[key] = histogram
+        for i, bound in enumerate(histogram["buckets"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["count"] += 1
+        histogram["sum"] += value
+
+
+@contextmanager
+def timer(name: str, **labels: Any) -> Iterator[None]:
+    """Mesure la durée du bloc dans l'histogramme `name`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def count_reads(count: int = 1) -> None:
+    """Compte des lectures Firestore, attribuées à la fonction de l'invocation courante"""
+    inc("firestore_reads_total", count, function=current_context().get("function", "unknown"))
+
+
+def snapshot() -> dict[str, Any]:
+    """Retourne une copie des compteurs, jauges et histogrammes (clés au format OpenMetrics)"""
+    with _lock:
+        counters = {_format_key(k): v for k, v in _counters.items()}
+        gauges = {_format_key(k): v for k, v in _gauges.items()}
+        histograms = {}
+        for key, histogram in _histograms.items():
+            cumulative = 0
+            buckets = {}
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                buckets[str(bound)] = cumulative
+            histograms[_format_key(key)] = {
+                "count": histogram["count"],
+                "sum": histogram["sum"],
+                "buckets": buckets,
+            }
+    return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+
+def _counter_family(name: str) -> str:
+    # OpenMetrics : le suffixe _total appartient à l'échantillon, pas à la famille
+    return name[:-len("_total")] if name.endswith("_total") else name
+
+
+def render_openmetrics() -> str:
+    """Rend les métriques au format texte OpenMetrics (une ligne # TYPE par famille)"""
+    lines = []
+
+    def declare(family: str, kind: str, declared: set[str]) -> None:
+        if family not in declared:
+            declared.add(family)
+            lines.append(f"# TYPE {family} {kind}")
+
+    declared: set[str] = set()
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            family = _counter_family(name)
+            declare(family, "counter", declared)
+            lines.append(f"{_format_key((family + '_total', labels))} {value}")
+        for key, value in sorted(_gauges.items()):
+            declare(key[0], "gauge", declared)
+            lines.append(f"{_format_key(key)} {value}")
+        for (name, labels), histogram in sorted(_histograms.items()):
+            declare(name, "histogram", declared)
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{_format_key((name + '_bucket', labels + (('le', str(bound)),)))} {cumulative}")
+            lines.append(f"{_format_key((name + '_bucket', labels + (('le', '+Inf'),)))} {histogram['count']}")
+            lines.append(f"{_format_key((name + '_count', labels))} {histogram['count']}")
+            lines.append(f"{_format_key((name + '_sum', labels))} {histogram['sum']}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def flush() -> None:
+    """Publie le snapshot courant vers le sink configuré"""
+    global _last_flush
+    _last_flush = time.monotonic()
+    if METRICS_SINK == "none":
+        return
+    data = snapshot()
+    if not data["counters"] and not data["gauges"] and not data["histograms"]:
+        return
+    try:
+        if METRICS_SINK == "log":
+            logger.info("Métriques de l'instance %s", INSTANCE_ID, extra={"fields": {"metrics": data}})
+            return
+        from firebase_admin import firestore
+
+        # Un document par fonction et par heure : le nombre de documents ne dépend pas des démarrages à froid
+        hour = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        document_id = f"{SERVICE_NAME}_{hour:%Y%m%d%H}"
+        firestore.client().collection(METRICS_COLLECTION).document(document_id).set({
+            "service": SERVICE_NAME,
+            "hour": hour,
+            "expiresAt": hour + timedelta(days=METRICS_RETENTION_DAYS),
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+            "instances": {INSTANCE_ID: data},
+        }, merge=True)
+    except Exception:
+        logger.exception("Erreur lors de la publication des métriques")
+
+
+def flush_if_due() -> None:
+    """Publie les métriques si l'intervalle METRICS_FLUSH_INTERVAL est écoulé"""
+    global _last_flush
+    if METRICS_FLUSH_INTERVAL <= 0:
+        return
+    # Une seule invocation publie quand plusieurs se terminent en même temps
+    with _lock:
+        if time.monotonic() - _last_flush < METRICS_FLUSH_INTERVAL:
+            return
+        _last_flush = time.monotonic()
+    flush()
+
+
+def _start_local_endpoint(port: int) -> None:
+    """Expose /metrics en local (émulateur, benchmarks)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            body = render_openmetrics().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info("Endpoint OpenMetrics local sur le port %s", port)
+
+
+if METRICS_PORT:
+    _start_local_endpoint(int(METRICS_PORT))
@@ -16,6 +16,7 @@ Note: This is a basic structure. You'll need to:
 
 import os
 import json
+import threading
 from typing import Any
 
 import firebase_admin
@@ -23,18 +24,37 @@ from firebase_admin import firestore
 from firebase_functions import https_fn
 import resend
 
+from instrumentation import instrumented
+from structured_logging import get_logger
+
 # Initialize Firebase Admin (if not already initialized)
 try:
     firebase_admin.get_app()
 except ValueError:
     firebase_admin.initialize_app()
 
-db = firestore.client()
+_db = None
+_db_lock = threading.Lock()
+
+logger = get_logger("paypal_webhook")
 
 # PayPal Webhook Secret (get from PayPal Developer Dashboard)
 PAYPAL_WEBHOOK_SECRET = os.environ.get("PAYPAL_WEBHOOK_SECRET", "")
 
 
+def get_db() -> Any:
+    """
+    Firestore client, created on first use and shared by concurrent requests
+    (the client is thread-safe; only its creation needs the lock)
+    """
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                _db = firestore.client()
+    return _db
+
+
 def verify_paypal_webhook(headers: dict, body: str, webhook_id: str) -> bool:
     """
     Verify PayPal webhook signature
@@ -51,6 +71,7 @@ def verify_paypal_webhook(headers: dict, body: str, webhook_id: str) -> bool:
     # But we enable it for flexibility. For webhooks, PayPal doesn't check CORS headers.
     region="europe-west9"
 )
+@instrumented
 def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
     """
     Handle PayPal webhook events
@@ -80,7 +101,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
         #         mimetype="application/json"
         #     )
         
-        print(f"Received PayPal webhook event: {event_type}")
+        logger.info("Received PayPal webhook event: %s", event_type)
         
         # Handle different event types
         if event_type == "PAYMENT.CAPTURE.COMPLETED":
@@ -101,13 +122,13 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             if custom_id:
                 # Update voucher status in Firestore
                 collection_name = "giftVouchers"  # Explicitly set collection name
-                print(f"DEBUG: Attempting to update voucher {custom_id} in collection '{collection_name}'")
-                voucher_ref = db.collection(collection_name).document(custom_id)
+                logger.debug("Attempting to update voucher %s in collection '%s'", custom_id, collection_name)
+                voucher_ref = get_db().collection(collection_name).document(custom_id)
                 
                 # Check if document exists first
                 doc = voucher_ref.get()
                 if not doc.exists:
-                    print(f"ERROR: Voucher document {custom_id} does not exist in collection '{collection_name}'")
+                    logger.error("Voucher document %s does not exist in collection '%s'", custom_id, collection_name)
                     return https_fn.Response(
                         json.dumps({"error": f"Voucher {custom_id} not found in collection '{collection_name}'"}),
                         status=404,
@@ -120,12 +141,12 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
                         "paidAt": firestore.SERVER_TIMESTAMP,
                         "paypalOrderId": order_id,
                     })
-                    print(f"Updated voucher {custom_id} to paid status in collection '{collection_name}'")
+                    logger.info("Updated voucher %s to paid status in collection '%s'", custom_id, collection_name)
                 except Exception as update_error:
-                    print(f"ERROR updating voucher {custom_id}: {str(update_error)}")
+                    logger.error("Error updating voucher %s: %s", custom_id, update_error)
                     raise update_error
             else:
-                print(f"Warning: No custom_id found in webhook for order {order_id}")
+                logger.warning("No custom_id found in webhook for order %s", order_id)
             
             return https_fn.Response(
                 json.dumps({"status": "success"}),
@@ -147,7 +168,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             
             if custom_id:
                 # Optionally update voucher status or send notification
-                print(f"Payment denied for voucher {custom_id}")
+                logger.info("Payment denied for voucher %s", custom_id)
             
             return https_fn.Response(
                 json.dumps({"status": "received"}),
@@ -170,13 +191,13 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             if custom_id:
                 # Update voucher status
                 collection_name = "giftVouchers"  # Explicitly set collection name
-                print(f"DEBUG: Attempting to update voucher {custom_id} in collection '{collection_name}'")
-                voucher_ref = db.collection(collection_name).document(custom_id)
+                logger.debug("Attempting to update voucher %s in collection '%s'", custom_id, collection_name)
+                voucher_ref = get_db().collection(collection_name).document(custom_id)
                 
                 # Check if document exists first
                 doc = voucher_ref.get()
                 if not doc.exists:
-                    print(f"ERROR: Voucher document {custom_id} does not exist in collection '{collection_name}'")
+                    logger.error("Voucher document %s does not exist in collection '%s'", custom_id, collection_name)
                     return https_fn.Response(
                         json.dumps({"error": f"Voucher {custom_id} not found in collection '{collection_name}'"}),
                         status=404,
@@ -187,9 +208,9 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
                     voucher_ref.update({
                         "status": "refunded",
                     })
-                    print(f"Updated voucher {custom_id} to refunded status in collection '{collection_name}'")
+                    logger.info("Updated voucher %s to refunded status in collection '%s'", custom_id, collection_name)
                 except Exception as update_error:
-                    print(f"ERROR updating voucher {custom_id}: {str(update_error)}")
+                    logger.error("Error updating voucher %s: %s", custom_id, update_error)
                     raise update_error
             
             return https_fn.Response(
@@ -200,7 +221,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
         
         else:
             # Unknown event type - log but don't fail
-            print(f"Unhandled event type: {event_type}")
+            logger.info("Unhandled event type: %s", event_type)
             return https_fn.Response(
                 json.dumps({"status": "received"}),
                 status=200,
@@ -208,9 +229,7 @@ def paypal_webhook(req: https_fn.Request) -> https_fn.Response:
             )
     
     except Exception as e:
-        print(f"Error processing PayPal webhook: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing PayPal webhook")
         
         return https_fn.Response(
             json.dumps({"error": str(e)}),
@@ -0,0 +1,268 @@
+"""
+Profilage CPU (cProfile) et mémoire (tracemalloc) à la demande des Cloud Functions
+
+Activé par variables d'environnement, sans redéploiement du code :
+- PROFILE_SAMPLE_RATE : fraction des invocations profilées (0 = désactivé, 1 = toutes)
+- PROFILE_FUNCTIONS : liste optionnelle de fonctions à profiler (séparées par des virgules)
+- PROFILE_DIR : répertoire local des profils (/tmp/profiles par défaut)
+- PROFILE_BUCKET : bucket Storage où copier les profils (profiles/<fonction>/<fichier>.prof)
+
+Mesure mémoire par invocation (pic et mémoire retenue, via tracemalloc) :
+- MEMORY_PROFILE=1 : active la mesure (métriques "invocation_peak_memory_bytes"
+  et "invocation_retained_memory_bytes")
+- MEMORY_PROFILE_FILE : fichier JSONL optionnel où ajouter chaque mesure
+
+tracemalloc est global au processus : avec une concurrence > 1 par instance,
+les mesures de deux invocations simultanées se mélangent. Utiliser ce mode avec
+une concurrence de 1 ou dans benchmark.py.
+
+Le profilage est branché dans le décorateur `instrumented` (instrumentation.py).
+
+Rapport des points chauds à partir des profils stockés :
+
+    python profiling.py report /tmp/profiles --top 30
+    python profiling.py report gs://<bucket>/profiles --function send_voucher_emails
+
+Recommandation de mémoire par fonction à partir des mesures :
+
+    python profiling.py memory-report /tmp/memory.jsonl
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Iterator
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("profiling")
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_FUNCTIONS = {name.strip() for name in os.environ.get("PROFILE_FUNCTIONS", "").split(",") if name.strip()}
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "profiles"))
+PROFILE_BUCKET = os.environ.get("PROFILE_BUCKET", "")
+PROFILE_STORAGE_PREFIX = "profiles"
+
+MEMORY_PROFILE = os.environ.get("MEMORY_PROFILE", "") not in ("", "0", "false")
+MEMORY_PROFILE_FILE = os.environ.get("MEMORY_PROFILE_FILE", "")
+
+# Paliers de mémoire proposés par Cloud Functions 2nd gen (MiB)
+MEMORY_TIERS_MIB = (128, 256, 512, 1024, 2048, 4096, 8192)
+# Mémoire de base d'une instance Python (runtime, firebase_admin, resend...) avant toute invocation
+DEFAULT_BASELINE_MIB = 90
+# Marge appliquée au pic observé avant de choisir un palier
+MEMORY_HEADROOM = 1.5
+MEMORY_BUCKETS = tuple(float(2 ** n) for n in range(16, 31, 2))  # 64 KiB .. 1 GiB
+
+_memory_file_lock = threading.Lock()
+_profile_lock = threading.Lock()
+
+
+def should_profile(function_name: str) -> bool:
+    """Tire au sort si l'invocation courante doit être profilée"""
+    if PROFILE_SAMPLE_RATE <= 0:
+        return False
+    if PROFILE_FUNCTIONS and function_name not in PROFILE_FUNCTIONS:
+        return False
+    return random.random() < PROFILE_SAMPLE_RATE
+
+
+def _profile_filename(function_name: str, event_id: str) -> str:
+    safe_event_id = re.sub(r"[^A-Za-z0-9_.-]", "_", event_id or "no-event")
+    return f"{function_name}__{int(time.time() * 1000)}__{safe_event_id}.prof"
+
+
+def _store_profile(profiler: cProfile.Profile, function_name: str, event_id: str) -> None:
+    """Écrit le profil en local et le copie dans Storage si PROFILE_BUCKET est défini"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    filename = _profile_filename(function_name, event_id)
+    path = os.path.join(PROFILE_DIR, filename)
+    profiler.dump_stats(path)
+    if PROFILE_BUCKET:
+        from firebase_admin import storage
+
+        blob = storage.bucket(PROFILE_BUCKET).blob(f"{PROFILE_STORAGE_PREFIX}/{function_name}/{filename}")
+        blob.upload_from_filename(path, content_type="application/octet-stream")
+        os.remove(path)
+        logger.info("Profil CPU enregistré dans gs://%s/%s", PROFILE_BUCKET, blob.name)
+    else:
+        logger.info("Profil CPU enregistré dans %s", path)
+
+
+@contextmanager
+def maybe_profile(function_name: str, event_id: str = "") -> Iterator[None]:
+    """Profile le bloc avec cProfile pour une fraction PROFILE_SAMPLE_RATE des invocations"""
+    # Un seul profil à la fois par instance : cProfile refuse deux profileurs actifs
+    if not should_profile(function_name) or not _profile_lock.acquire(blocking=False):
+        yield
+        return
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            try:
+                _store_profile(profiler, function_name, event_id)
+            except Exception:
+                logger.exception("Erreur lors de l'enregistrement du profil CPU")
+    finally:
+        _profile_lock.release()
+
+
+def _record_memory_sample(function_name: str, event_id: str, peak: int, retained: int) -> None:
+    """Publie une mesure mémoire dans les métriques, les logs et MEMORY_PROFILE_FILE"""
+    metrics.observe("invocation_peak_memory_bytes", peak, buckets=MEMORY_BUCKETS, function=function_name)
+    metrics.observe("invocation_retained_memory_bytes", max(retained, 0), buckets=MEMORY_BUCKETS, function=function_name)
+    logger.debug("Mémoire: pic %s octets, retenue %s octets", peak, retained)
+    if MEMORY_PROFILE_FILE:
+        line = json.dumps({"function": function_name, "event_id": event_id, "peak": peak, "retained": retained})
+        with _memory_file_lock, open(MEMORY_PROFILE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+@contextmanager
+def maybe_trace_memory(function_name: str, event_id: str = "") -> Iterator[None]:
+    """Mesure le pic et la mémoire retenue par le bloc quand MEMORY_PROFILE est activé"""
+    if not MEMORY_PROFILE:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    try:
+        yield
+    finally:
+        current, peak = tracemalloc.get_traced_memory()
+        try:
+            _record_memory_sample(function_name, event_id, peak - baseline, current - baseline)
+        except Exception:
+            logger.exception("Erreur lors de l'enregistrement de la mesure mémoire")
+
+
+def _percentile(values: list[int], fraction: float) -> int:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def recommend_memory_tier(peak_bytes: int, baseline_mib: float = DEFAULT_BASELINE_MIB) -> int:
+    """Retourne le plus petit palier (MiB) couvrant la base de l'instance plus le pic avec marge"""
+    needed_mib = baseline_mib + peak_bytes * MEMORY_HEADROOM / (1024 * 1024)
+    for tier in MEMORY_TIERS_MIB:
+        if tier >= needed_mib:
+            return tier
+    return MEMORY_TIERS_MIB[-1]
+
+
+def memory_report(samples_path: str, baseline_mib: float = DEFAULT_BASELINE_MIB) -> list[dict]:
+    """
+    Agrège les mesures d'un fichier JSONL (MEMORY_PROFILE_FILE) par fonction
+    et affiche le palier de mémoire recommandé (basé sur le pic maximum observé)
+    """
+    samples: dict[str, list[dict]] = {}
+    with open(samples_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                sample = json.loads(line)
+                samples.setdefault(sample["function"], []).append(sample)
+
+    rows = []
+    for name, function_samples in sorted(samples.items()):
+        peaks = [s["peak"] for s in function_samples]
+        retained = [s["retained"] for s in function_samples]
+        rows.append({
+            "function": name,
+            "invocations": len(function_samples),
+            "peak_p95": _percentile(peaks, 0.95),
+            "peak_max": max(peaks),
+            "retained_max": max(retained),
+            # Le maximum est utilisé : une invocation OOM coûte plus qu'un palier surdimensionné
+            "recommended_mib": recommend_memory_tier(max(peaks), baseline_mib),
+        })
+
+    print(f"{'Fonction':<36} {'Invocations':>11} {'Pic p95':>10} {'Pic max':>10} {'Retenue':>10} {'Palier':>8}")
+    for row in rows:
+        print(
+            f"{row['function']:<36} {row['invocations']:>11} "
+            f"{row['peak_p95'] / 1024:>8.0f}Ki {row['peak_max'] / 1024:>8.0f}Ki "
+            f"{row['retained_max'] / 1024:>8.0f}Ki {row['recommended_mib']:>5}MiB"
+        )
+    return rows
+
+
+def _download_profiles(gs_path: str, destination: str) -> None:
+    """Télécharge les profils d'un chemin gs://bucket/prefix dans `destination`"""
+    from google.cloud import storage as gcs
+
+    bucket_name, _, prefix = gs_path[len("gs://"):].partition("/")
+    client = gcs.Client()
+    for blob in client.list_blobs(bucket_name, prefix=prefix):
+        if blob.name.endswith(".prof"):
+            blob.download_to_filename(os.path.join(destination, os.path.basename(blob.name)))
+
+
+def _collect_profiles(directory: str, function_name: str | None) -> dict[str, list[str]]:
+    """Regroupe les fichiers .prof par nom de fonction"""
+    grouped: dict[str, list[str]] = {}
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".prof"):
+            continue
+        name = filename.split("__", 1)[0]
+        if function_name and name != function_name:
+            continue
+        grouped.setdefault(name, []).append(os.path.join(directory, filename))
+    return grouped
+
+
+def report(source: str, function_name: str | None = None, top: int = 25, sort: str = "cumulative") -> None:
+    """Agrège les profils stockés et affiche les points chauds par fonction"""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = source
+        if source.startswith("gs://"):
+            _download_profiles(source, tmp)
+            directory = tmp
+        grouped = _collect_profiles(directory, function_name)
+        if not grouped:
+            print(f"Aucun profil trouvé dans {source}")
+            return
+        for name, files in grouped.items():
+            print(f"\n=== {name} ({len(files)} profil(s)) ===")
+            stats = pstats.Stats(*files, stream=sys.stdout)
+            stats.strip_dirs().sort_stats(sort).print_stats(top)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Outils de profilage des Cloud Functions Harmonya")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report_parser = subparsers.add_parser("report", help="Rapport des points chauds à partir des profils stockés")
+    report_parser.add_argument("source", nargs="?", default=PROFILE_DIR, help="Répertoire local ou gs://bucket/prefix")
+    report_parser.add_argument("--function", dest="function_name", help="Limiter à une fonction")
+    report_parser.add_argument("--top", type=int, default=25, help="Nombre de lignes par fonction")
+    report_parser.add_argument("--sort", default="cumulative", help="Clé de tri pstats (cumulative, tottime, ncalls...)")
+    memory_parser = subparsers.add_parser("memory-report", help="Palier de mémoire recommandé par fonction")
+    memory_parser.add_argument("samples", help="Fichier JSONL écrit via MEMORY_PROFILE_FILE")
+    memory_parser.add_argument("--baseline-mib", type=float, default=DEFAULT_BASELINE_MIB, help="Mémoire de base d'une instance")
+    args = parser.parse_args(argv)
+
+    if args.command == "report":
+        report(args.source, args.function_name, args.top, args.sort)
+    elif args.command == "memory-report":
+        memory_report(args.samples, args.baseline_mib)
+
+
+if __name__ == "__main__":
+    main()
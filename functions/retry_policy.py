@@ -0,0 +1,154 @@
+"""
+Politique de retry commune pour les appels à Resend
+
+- Les erreurs sont classées d'après le code HTTP (et le type d'erreur Resend),
+  plus aucune détection par sous-chaîne du message
+- Retry-After (ou ratelimit-reset) est respecté quand Resend le fournit
+- Le backoff exponentiel est aléatoire (jitter) pour éviter que les invocations
+  concurrentes ne réessaient toutes au même instant
+- Chaque invocation dispose d'un budget de temps global (INVOCATION_BUDGET_SECONDS,
+  45 s par défaut, ouvert par le décorateur `instrumented`) : aucune attente ne
+  dépasse le temps restant
+"""
+
+import contextlib
+import contextvars
+import os
+import random
+import socket
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Iterator, TypeVar
+
+import requests
+
+T = TypeVar("T")
+
+INVOCATION_BUDGET_SECONDS = float(os.environ.get("INVOCATION_BUDGET_SECONDS", "45"))
+
+# Classes d'erreurs
+RATE_LIMITED = "rate_limited"  # 429 : réessayer après Retry-After
+QUOTA_EXCEEDED = "quota_exceeded"  # 429 quota journalier/mensuel : inutile de réessayer maintenant
+TRANSIENT = "transient"  # 5xx, 408, erreurs réseau : réessayer avec backoff
+PERMANENT = "permanent"  # autres 4xx : ne jamais réessayer
+
+RETRYABLE = (RATE_LIMITED, TRANSIENT)
+
+# Erreurs réseau sans code HTTP (le SDK Resend les convertit d'ordinaire en ResendError 500)
+NETWORK_ERRORS = (requests.ConnectionError, requests.Timeout, socket.timeout, ConnectionError, TimeoutError)
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("invocation_deadline", default=None)
+
+
+@contextlib.contextmanager
+def invocation_budget(seconds: float = INVOCATION_BUDGET_SECONDS) -> Iterator[None]:
+    """Ouvre le budget de temps de l'invocation courante"""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> float:
+    """Secondes restantes dans le budget de l'invocation (infini hors invocation)"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return float("inf")
+    return max(0.0, deadline - time.monotonic())
+
+
+def status_code(error: Exception) -> int | None:
+    """Code HTTP associé à l'erreur, ou None (erreur réseau, timeout...)"""
+    try:
+        return int(getattr(error, "code", None))
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(error: Exception) -> str:
+    """Classe une erreur d'envoi (RATE_LIMITED, QUOTA_EXCEEDED, TRANSIENT ou PERMANENT)"""
+    if getattr(error, "retryable", None) is False:
+        return PERMANENT
+    code = status_code(error)
+    if code is None:
+        # Sans code HTTP, seules les erreurs réseau sont temporaires : une erreur de
+        # programmation (TypeError, KeyError, ValueError...) ne doit être ni réessayée
+        # ni comptée comme une panne de Resend
+        return TRANSIENT if isinstance(error, NETWORK_ERRORS) else PERMANENT
+    if code >= 500 or code == 408:
+        return TRANSIENT
+    if code == 429:
+        if getattr(error, "error_type", "") in ("daily_quota_exceeded", "monthly_quota_exceeded"):
+            return QUOTA_EXCEEDED
+        return RATE_LIMITED
+    return PERMANENT
+
+
+def retry_after_seconds(error: Exception) -> float | None:
+    """Délai demandé par le serveur (Retry-After en secondes ou date HTTP, ou ratelimit-reset)"""
+    headers = {k.lower(): v for k, v in (getattr(error, "headers", None) or {}).items()}
+    value = headers.get("retry-after") or headers.get("ratelimit-reset")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    Paramètres de retry : nombre de tentatives, backoff de base et plafond
+
+    Le délai avant la tentative n+1 est :
+    - Retry-After + jitter (0 à 20 %) si le serveur l'indique
+    - sinon un tirage uniforme entre base et base * 2^n, plafonné à max_delay
+    """
+
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, 0.2 * max(retry_after, self.base_delay))
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return random.uniform(min(self.base_delay, ceiling), ceiling)
+
+    def call(self, func: Callable[[], T], on_retry: Callable[[int, Exception, float], None] | None = None) -> T:
+        """
+        Appelle `func` en réessayant les erreurs RATE_LIMITED et TRANSIENT
+        Relance la dernière erreur si elle n'est pas réessayable, si les tentatives
+        sont épuisées ou si l'attente dépasserait le budget de l'invocation
+        """
+        attempt = 0
+        while True:
+            try:
+                return func()
+            except Exception as e:
+                attempt += 1
+                if classify_error(e) not in RETRYABLE or attempt >= self.max_attempts:
+                    raise
+                wait = self.delay(attempt - 1, e)
+                if wait >= remaining_budget():
+                    raise
+                if on_retry is not None:
+                    on_retry(attempt, e, wait)
+                time.sleep(wait)
+
+
+DEFAULT_POLICY = RetryPolicy(
+    max_attempts=int(os.environ.get("EMAIL_MAX_ATTEMPTS", "4")),
+    base_delay=float(os.environ.get("EMAIL_RETRY_BASE_SECONDS", "0.5")),
+)
@@ -0,0 +1,115 @@
+"""
+Agrégat des notes des commentaires approuvés
+
+Le document reviewStats/summary contient :
+- count : nombre de commentaires approuvés
+- sum : somme de leurs notes (moyenne = sum / count)
+- histogram : nombre de commentaires par note ({"1": ..., "5": ...})
+
+La page d'accueil affiche la note moyenne en une seule lecture, quel que soit
+le nombre de commentaires. L'agrégat est tenu à jour par les triggers de
+"reviews" (main.py) à la création, à l'approbation, au changement de note et
+à la suppression d'un commentaire.
+
+Chaque commentaire compté a un marqueur reviewStats/summary/countedReviews/{reviewId}
+contenant la note prise en compte. `record_review` compare, dans une transaction,
+ce marqueur à l'état attendu (note si approuvé, rien sinon) et n'applique que
+la différence : un événement reçu deux fois ne compte pas deux fois le commentaire.
+L'agrégat est modifié par Increment, sans être lu : la transaction ne verrouille
+que le marqueur du commentaire.
+
+Recalcul complet (commentaires approuvés avant la mise en place de l'agrégat) :
+
+    python review_stats.py rebuild
+"""
+
+import sys
+from typing import Any
+
+from firebase_admin import firestore
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("review_stats")
+
+REVIEW_STATS_COLLECTION = "reviewStats"
+REVIEW_STATS_DOCUMENT = "summary"
+COUNTED_REVIEWS_COLLECTION = "countedReviews"
+RATINGS = (1, 2, 3, 4, 5)
+
+
+def counted_rating(review: dict | None) -> int | None:
+    """Note à compter pour un commentaire : sa note s'il est approuvé, sinon None"""
+    if not review or review.get("approved") is not True:
+        return None
+    try:
+        rating = int(review.get("rating", 5))
+    except (TypeError, ValueError):
+        return None
+    return rating if rating in RATINGS else None
+
+
+def _delta(previous: int | None, rating: int | None) -> dict:
+    """Écriture unique de l'agrégat : retire l'ancienne note et ajoute la nouvelle"""
+    count = sum_delta = 0
+    histogram: dict[str, int] = {}
+    if previous is not None:
+        count, sum_delta = count - 1, sum_delta - previous
+        histogram[str(previous)] = histogram.get(str(previous), 0) - 1
+    if rating is not None:
+        count, sum_delta = count + 1, sum_delta + rating
+        histogram[str(rating)] = histogram.get(str(rating), 0) + 1
+    return {
+        "count": firestore.Increment(count),
+        "sum": firestore.Increment(sum_delta),
+        "histogram": {key: firestore.Increment(value) for key, value in histogram.items()},
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }
+
+
+@firestore.transactional
+def _apply(transaction: Any, stats_ref: Any, counted_ref: Any, rating: int | None) -> bool:
+    counted = counted_ref.get(transaction=transaction)
+    previous = (counted.to_dict() or {}).get("rating") if counted.exists else None
+    if previous == rating:
+        return False
+    transaction.set(stats_ref, _delta(previous, rating), merge=True)
+    if rating is not None:
+        transaction.set(counted_ref, {"rating": rating, "countedAt": firestore.SERVER_TIMESTAMP})
+    else:
+        transaction.delete(counted_ref)
+    return True
+
+
+def record_review(db: Any, review_id: str, review: dict | None) -> bool:
+    """
+    Met l'agrégat en accord avec l'état du commentaire (None s'il a été supprimé)
+    Retourne True si l'agrégat a été modifié
+    """
+    stats_ref = db.collection(REVIEW_STATS_COLLECTION).document(REVIEW_STATS_DOCUMENT)
+    counted_ref = stats_ref.collection(COUNTED_REVIEWS_COLLECTION).document(review_id)
+    changed = _apply(db.transaction(), stats_ref, counted_ref, counted_rating(review))
+    metrics.count_reads()
+    if changed:
+        metrics.inc("review_stats_updates_total")
+        logger.info("Agrégat des notes mis à jour pour le commentaire %s", review_id)
+    return changed
+
+
+def rebuild(db: Any) -> int:
+    """Compte tous les commentaires approuvés (idempotent), retourne le nombre de modifications"""
+    changed = 0
+    for doc in db.collection("reviews").where("approved", "==", True).stream():
+        metrics.count_reads()
+        changed += record_review(db, doc.id, doc.to_dict())
+    return changed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("Usage : python review_stats.py rebuild")
+    import firebase_admin
+
+    firebase_admin.initialize_app()
+    print(f"{rebuild(firestore.client())} commentaire(s) ajouté(s) à l'agrégat")
@@ -0,0 +1,150 @@
+"""
+Budget d'envoi Resend (quotas journalier et mensuel)
+
+En plus du débit (2 requêtes/s, géré par retry_policy.py et send_batch), les
+offres Resend limitent le nombre d'emails par jour et par mois. Chaque email
+envoyé est compté dans emailBudget/{AAAA-MM} (UTC, comme les quotas Resend) :
+- total : emails envoyés dans le mois
+- days : emails envoyés par jour du mois ({"19": ...})
+
+Le compteur est partagé par toutes les instances (Increment, sans lecture).
+Chaque instance relit le document au plus toutes les SEND_BUDGET_REFRESH_SECONDS
+secondes et ajoute ses propres envois depuis la dernière lecture.
+
+Les emails sont classés par priorité (type d'email de send_email) :
+- LOW : notifications administrateur (nouvelle réservation, commentaire,
+  message de contact, bon cadeau)
+- NORMAL : envois groupés et récapitulatifs (rappels, expiration des bons,
+  récapitulatif admin)
+- CRITICAL : tous les autres, c'est-à-dire les emails destinés aux clients
+  (confirmations, annulations, bons cadeaux, réponses)
+
+Quand le reste du budget du jour ou du mois descend sous SEND_BUDGET_LOW_RESERVE
+(fraction du quota), les notifications LOW passent par le récapitulatif admin
+(admin_digest.py) ou sont différées ; sous SEND_BUDGET_NORMAL_RESERVE, les
+emails NORMAL sont différés. Les emails CRITICAL sont toujours tentés : la
+réserve leur est destinée. Les emails différés pour budget ne sont renvoyés
+par retry_deferred_emails que lorsque le budget le permet à nouveau.
+
+Configuration :
+- RESEND_DAILY_QUOTA : emails par jour, 0 = illimité (0 ; 100 pour l'offre gratuite)
+- RESEND_MONTHLY_QUOTA : emails par mois, 0 = illimité (0 ; 3000 pour l'offre gratuite)
+- SEND_BUDGET_LOW_RESERVE : réserve sous laquelle LOW est retenu (0.2)
+- SEND_BUDGET_NORMAL_RESERVE : réserve sous laquelle NORMAL est retenu (0.05)
+- SEND_BUDGET_REFRESH_SECONDS : durée du cache du compteur par instance (60)
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("send_budget")
+
+SEND_BUDGET_COLLECTION = "emailBudget"
+RESEND_DAILY_QUOTA = int(os.environ.get("RESEND_DAILY_QUOTA", "0"))
+RESEND_MONTHLY_QUOTA = int(os.environ.get("RESEND_MONTHLY_QUOTA", "0"))
+SEND_BUDGET_LOW_RESERVE = float(os.environ.get("SEND_BUDGET_LOW_RESERVE", "0.2"))
+SEND_BUDGET_NORMAL_RESERVE = float(os.environ.get("SEND_BUDGET_NORMAL_RESERVE", "0.05"))
+SEND_BUDGET_REFRESH_SECONDS = float(os.environ.get("SEND_BUDGET_REFRESH_SECONDS", "60"))
+
+CRITICAL = "critical"
+NORMAL = "normal"
+LOW = "low"
+
+PRIORITIES = {
+    "booking_admin": LOW,
+    "review_admin": LOW,
+    "contact_admin": LOW,
+    "voucher_admin": LOW,
+    "booking_reminder": NORMAL,
+    "voucher_expiring": NORMAL,
+    "admin_digest": NORMAL,
+}
+
+_RESERVES = {LOW: SEND_BUDGET_LOW_RESERVE, NORMAL: SEND_BUDGET_NORMAL_RESERVE, CRITICAL: 0.0}
+
+# Compteurs connus de l'instance : mois et jour courants, valeurs lues, envois locaux depuis la lecture
+_lock = threading.Lock()
+_usage = {"month": "", "day": "", "month_sent": 0, "day_sent": 0, "loaded_at": float("-inf")}
+
+
+def priority(email_type: str) -> str:
+    return PRIORITIES.get(email_type, CRITICAL)
+
+
+def _period(now: datetime | None = None) -> tuple[str, str]:
+    now = now or datetime.now(timezone.utc)
+    return now.strftime("%Y-%m"), str(now.day)
+
+
+def _refresh(month: str, day: str) -> None:
+    """Relit le compteur partagé si le cache a expiré ou si la période a changé (verrou tenu)"""
+    if _usage["month"] == month and _usage["day"] == day \
+            and time.monotonic() - _usage["loaded_at"] < SEND_BUDGET_REFRESH_SECONDS:
+        return
+    try:
+        doc = firestore.client().collection(SEND_BUDGET_COLLECTION).document(month).get()
+        metrics.count_reads()
+    except Exception as e:
+        # Compteur illisible : on garde les dernières valeurs plutôt que de bloquer les envois
+        logger.warning("Lecture du budget d'envoi impossible: %s", e)
+        return
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    _usage.update(
+        month=month, day=day,
+        month_sent=int(data.get("total", 0)),
+        day_sent=int((data.get("days") or {}).get(day, 0)),
+        loaded_at=time.monotonic(),
+    )
+    metrics.set_gauge("email_budget_remaining", remaining(RESEND_DAILY_QUOTA, _usage["day_sent"]), period="day")
+    metrics.set_gauge("email_budget_remaining", remaining(RESEND_MONTHLY_QUOTA, _usage["month_sent"]), period="month")
+
+
+def remaining(quota: int, sent: int) -> float:
+    """Part restante du quota (1.0 si illimité)"""
+    if quota <= 0:
+        return 1.0
+    return max(0.0, (quota - sent) / quota)
+
+
+def usage() -> dict[str, int | str]:
+    """Emails envoyés dans le jour et le mois courants (vus par cette instance)"""
+    month, day = _period()
+    with _lock:
+        _refresh(month, day)
+        return {"month": month, "day": day, "month_sent": _usage["month_sent"], "day_sent": _usage["day_sent"]}
+
+
+def allows(email_type: str, count: int = 1) -> bool:
+    """Indique si `count` emails de ce type peuvent partir sans entamer la réserve des emails prioritaires"""
+    level = priority(email_type)
+    if level == CRITICAL:
+        return True
+    reserve = _RESERVES[level]
+    current = usage()
+    return (remaining(RESEND_DAILY_QUOTA, current["day_sent"] + count) >= reserve
+            and remaining(RESEND_MONTHLY_QUOTA, current["month_sent"] + count) >= reserve)
+
+
+def record(count: int = 1) -> None:
+    """Compte `count` emails envoyés (une écriture, sans lecture)"""
+    month, day = _period()
+    with _lock:
+        if _usage["month"] == month:
+            _usage["month_sent"] += count
+            if _usage["day"] == day:
+                _usage["day_sent"] += count
+    try:
+        firestore.client().collection(SEND_BUDGET_COLLECTION).document(month).set({
+            "total": firestore.Increment(count),
+            "days": {day: firestore.Increment(count)},
+            "updatedAt": firestore.SERVER_TIMESTAMP,
+        }, merge=True)
+    except Exception as e:
+        logger.warning("Mise à jour du budget d'envoi impossible: %s", e)
@@ -0,0 +1,167 @@
+"""
+Regroupement des renommages de prestations avant mise à jour des clients
+
+Chaque client garde le nom des prestations qu'il a réservées
+(massageTypesNames, treatmentTypesNames). Quand l'admin renomme ou réordonne
+plusieurs prestations, chaque modification déclenchait un parcours complet
+des clients concernés, et plusieurs renommages successifs d'une même
+prestation se réécrasaient.
+
+Les triggers de "massages" et "treatments" (main.py) ne font plus qu'ajouter
+la prestation renommée au document serviceRenames/pending (une écriture, sans
+lecture) :
+
+    {"changes": {"massages": {"cocooning": <date>}, "treatments": {...}}, "lastChangeAt": <date>}
+
+La fonction planifiée flush_service_renames (main.py) applique les changements
+quand aucun renommage n'est arrivé depuis RENAME_DEBOUNCE_SECONDS secondes, ou
+quand une prestation en attente a été renommée il y a plus de
+RENAME_MAX_DELAY_SECONDS secondes (renommages en continu) :
+- le document est vidé dans une transaction (les renommages arrivés ensuite
+  restent pour le passage suivant)
+- les noms sont relus dans les documents des prestations : seul le dernier nom
+  compte, quel que soit l'ordre d'arrivée des événements
+- les clients concernés par toutes les prestations renommées sont lus en une
+  passe (array_contains_any) et chaque client est écrit une seule fois
+
+Si l'application échoue, les changements sont remis dans le document.
+
+Configuration :
+- RENAME_FLUSH_SCHEDULE : fréquence de la fonction planifiée ("every 1 minutes")
+- RENAME_DEBOUNCE_SECONDS : délai sans renommage avant application (60)
+- RENAME_MAX_DELAY_SECONDS : attente maximale malgré des renommages continus (600)
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from firebase_admin import firestore
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("service_renames")
+
+SERVICE_RENAMES_COLLECTION = "serviceRenames"
+SERVICE_RENAMES_DOCUMENT = "pending"
+RENAME_FLUSH_SCHEDULE = os.environ.get("RENAME_FLUSH_SCHEDULE", "every 1 minutes")
+RENAME_DEBOUNCE_SECONDS = float(os.environ.get("RENAME_DEBOUNCE_SECONDS", "60"))
+RENAME_MAX_DELAY_SECONDS = float(os.environ.get("RENAME_MAX_DELAY_SECONDS", "600"))
+
+# Collection de la prestation -> (champ des IDs, champ des noms) dans les documents clients
+SERVICE_FIELDS = {
+    "massages": ("massageTypes", "massageTypesNames"),
+    "treatments": ("treatmentTypes", "treatmentTypesNames"),
+}
+
+# Limite Firestore du nombre de valeurs d'un filtre array_contains_any
+_ARRAY_CONTAINS_ANY_MAX = 30
+
+
+def _pending_ref(db: Any) -> Any:
+    return db.collection(SERVICE_RENAMES_COLLECTION).document(SERVICE_RENAMES_DOCUMENT)
+
+
+def queue_service_rename(db: Any, collection: str, service_id: str) -> None:
+    """Ajoute une prestation renommée au prochain passage de apply_service_renames"""
+    _pending_ref(db).set({
+        "changes": {collection: {service_id: firestore.SERVER_TIMESTAMP}},
+        "lastChangeAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+    metrics.inc("service_renames_queued_total", collection=collection)
+    logger.info("Renommage de %s/%s en attente", collection, service_id)
+
+
+def _oldest(changes: dict[str, dict[str, Any]]) -> datetime | None:
+    dates = [value for services in changes.values() for value in services.values() if isinstance(value, datetime)]
+    return min(dates) if dates else None
+
+
+@firestore.transactional
+def _claim(transaction: Any, pending_ref: Any, now: datetime) -> dict[str, dict[str, Any]]:
+    doc = pending_ref.get(transaction=transaction)
+    data = (doc.to_dict() or {}) if doc.exists else {}
+    changes = {collection: services for collection, services in (data.get("changes") or {}).items() if services}
+    if not changes:
+        return {}
+    last_change = data.get("lastChangeAt")
+    oldest = _oldest(changes)
+    quiet = not isinstance(last_change, datetime) or now - last_change >= timedelta(seconds=RENAME_DEBOUNCE_SECONDS)
+    overdue = oldest is not None and now - oldest >= timedelta(seconds=RENAME_MAX_DELAY_SECONDS)
+    if not quiet and not overdue:
+        return {}
+    transaction.set(pending_ref, {"changes": {}, "lastAppliedAt": firestore.SERVER_TIMESTAMP})
+    return changes
+
+
+def _current_names(db: Any, changes: dict[str, dict[str, Any]]) -> dict[str, dict[str, str]]:
+    """{collection: {service_id: nom actuel}} pour les prestations encore présentes et nommées"""
+    refs = [db.collection(collection).document(service_id)
+            for collection, services in changes.items() if collection in SERVICE_FIELDS
+            for service_id in services]
+    names: dict[str, dict[str, str]] = {}
+    for doc in db.get_all(refs):
+        metrics.count_reads()
+        name = (doc.to_dict() or {}).get("name") if doc.exists else None
+        if name:
+            names.setdefault(doc.reference.parent.id, {})[doc.id] = name
+    return names
+
+
+def rename_customers(db: Any, names: dict[str, dict[str, str]]) -> int:
+    """Applique les noms à tous les clients concernés (une écriture par client), retourne le nombre de clients modifiés"""
+    updates: dict[str, tuple[Any, dict[str, list]]] = {}
+    for collection, services in names.items():
+        ids_field, names_field = SERVICE_FIELDS[collection]
+        service_ids = sorted(services)
+        for start in range(0, len(service_ids), _ARRAY_CONTAINS_ANY_MAX):
+            chunk = service_ids[start:start + _ARRAY_CONTAINS_ANY_MAX]
+            query = db.collection("customers").where(ids_field, "array_contains_any", chunk)
+            for customer_doc in query.select([ids_field, names_field]).stream():
+                metrics.count_reads()
+                data = customer_doc.to_dict() or {}
+                ids = data.get(ids_field) or []
+                current = list(data.get(names_field) or [])
+                renamed = list(current) + [""] * (len(ids) - len(current))
+                for index, service_id in enumerate(ids):
+                    if service_id in services:
+                        renamed[index] = services[service_id]
+                if renamed == current:
+                    continue
+                _, fields = updates.setdefault(customer_doc.reference.path, (customer_doc.reference, {}))
+                fields[names_field] = renamed
+
+    # Écriture par batch (max 500 par batch)
+    pending = list(updates.values())
+    for start in range(0, len(pending), 500):
+        batch = db.batch()
+        for customer_ref, fields in pending[start:start + 500]:
+            batch.update(customer_ref, fields)
+        batch.commit()
+    return len(pending)
+
+
+def apply_service_renames(db: Any, now: datetime | None = None) -> int:
+    """
+    Applique les renommages en attente si le délai de regroupement est écoulé
+    Retourne le nombre de clients modifiés
+    """
+    now = now or datetime.now(timezone.utc)
+    pending_ref = _pending_ref(db)
+    changes = _claim(db.transaction(), pending_ref, now)
+    metrics.count_reads()
+    if not changes:
+        return 0
+    try:
+        names = _current_names(db, changes)
+        updated = rename_customers(db, names)
+    except Exception:
+        # Remis en attente pour le prochain passage (merge : les renommages arrivés entre-temps sont conservés)
+        pending_ref.set({"changes": {collection: {service_id: firestore.SERVER_TIMESTAMP for service_id in services}
+                                     for collection, services in changes.items()}}, merge=True)
+        raise
+    services = sum(len(services) for services in changes.values())
+    metrics.inc("service_renames_applied_total", services)
+    logger.info("%s renommage(s) de prestation appliqué(s) à %s client(s)", services, updated)
+    return updated
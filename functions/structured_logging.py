@@ -0,0 +1,90 @@
+"""
+Logging structuré (JSON) pour les Cloud Functions Harmonya
+
+Chaque ligne écrite sur stdout est un objet JSON que Cloud Logging interprète
+directement (champs "severity" et "message"). La configuration est faite une
+seule fois par instance, à l'import du module.
+
+Le niveau est contrôlé par la variable d'environnement LOG_LEVEL (INFO par défaut).
+Les appels logger.debug(...) utilisent le formatage paresseux de `logging` :
+quand DEBUG est désactivé, le message n'est jamais construit.
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+
+# Champs de contexte ajoutés à chaque ligne de log (function, document_id, attempt...)
+_log_context: contextvars.ContextVar[dict[str, Any]] = contextvars.ContextVar("log_context", default={})
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Formate un LogRecord en une ligne JSON compatible Cloud Logging"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: dict[str, Any] = {
+            "severity": record.levelname,
+            "message": record.getMessage(),
+            "logger": record.name,
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+        }
+        entry.update(_log_context.get())
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging() -> None:
+    """Configure le logger racine "harmonya" (idempotent)"""
+    global _configured
+    if _configured:
+        return
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        root = logging.getLogger("harmonya")
+        root.handlers = [handler]
+        root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+        # Ne pas dupliquer les lignes via le logger racine du runtime
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Retourne un logger enfant de "harmonya" (ex: get_logger("main"))"""
+    configure_logging()
+    return logging.getLogger(f"harmonya.{name}")
+
+
+def current_context() -> dict[str, Any]:
+    """Retourne une copie des champs de contexte de l'invocation courante"""
+    return dict(_log_context.get())
+
+
+@contextlib.contextmanager
+def log_context(**fields: Any) -> Iterator[None]:
+    """
+    Ajoute des champs de contexte aux logs émis dans le bloc
+    Exemple: with log_context(attempt=2): logger.warning("Rate limit")
+    """
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
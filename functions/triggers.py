@@ -0,0 +1,193 @@
+"""
+Outils communs aux triggers Firestore
+
+`CollectionDispatcher` regroupe les handlers d'une collection (created,
+updated, deleted) derrière une seule fonction déployée on_document_written :
+moins de fonctions, donc moins d'instances et de démarrages à froid.
+TRIGGER_DISPATCH choisit le déploiement :
+- "collection" (défaut) : une fonction par collection, qui route vers les handlers
+- "separate" : chaque handler est déployé comme sa propre fonction, comme avant
+
+`watch_fields` filtre les triggers on_document_updated (et on_document_written,
+une création ou une suppression comptant comme un changement) : seuls les champs
+surveillés sont comparés entre before et after (snapshot.get, sans
+désérialiser tout le document) et la fonction n'est appelée que si l'un
+d'eux a changé. Les événements ignorés et traités sont comptés dans
+"trigger_events_total" (labels function et outcome=skipped|processed),
+ce qui donne le taux d'invocations inutiles par fonction.
+
+`skip_imported` ignore les écritures faites par l'import en masse
+(bulk_import.py) : documents marqués imported=true dont importedAt vient
+d'être écrit. Les modifications faites ensuite depuis l'application sont
+traitées normalement (outcome=imported dans "trigger_events_total").
+"""
+
+import copy
+import dataclasses
+import functools
+import os
+from typing import Any, Callable
+
+import metrics
+from structured_logging import get_logger
+
+logger = get_logger("triggers")
+
+TRIGGER_DISPATCH = os.environ.get("TRIGGER_DISPATCH", "collection").lower()
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+WRITTEN = "written"
+
+
+def _field_value(snapshot: Any, field: str) -> Any:
+    """Valeur d'un champ (chemin "a.b" accepté), None s'il est absent"""
+    if snapshot is None:
+        return None
+    try:
+        return snapshot.get(field)
+    except KeyError:
+        return None
+
+
+def changed_fields(event: Any, fields: tuple[str, ...]) -> list[str]:
+    """Champs surveillés dont la valeur diffère entre before et after"""
+    change = event.data
+    if change is None:
+        return list(fields)
+    return [
+        field for field in fields
+        if _field_value(change.before, field) != _field_value(change.after, field)
+    ]
+
+
+def watch_fields(*fields: str) -> Callable[[Callable[[Any], None]], Callable[[Any], None]]:
+    """
+    Décorateur des triggers on_document_updated ou on_document_written : n'appelle
+    la fonction que si l'un des champs `fields` a changé (à placer sous @instrumented)
+
+        @firestore_fn.on_document_updated(document="bookings/{bookingId}", ...)
+        @instrumented
+        @watch_fields("status")
+        def send_booking_status_email(event): ...
+    """
+
+    def decorator(func: Callable[[Any], None]) -> Callable[[Any], None]:
+        function_name = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(event: Any) -> None:
+            if not changed_fields(event, fields):
+                metrics.inc("trigger_events_total", function=function_name, outcome="skipped")
+                logger.debug("%s ignoré : aucun champ surveillé modifié (%s)", function_name, ", ".join(fields))
+                return None
+            metrics.inc("trigger_events_total", function=function_name, outcome="processed")
+            return func(event)
+
+        wrapper.watched_fields = fields
+        return wrapper
+
+    return decorator
+
+
+def is_import_write(event: Any) -> bool:
+    """
+    Indique si l'événement vient de l'import en masse : document créé avec
+    imported=true, ou mis à jour avec un nouvel importedAt (reprise d'import)
+    """
+    data = event.data
+    if data is None:
+        return False
+    after = getattr(data, "after", data)
+    if _field_value(after, "imported") is not True:
+        return False
+    before = getattr(data, "before", None)
+    return before is None or _field_value(before, "importedAt") != _field_value(after, "importedAt")
+
+
+def skip_imported(func: Callable[[Any], None]) -> Callable[[Any], None]:
+    """
+    Décorateur des triggers de création et de mise à jour : n'appelle pas la
+    fonction pour les écritures de l'import en masse (à placer sous @instrumented)
+    """
+    function_name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(event: Any) -> None:
+        if is_import_write(event):
+            metrics.inc("trigger_events_total", function=function_name, outcome="imported")
+            return None
+        return func(event)
+
+    return wrapper
+
+
+def _with_data(event: Any, data: Any) -> Any:
+    """Copie de l'événement avec un autre contenu pour `data`"""
+    if dataclasses.is_dataclass(event):
+        return dataclasses.replace(event, data=data)
+    routed = copy.copy(event)
+    routed.data = data
+    return routed
+
+
+class CollectionDispatcher:
+    """
+    Handlers d'une collection, appelés par un seul trigger on_document_written
+
+        bookings = CollectionDispatcher("bookings")
+
+        @bookings.handler(CREATED, firestore_fn.on_document_created(document="bookings/{bookingId}", ...))
+        @instrumented
+        def send_booking_email(event): ...
+
+    Chaque handler reçoit l'événement sous la forme qu'il recevrait s'il était
+    déployé seul : DocumentSnapshot pour created/deleted, Change pour updated.
+    Les handlers WRITTEN reçoivent l'événement on_document_written tel quel,
+    pour toute création, mise à jour ou suppression.
+    """
+
+    def __init__(self, collection: str):
+        self.collection = collection
+        self._handlers: dict[str, list[Callable[[Any], None]]] = {CREATED: [], UPDATED: [], DELETED: [], WRITTEN: []}
+
+    @property
+    def dispatching(self) -> bool:
+        return TRIGGER_DISPATCH != "separate"
+
+    def handler(self, event_type: str, deploy: Callable[[Callable], Any]) -> Callable[[Callable], Any]:
+        """
+        Enregistre la fonction pour `event_type` ; en mode "separate", la déploie
+        aussi avec `deploy` (décorateur firestore_fn.on_document_*)
+        """
+
+        def decorator(func: Callable[[Any], None]) -> Any:
+            self._handlers[event_type].append(func)
+            if self.dispatching:
+                return func
+            return deploy(func)
+
+        return decorator
+
+    def dispatch(self, event: Any) -> None:
+        """Route un événement on_document_written vers les handlers concernés"""
+        change = event.data
+        before = getattr(change, "before", None)
+        after = getattr(change, "after", None)
+        if before is None and after is not None:
+            event_type, data = CREATED, after
+        elif before is not None and after is None:
+            event_type, data = DELETED, before
+        else:
+            event_type, data = UPDATED, change
+        metrics.inc("dispatched_events_total", collection=self.collection, event=event_type)
+        routed = _with_data(event, data)
+        handlers = [(handler, routed) for handler in self._handlers[event_type]]
+        handlers += [(handler, event) for handler in self._handlers[WRITTEN]]
+        for handler, handler_event in handlers:
+            # Chaque handler gère ses propres erreurs ; une exception ne doit pas priver les suivants
+            try:
+                handler(handler_event)
+            except Exception:
+                logger.exception("Erreur dans le handler %s (%s/%s)", handler.__name__, self.collection, event_type)